@@ -0,0 +1,170 @@
+"""
+Offline throughput benchmark. Starts a local mock Particle endpoint (utils/mock_rpc.py) in its own
+process and drives either a full `file_list_main` scan or raw `ParticleApi.get_tokens` calls against
+it, then reports wallets/s, requests/s, client side p50/p99 request latency and the client's peak RSS.
+
+    python bench.py scan --wallets 2000 --latency 30 --error-rate 0.01 --max-concurrent 64
+    python bench.py api --calls 20000 --concurrency 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import secrets
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+
+import main
+from utils import transport
+from utils.color_print import ColorPrint
+from utils.mock_rpc import LATENCY_DISTRIBUTIONS, MockProcess
+
+
+class LatencyRecorder:
+    def __init__(self):
+        """
+        Client side latency of every HTTP request sent through the shared transport, collected
+        with httpx event hooks so nothing in the code under test has to change
+        """
+        self.started: dict[int, float] = {}
+        self.samples: list[float] = []
+
+    async def on_request(self, request: httpx.Request):
+        self.started[id(request)] = time.perf_counter()
+
+    async def on_response(self, response: httpx.Response):
+        started = self.started.pop(id(response.request), None)
+        if started is not None:
+            self.samples.append(time.perf_counter() - started)
+
+    def install(self, client: httpx.AsyncClient):
+        client.event_hooks['request'].append(self.on_request)
+        client.event_hooks['response'].append(self.on_response)
+
+    def percentile(self, p: float) -> float:
+        if not self.samples:
+            return 0.0
+        if len(self.samples) == 1:
+            return self.samples[0]
+        return statistics.quantiles(self.samples, n=100, method='inclusive')[int(p) - 1]
+
+
+def peak_rss_mb() -> float:
+    # this process only, the mock server runs in a child which RUSAGE_SELF does not count
+    # ru_maxrss is in kilobytes on linux, bytes on macos
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def write_keys(path: str, count: int):
+    with open(path, 'w') as f:
+        for _ in range(count):
+            f.write(secrets.token_hex(32) + '\n')
+
+
+async def bench_scan(_args: argparse.Namespace, server: MockProcess, recorder: LatencyRecorder,
+                     workdir: str) -> dict:
+    keys = os.path.join(workdir, 'keys.txt')
+    write_keys(keys, _args.wallets)
+    recorder.install(transport.get_client())
+    started = time.perf_counter()
+    await main.file_list_main(keys, _args.chain_id, os.path.join(workdir, 'report.json'), _args.batch,
+                              _args.concurrency, main.cp, rpc_batch=_args.rpc_batch,
+                              rpc_batch_window=_args.rpc_batch_window / 1000, adaptive=not _args.no_adaptive,
+                              max_per_chain=_args.max_per_chain,
+                              filter_scams=False, prefilter_mode=_args.prefilter, base_url=server.url)
+    elapsed = time.perf_counter() - started
+    return {'wallets': _args.wallets, 'elapsed': elapsed, 'wallets_per_sec': _args.wallets / elapsed}
+
+
+async def bench_api(_args: argparse.Namespace, server: MockProcess, recorder: LatencyRecorder) -> dict:
+    api = main.ParticleApi('bench', 'bench', _args.rpc_batch, _args.rpc_batch_window / 1000,
+                           not _args.no_adaptive, _args.batch, base_url=server.url)
+    recorder.install(api.client)
+    sem = asyncio.Semaphore(_args.concurrency)
+    chains = [c for c, _ in main.data.constants.PARTICLE_SUPPORTED] if _args.chain_id == 0 else [_args.chain_id]
+
+    async def one(i: int):
+        async with sem:
+            await api.get_tokens('0x' + secrets.token_hex(20), chains[i % len(chains)])
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*[one(i) for i in range(_args.calls)])
+    finally:
+        await transport.aclose()
+    elapsed = time.perf_counter() - started
+    return {'wallets': _args.calls, 'elapsed': elapsed, 'wallets_per_sec': _args.calls / elapsed}
+
+
+def cli_args() -> argparse.Namespace:
+    _args = argparse.ArgumentParser(description='Benchmark the scanner against a local mock Particle endpoint')
+    _args.add_argument('mode', choices=('scan', 'api'), help='full file_list scan, or raw ParticleApi calls')
+    _args.add_argument('--wallets', type=int, default=1000, help='scan mode: number of random keys')
+    _args.add_argument('--calls', type=int, default=10000, help='api mode: number of get_tokens calls')
+    _args.add_argument('--chain-id', type=int, default=0, help='chain to scan, 0 for every supported chain')
+    _args.add_argument('-b', '--batch', type=int, default=20, help='max wallets in flight per chain')
+    _args.add_argument('-c', '--concurrency', type=int, default=100, help='max requests in flight')
+    _args.add_argument('--rpc-batch', type=int, default=20, help='JSON-RPC batch size (0 to disable)')
+    _args.add_argument('--rpc-batch-window', type=float, default=5, help='milliseconds to fill a batch')
+    _args.add_argument('--max-per-chain', type=int, default=64, help='ceiling of the adaptive per chain limit')
+    _args.add_argument('--no-adaptive', action='store_true', help='disable the adaptive limiter')
+    _args.add_argument('--prefilter', choices=('off', 'any', 'nonce'), default='off')
+    _args.add_argument('--latency', type=float, default=20, help='mock: mean service time in milliseconds')
+    _args.add_argument('--latency-dist', choices=LATENCY_DISTRIBUTIONS, default='lognormal')
+    _args.add_argument('--error-rate', type=float, default=0.0, help='mock: fraction of requests failing with 500')
+    _args.add_argument('--max-concurrent', type=int, default=0, help='mock: answer 429 above this many in flight')
+    _args.add_argument('--hit-rate', type=float, default=0.05, help='mock: fraction of wallets holding tokens')
+    _args.add_argument('--seed', type=int, default=None)
+    _args.add_argument('--json', type=str, default=None, help='also write the results to this file')
+    return _args.parse_args()
+
+
+async def run(_args: argparse.Namespace) -> dict:
+    server = MockProcess(latency=_args.latency / 1000, latency_dist=_args.latency_dist,
+                         error_rate=_args.error_rate, max_concurrent=_args.max_concurrent,
+                         hit_rate=_args.hit_rate, seed=_args.seed).start()
+    recorder = LatencyRecorder()
+    try:
+        with tempfile.TemporaryDirectory(prefix='particle-bench-') as workdir:
+            if _args.mode == 'scan':
+                ret = await bench_scan(_args, server, recorder, workdir)
+            else:
+                ret = await bench_api(_args, server, recorder)
+    finally:
+        stats = server.stop()
+    ret.update({
+        'http_requests': stats.requests,
+        'rpc_calls': stats.calls,
+        'requests_per_sec': stats.requests / ret['elapsed'],
+        'calls_per_sec': stats.calls / ret['elapsed'],
+        'statuses': stats.statuses,
+        'methods': stats.methods,
+        'latency_p50_ms': recorder.percentile(50) * 1000,
+        'latency_p99_ms': recorder.percentile(99) * 1000,
+        'peak_rss_mb': peak_rss_mb(),
+    })
+    return ret
+
+
+if __name__ == '__main__':
+    args = cli_args()
+    main.cp = ColorPrint(0)
+    main.args = args
+    main.project_id = main.project_server_key = 'bench'
+    results = asyncio.run(run(args))
+    main.cp.output('%s wallets in %.2fs: %.1f wallets/s' % (results['wallets'], results['elapsed'],
+                                                             results['wallets_per_sec']))
+    main.cp.output('%s HTTP requests (%.1f/s), %s JSON-RPC calls (%.1f/s), statuses %s' % (
+        results['http_requests'], results['requests_per_sec'], results['rpc_calls'], results['calls_per_sec'],
+        results['statuses']))
+    main.cp.output('Latency p50 %.1fms, p99 %.1fms' % (results['latency_p50_ms'], results['latency_p99_ms']))
+    main.cp.output('Peak client RSS %.1f MB' % results['peak_rss_mb'])
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
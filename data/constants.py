@@ -1,10 +1,20 @@
 import json
+import os
 from typing import Union
 
 import web3
 from hexbytes import HexBytes
 
 NULL_KEY = '0x' + '0' * 64
+PARTICLE_RPC_URL = 'https://rpc.particle.network/evm-chain'
+# resolved from this file, so the scanner can be started from any directory
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+TOKENS_DB = os.path.join(DATA_DIR, 'tokens.db')
+# runtime caches (derived addresses, prices, token metadata, chain stats), kept out of the tracked tokens db
+CACHE_DB = os.path.join(DATA_DIR, 'cache.db')
+SCAM_TOKENS_FILE = os.path.join(DATA_DIR, 'scam_tokens.json')
+USER_SCAM_FILE = os.path.join(DATA_DIR, 'user_scam.lst')
+SCAM_FILTER_CACHE = os.path.join(DATA_DIR, 'scam_filter.bin')
 ZERO_ADDRESS = '0x' + '0' * 40
 NULL_ADDRESS = '0x' + 'f' * 40
 ANON_KEY_BYTES = b'cf2f7f0f9cbf631adefffe63f9b666e1e01628d6350a80545570ce53ab7bc96a'
@@ -11,6 +11,7 @@ from typing import Union, Any
 import dotenv
 import httpcore
 import httpx
+import numpy as np
 import tqdm
 import tqdm.asyncio
 from eth_typing import ChecksumAddress
@@ -19,9 +20,26 @@ from eth_utils import to_checksum_address
 import data.constants
 
 from data.constants import ZERO_ADDRESS
-from utils import helpers, custom_logger
+from utils import helpers, custom_logger, metrics, transport
+from utils.chain_stats import ChainStats
+from utils.checkpoint import CheckpointLog
 from utils.color_print import ColorPrint
-from utils.helpers import async_load_eth_keys, Acct
+from utils.holdings import HoldingsStore
+from utils.helpers import async_load_eth_keys, async_iter_eth_keys, Acct
+from utils.key_cache import KeyCache
+from utils.key_derivation import KeyDeriver
+from utils.limiter import LimiterRegistry
+from utils.prefilter import ActivityPrefilter, MODES as prefilter_modes
+from utils.price_broker import PriceBroker
+from utils.price_cache import PriceCache
+from utils.retry import RetryEngine
+from utils.scam_filter import ScamFilter
+from utils.result_writer import write_json_array
+from utils.rpc_batch import RpcBatcher
+from utils.scheduler import ChainScheduler
+from utils.storage import SqliteStore
+from utils.token_registry import TokenRegistry
+from utils.valuation import Valuation, report_entries, value_holdings
 
 cp = None
 
@@ -90,19 +108,37 @@ class TokenPrice:
 
 
 class ScanSession:
-    def __init__(self, output_file: str = None, accounts: list[Acct] = None, verbosity: int = 0):
+    def __init__(self, output_file: str = None, accounts: list[Acct] = None, verbosity: int = 0,
+                 scan_log: str = None, store: SqliteStore = None, registry: TokenRegistry = None,
+                 price_ttl: float = 600):
+        """
+        :param output_file: json report
+        :param accounts: accounts to pre-register (legacy, wallets are added as results land)
+        :param verbosity: output verbosity
+        :param scan_log: NDJSON scan log, with one the report lists every (wallet, chain) entry
+        :param store: optional sqlite store every wallet result is also persisted to
+        :param registry: token metadata registry (a private in memory one is used otherwise)
+        :param price_ttl: seconds a price is fresh for, the same ttl the price broker and cache use
+        """
         self.verbosity = verbosity
+        self.price_ttl = price_ttl
+        self.scan_log = scan_log
+        self.store = store
         self.initiated = time.time().__str__()
         self.output_file = output_file if output_file is not None else f'scan_{self.initiated}.json'
-        self.acct_map = {}
+        self.registry = registry if registry is not None else TokenRegistry()
+        self.holdings = HoldingsStore(self.registry)
+        self.valuation = Valuation.empty()
+        self.price_table = np.zeros(0, dtype=np.float64)
         self.native_prices: dict[int, TokenPrice] = {}
         self.token_prices: dict[int, dict[Union[str, ChecksumAddress], TokenPrice]] = {}
         self._acct_list = accounts
         self._accounts: list[Acct] = []
 
     @classmethod
-    async def create(cls, output_file: str, accounts: list[Acct]):
-        session = cls(output_file, accounts)
+    async def create(cls, output_file: str, accounts: list[Acct], scan_log: str = None, store: SqliteStore = None,
+                     registry: TokenRegistry = None, price_ttl: float = 600):
+        session = cls(output_file, accounts, scan_log=scan_log, store=store, registry=registry, price_ttl=price_ttl)
         # await session.initialize_accounts()
         return session
 
@@ -116,36 +152,56 @@ class ScanSession:
         cp.notice('Creating account dict')
         for acct in accts:
             if acct is not None:
-                self.acct_map[acct.address] = {'key': acct.key.hex().__str__(), 'tokens': []}
+                self.holdings.add_address(acct.address, acct.key.hex().__str__())
+        self.init_chains(_cids)
+
+    def init_chains(self, _cids: list[int]):
         for c in _cids:
-            self.token_prices[c] = {}
+            self.token_prices.setdefault(c, {})
+
+    def slim_result(self, tokens_ret: dict, _cid: int) -> dict:
+        """
+        Intern the token metadata of a `particle_getTokens` result into the registry and strip it
+        from the result, so per wallet records only carry address, amount and decimals. Tokens
+        reporting impossible decimals are dropped, they cannot be valued.
+        """
+        tokens = []
+        for token in tokens_ret.get('tokens'):
+            decimals = token.get('decimals')
+            try:
+                self.registry.register(_cid, token.get('address'), int(decimals) if decimals is not None else None,
+                                       token.get('symbol'), token.get('name'))
+            except ValueError:
+                continue
+            tokens.append({'address': token.get('address'), 'amount': token.get('amount'), 'decimals': decimals})
+        return {'native': tokens_ret.get('native'), 'tokens': tokens}
 
     async def update_wallet(self, data_: dict, _cid: int):
+        """
+        Append a wallet result to the holdings store, one row per token held (plus the native asset)
+        """
         _cid = int(_cid)
-        # print('[debug] update wallet %s' % data_)
-        # _cid = data_.get('cid')
         __data = data_.get('result')
         native_amount = int(__data.get('native'))
-        tokens = __data.get('tokens')
-
         addr = data_['address']
-        # print('updating acct %s' % addr)
-        # print('native: ', native_amount)
-        # print('tokens: ', tokens)
-        if self.acct_map.get(addr):
-            # print('found addr: %s ' % addr)
-
-            # print('tokens: ', self.acct_map[addr].get('tokens'))
-            if int(native_amount) > 0:
-                tokens.append({'address': ZERO_ADDRESS, 'amount': native_amount, 'cid': _cid})
-            if len(tokens):
-                self.acct_map[addr]['tokens'].extend(tokens)
-        #  print('acct_map_tokens', self.acct_map[addr]['tokens'])
+        key = data_.get('key')
+        if native_amount > 0:
+            self.holdings.add(addr, key, _cid, ZERO_ADDRESS, native_amount, 18)
+        for token in __data.get('tokens'):
+            amount = int(token.get('amount'))
+            if amount > 0:
+                self.holdings.add(addr, key, _cid, token.get('address'), amount, int(token.get('decimals') or 0))
+        if self.store is not None:
+            self.store.write(data_, _cid)
+        metrics.WALLET_WRITES.inc(_cid)
+        metrics.HOLDINGS_ROWS.set(value=len(self.holdings))
 
     async def set_token_prices(self, price_list: list[TokenPrice]):
         def needs_update(tp: TokenPrice):
-            if self.token_prices.get(tp.chain_id).get(tp.address):
-                return not tp.updated >= time.time() - 600
+            held = self.token_prices.setdefault(tp.chain_id, {}).get(tp.address)
+            if held:
+                # the held price is replaced once it is older than the ttl the broker re-prices on
+                return held.updated < time.time() - self.price_ttl
             else:
                 return True
 
@@ -163,11 +219,7 @@ class ScanSession:
                 # self.token_prices.update({ZERO_ADDRESS: _price_native})
             else:
                 # print(price, type(price))
-                if self.token_prices.get(price.chain_id) is {}:
-                    self.token_prices[price.chain_id] = {to_checksum_address(price.address): price}
-                else:
-                    self.token_prices[price.chain_id].update({to_checksum_address(price.address): price})
-                    # self.token_prices.update({price.chain_id: })
+                self.token_prices.setdefault(price.chain_id, {}).update({to_checksum_address(price.address): price})
 
     async def get_token_price(self, token: ChecksumAddress, _chain_id=None) -> tuple[float, int]:
         if token == 'native' or token == ZERO_ADDRESS:
@@ -181,83 +233,96 @@ class ScanSession:
                 return self.token_prices[_chain_id].get(token).price, _chain_id
         return 0, 0
 
+    def _price_of(self, token: str, _chain_id: int) -> float:
+        if token == 'native' or token == ZERO_ADDRESS:
+            native = self.native_prices.get(_chain_id)
+            return float(native.price) if native is not None else 0.0
+        price = self.token_prices.get(_chain_id, {}).get(to_checksum_address(token))
+        return float(price.price) if price is not None else 0.0
+
     async def calculate_values(self, ):
-        count = 0
-        final_report = {}
-        report_copy = self.acct_map.copy()
+        """
+        Value every holding in one vectorized pass (see utils.valuation), prices are looked up once
+        per interned token and the array math runs off the event loop
+        :return: per address totals
+        """
         cp.notice('Calculating dollar values ... ')
-        for address, __data in self.acct_map.items():
-            # print(address, __data)
-            key = __data['key']
-            tokens = __data['tokens']
-            # cid = __data['cid']
-            cp.output('address: %s , data: %s, ' % (address, __data))
-
-            for x, token in enumerate(tokens):
-                if token.get('address') in ['native', ZERO_ADDRESS]:
-                    eth = int(token.get('amount'))
-                    cid = int(token.get('cid'))
-
-                    if eth > 0:
-                        price, nada = await self.get_token_price(ZERO_ADDRESS, token['cid'])
-                        count += 1
-                        bal = int(eth) / (10 ** 18)
-                        token_value = float(price) * bal
-                        report_copy[address]['tokens'][x].update({'price': price,
-                                                                  'balance': bal,
-                                                                  'value': token_value,
-                                                                  'cid': cid})
-                        entry = report_copy[address]['tokens'][x]
-                        entry['key'] = key
-                        final_report.update({address: entry})
-                else:
-                    raw_balance = int(token.get('amount'))
-                    if raw_balance > 0:
-                        price, nothing = await self.get_token_price(token.get('address'), token.get('cid'))
-                        cid = token.get('cid')
-                        count += 1
-                        decimals = int(token.get('decimals'))
-                        human_bal = raw_balance / (10 ** decimals)
-                        token_value = human_bal * price
-                        report_copy[address]['tokens'][x].update(
-                            {'price': float(price), 'balance': human_bal, 'value': token_value, 'cid': cid}),
-                        entry = report_copy[address]['tokens'][x]
-                        entry['key'] = key
-                        final_report.update({address: entry})
-        self.acct_map = final_report
-        return final_report
+        store = self.holdings
+        # the registry may know far more tokens than this scan holds, only price the held ones
+        token_prices = np.zeros(len(store.tokens), dtype=np.float64)
+        for t in np.unique(np.frombuffer(store.token_idx, dtype=np.uint32)):
+            cid, token = store.tokens[t]
+            token_prices[t] = self._price_of(token, cid)
+        self.price_table = token_prices
+        self.valuation = await asyncio.to_thread(value_holdings, store, token_prices)
+        for a in np.flatnonzero(self.valuation.address_rows):
+            total = float(self.valuation.address_totals[a])
+            cp.item('address: %s , value: %s', store.addresses[a], total, value=total)
+        for c, total in enumerate(self.valuation.chain_totals):
+            cp.notice('Chain %s total value: %s', store.chains[c], total)
+        return self.report
 
     async def finalize(self):
-        report_copy = await self.calculate_values()
-        self.report_setter(report_copy)
+        await self.calculate_values()
         await self.dump()
         return self.report
 
     async def dump(self):
+        """
+        Write the report from the HoldingsStore and its Valuation. With a scan log every (wallet, chain)
+        entry is streamed out off the event loop, balances and values taken from the valuation and prices
+        from the table it was computed with, otherwise the {address: key, value} map is dumped.
+        """
         await asyncio.sleep(0)
-        await helpers.async_dump_json(self.output_file, self.acct_map)
+        if self.scan_log is not None:
+            entries = report_entries(self.holdings, self.valuation, self.price_table)
+            count = await asyncio.to_thread(write_json_array, self.output_file, entries)
+            cp.notice('Wrote %s wallet entries to %s' % (count, self.output_file))
+        else:
+            await helpers.async_dump_json(self.output_file, self.report)
 
     @property
-    def report(self):
-        return json.loads(json.dumps(self.acct_map))
-
-    def report_setter(self, report: dict):
-        setattr(self, 'acct_map', report)
+    def report(self) -> dict:
+        """
+        :return: {address: {'key', 'value'}} for every wallet that holds something
+        """
+        store = self.holdings
+        totals = self.valuation.address_totals
+        return {store.addresses[a]: {'key': store.keys[a], 'value': float(totals[a])}
+                for a in np.flatnonzero(self.valuation.address_rows)}
 
 
 TASKS = set()
 
 
 class ParticleApi:
-    def __init__(self, _project_id: str, _project_server_key: str):
+    def __init__(self, _project_id: str, _project_server_key: str, batch_size: int = 0, batch_window: float = 0.005,
+                 adaptive: bool = True, max_concurrency: int = 64, retry: RetryEngine = None,
+                 base_url: str = data.constants.PARTICLE_RPC_URL, limiters: LimiterRegistry = None):
+        """
+        :param _project_id: particle project id
+        :param _project_server_key: particle server key
+        :param batch_size: coalesce up to this many concurrent calls per chain into one JSON-RPC batch (0 disables)
+        :param batch_window: seconds to wait for a batch to fill before sending it
+        :param adaptive: feed 429s, 5xx and transport errors to per chain AIMD limiters as congestion
+        :param max_concurrency: ceiling for the adaptive limiters, when they are not supplied
+        :param retry: retry policy, budget and per chain circuit breakers (a default one is created)
+        :param base_url: evm-chain rpc endpoint (ie a local mock server for benchmarks)
+        :param limiters: shared limiters, the scheduler gates (wallet, chain) units on the same ones
+        """
         self.project_id = _project_id
         self.project_server_key = _project_server_key
-        self.base_url = f"https://rpc.particle.network/evm-chain"
+        self.base_url = base_url
         self.headers = {'Content-Type': 'application/json'}
-        self.auth = (_project_id, _project_server_key)
-        self.client = httpx.AsyncClient(auth=self.auth, headers=self.headers)
+        self.auth = httpx.BasicAuth(_project_id or '', _project_server_key or '')
+        self.client = transport.get_client()
         self.price_map: dict[int, TokenPrice] = {}
         self.logger: logging.Logger = self.setup_logger
+        self.batcher = RpcBatcher(self._send, batch_size, batch_window) if batch_size > 1 else None
+        if limiters is None and adaptive:
+            limiters = LimiterRegistry(max_limit=max_concurrency)
+        self.limiters = limiters
+        self.retry = retry if retry is not None else RetryEngine()
 
     @property
     def setup_logger(self):
@@ -266,48 +331,103 @@ class ParticleApi:
     def get_url_by_chain_id(self, _chain_id: int):
         return self.base_url + f"?chainId={_chain_id}"
 
-    async def make_request(self, _chain_id: int, method: str, params: list[Any] = [],
-                           sleep_for_attempt: float = 1.5) -> Any:
-        ret_val = None
-        sleep_for_attempt += sleep_for_attempt
+    async def _send(self, _chain_id: int, payload: Union[dict, list[dict]]) -> Union[dict, list[dict], None]:
+        """
+        POST a single payload or a batch array
+        :return: decoded json, None on a 429 or 5xx (worth retrying), or a JSON-RPC error object for
+                 any other bad status: the endpoint refused the call itself and will do so again
+        """
+        # the limiters gate whole units in the scheduler, requests only report congestion to them
+        try:
+            response = await self.client.post(self.get_url_by_chain_id(_chain_id), json=payload, auth=self.auth,
+                                              headers=self.headers)
+        except httpx.TransportError:
+            if self.limiters is not None:
+                self.limiters.get(self.base_url, _chain_id).congestion()
+            raise
+        if self.limiters is not None and (response.status_code == 429 or response.status_code >= 500):
+            self.limiters.get(self.base_url, _chain_id).congestion()
+        metrics.HTTP_RESPONSES.inc(_chain_id, response.status_code)
+        if response.status_code == 200:
+            return response.json()
+        self.logger.error('Http Status %s' % response.status_code)
+        if response.status_code == 429 or response.status_code >= 500:
+            return None
+        return {'jsonrpc': '2.0', 'id': payload.get('id') if isinstance(payload, dict) else None,
+                'error': {'code': response.status_code, 'message': 'Http Status %s' % response.status_code}}
+
+    async def make_request(self, _chain_id: int, method: str, params: list[Any] = []) -> Any:
+        """
+        Make a JSON-RPC call, retrying transport errors, 429s and 5xx with jittered exponential backoff
+        while the global retry budget allows it. Only those count against the chain's circuit breaker,
+        calls to a chain whose breaker is open fail fast.
+        :return: the `result` field, or None if the call was dropped
+        """
+        breaker = self.retry.breaker(_chain_id)
         payload = {
             "jsonrpc": "2.0",
             "method": method,
             "params": params,
             "id": 1,
         }
-        for x in range(3):
+        self.retry.budget.deposit()
+        started = time.monotonic()
+        for attempt in range(self.retry.policy.max_attempts):
+            if not breaker.allow():
+                self.retry.stats.short_circuit(_chain_id)
+                metrics.REQUESTS.inc(_chain_id, method, 'short_circuit')
+                return None
             try:
-                response = await self.client.post(self.get_url_by_chain_id(_chain_id), json=payload)
-            except (httpx.ReadTimeout, httpx.ReadError) as err:
-                self.logger.error('Http Error making request: %s, sleeping for %s' % (err, sleep_for_attempt))
-                await asyncio.sleep(sleep_for_attempt)
-            except (httpx.ConnectTimeout, httpx.HTTPStatusError, httpcore.ConnectError) as err:
-                self.logger.error('Http conn timeout: %s' % err)
-                await asyncio.sleep(sleep_for_attempt)
+                if self.batcher is not None:
+                    resp = await self.batcher.call(_chain_id, method, params)
+                else:
+                    resp = await self._send(_chain_id, payload)
+            except (httpx.TimeoutException, httpx.ReadError) as err:
+                self.logger.error('Http Error making request: %s (%s/%s)' % (err, attempt + 1,
+                                                                            self.retry.policy.max_attempts))
+            except (httpx.HTTPStatusError, httpx.TransportError, httpcore.ConnectError) as err:
+                self.logger.error('Http conn error: %s (%s/%s)' % (err, attempt + 1, self.retry.policy.max_attempts))
             except Exception as err:
-                self.logger.error(f'Unknown exception: %s, sleeping for %s' % (err, sleep_for_attempt))
-                await asyncio.sleep(sleep_for_attempt)
+                self.logger.error('Unknown exception: %s (%s/%s)' % (err, attempt + 1, self.retry.policy.max_attempts))
             else:
-                if response.status_code == 200:
-                    ret_val = response.json().get('result')
-                else:
-                    self.logger.error('Http Status %s' % response.status_code)
-            finally:
-                if ret_val:
-                    return ret_val
-                if sleep_for_attempt > 1.3:
-                    return None
-                return await self.make_request(_chain_id, method, params, sleep_for_attempt)
+                if resp is not None:
+                    if resp.get('error') is not None:
+                        # the node answered, retrying the same call will not change its mind, and a
+                        # bad address or unsupported method says nothing about the chain's health
+                        self.logger.error('RPC error on chain %s: %s' % (_chain_id, resp.get('error')))
+                        breaker.record_success()
+                        self.retry.stats.drop(_chain_id)
+                        metrics.REQUESTS.inc(_chain_id, method, 'rpc_error')
+                        metrics.REQUEST_SECONDS.observe(time.monotonic() - started, _chain_id, method)
+                        return None
+                    breaker.record_success()
+                    metrics.REQUESTS.inc(_chain_id, method, 'ok')
+                    metrics.REQUEST_SECONDS.observe(time.monotonic() - started, _chain_id, method)
+                    return resp.get('result')
+            breaker.record_failure()
+            if not self.retry.should_retry(_chain_id, attempt):
+                break
+            metrics.RETRIES.inc(_chain_id, method)
+            await asyncio.sleep(self.retry.policy.backoff(attempt))
+        self.retry.stats.drop(_chain_id)
+        metrics.REQUESTS.inc(_chain_id, method, 'dropped')
+        metrics.DROPS.inc(_chain_id, method)
+        metrics.REQUEST_SECONDS.observe(time.monotonic() - started, _chain_id, method)
+        return None
 
     async def eth_get_block(self, _chain_id: int, block: Union[int, str]):
         return await self.make_request(_chain_id, 'eth_getBlockByNumber', [block])
 
     async def eth_get_balance(self, addresses: list[Union[str, ChecksumAddress]], _chain_id: int):
-        return int(await self.make_request(_chain_id, 'eth_getBalance', [
+        ret = await self.make_request(_chain_id, 'eth_getBalance', [
             addresses,
             "latest",
-        ]), 16)
+        ])
+        return int(ret, 16) if ret is not None else None
+
+    async def eth_get_transaction_count(self, address: Union[str, ChecksumAddress], _chain_id: int):
+        ret = await self.make_request(_chain_id, 'eth_getTransactionCount', [address, "latest"])
+        return int(ret, 16) if ret is not None else None
 
     async def get_tokens(self, address: Union[str, ChecksumAddress, Union[list[str, ChecksumAddress]]], _chain_id: int):
         if type(address) is not list:
@@ -322,12 +442,12 @@ class ParticleApi:
         result_prices = []
         tokens = list(sorted(set(tokens)))
         ret_dict: list[ChecksumAddress, str] = await self._get_price(tokens, _chain_id)
-        if not ret_dict:
+        if ret_dict is None:
             return None
         else:
             if len(ret_dict):
                 for x, res in enumerate(ret_dict):
-                    cp.debug('Price %s, %s' % (x, res))
+                    cp.debug('Price %s, %s', x, res)
                     if res['address'] in ['native', ZERO_ADDRESS]:
                         address = ZERO_ADDRESS
                         price = res['currencies'][0]['price']
@@ -342,7 +462,45 @@ class ParticleApi:
 
 def cli_args() -> argparse.Namespace:
     _args = argparse.ArgumentParser()
-    _args.add_argument('-b', '--batch', type=int, default=100, help='Probably do not change this')
+    _args.add_argument('-b', '--batch', type=int, default=20,
+                       help='Wallets in flight per chain, where the adaptive limiter starts from when it is on')
+    _args.add_argument('--max-per-chain', type=int, default=64,
+                       help='Ceiling for the adaptive per chain limit of wallets in flight')
+    _args.add_argument('--no-adaptive', action='store_true',
+                       help='Disable the adaptive per chain limiter and keep --batch wallets in flight per chain')
+    _args.add_argument('-c', '--concurrency', type=int, default=100,
+                       help='Max requests in flight across all chains')
+    _args.add_argument('--rpc-batch', type=int, default=20,
+                       help='Coalesce up to this many calls per chain into one JSON-RPC batch (0 to disable). A '
+                            'refused batch is resent as single calls, and batching stops on chains that keep '
+                            'refusing them')
+    _args.add_argument('--rpc-batch-window', type=float, default=5,
+                       help='Milliseconds to wait for a JSON-RPC batch to fill')
+    _args.add_argument('--no-http2', action='store_true', help='Stick to HTTP/1.1 even if h2 is installed')
+    _args.add_argument('--max-connections', type=int, default=200, help='Size of the shared connection pool')
+    _args.add_argument('--rpc-url', type=str, default=data.constants.PARTICLE_RPC_URL,
+                       help='Particle evm-chain rpc endpoint')
+    _args.add_argument('--metrics-file', type=str, default=None,
+                       help='Write run metrics here at the end, as JSON for a .json path, Prometheus text otherwise')
+    _args.add_argument('--metrics-port', type=int, default=None,
+                       help='Serve live metrics on http://127.0.0.1:PORT/metrics (and /metrics.json)')
+    _args.add_argument('--db', type=str, default=data.constants.TOKENS_DB, help='sqlite database for --store')
+    _args.add_argument('--cache-db', type=str, default=data.constants.CACHE_DB,
+                       help='sqlite database for the key, price, token and chain stats caches')
+    _args.add_argument('--no-key-cache', action='store_true', help='Always derive addresses from keys')
+    _args.add_argument('--price-ttl', type=float, default=600, help='Seconds a token price is reused for')
+    _args.add_argument('--price-cache-size', type=int, default=100000,
+                       help='Most prices kept in the persistent price cache')
+    _args.add_argument('--no-price-cache', action='store_true', help='Do not persist prices between runs')
+    _args.add_argument('--no-chain-stats', action='store_true',
+                       help='Neither learn nor use per chain hit rates to order and skip chains')
+    _args.add_argument('--no-scam-filter', action='store_true', help='Keep tokens on the scam token lists')
+    _args.add_argument('--no-token-cache', action='store_true',
+                       help='Do not load or save token metadata in the contracts table')
+    _args.add_argument('--buffer-output', action='store_true',
+                       help='Buffer console output and write it out twice a second')
+    _args.add_argument('--summary', action='store_true',
+                       help='Print periodic totals instead of one line per wallet')
     _args.add_argument('-v', '--verbosity', action='count', default=0, help='Increase the output verbosity')
     subparsers = _args.add_subparsers(dest='command')
     single = subparsers.add_parser('single')
@@ -352,6 +510,16 @@ def cli_args() -> argparse.Namespace:
     file_list.add_argument('file', type=str, help='Name of file or list')
     file_list.add_argument('chain_id', type=int, help='list')
     file_list.add_argument('output_file', type=str, help='json output')
+    file_list.add_argument('--prefilter', choices=prefilter_modes, default='off',
+                           help='Probe nonce and native balance before enumerating tokens: `any` skips wallets '
+                                'with neither, `nonce` also records funded wallets that never sent a '
+                                'transaction with their native balance only')
+    file_list.add_argument('--min-yield', type=float, default=0.0,
+                           help='Skip chains whose hit rate in earlier scans is below this (ie 0.001)')
+    file_list.add_argument('--store', action='store_true',
+                           help='Also persist every wallet result to the accounts/account_tokens tables of --db')
+    file_list.add_argument('--resume', action='store_true',
+                           help='Continue an interrupted scan from its <output_file>.ndjson scan log')
 
     return _args.parse_args()
 
@@ -379,53 +547,95 @@ async def log_result(out_file: str, _result: Union[dict, str]):
         await asyncio.sleep(0)
 
 
-async def single_main(_address: Union[str, ChecksumAddress], _cid: int):
+async def single_main(_address: Union[str, ChecksumAddress], _cid: int,
+                      base_url: str = data.constants.PARTICLE_RPC_URL):
     result = {}
     cp.output(f'Running {_address}')
-    api = ParticleApi(project_id, project_server_key)
-    tokens_ret = await api.get_tokens(_address, _cid)
+    api = ParticleApi(project_id, project_server_key, base_url=base_url)
+    try:
+        tokens_ret = await api.get_tokens(_address, _cid)
+    finally:
+        await transport.aclose()
     result.update({'tokens': tokens_ret})
     return result
 
 
-async def wrap_get_tokens(_api, acct: Acct, _cid: int, _out: str,
-                          _scan_session: ScanSession) -> dict[Any, dict[str, Any]] | bool:
-    success = False
-    res = {}
-    sleep_for = 0.3
+async def wrap_get_tokens(_api, acct: Acct, _cid: int, _out: str, _scan_session: ScanSession,
+                          _scam_filter: ScamFilter = None,
+                          _prefilter: ActivityPrefilter = None) -> dict[Any, dict[str, Any]] | bool | None:
+    """
+    :param _scam_filter: known scam tokens are dropped before they are priced or recorded
+    :param _prefilter: optional activity probe that decides whether the wallet's tokens are enumerated
+    :return: the wallet result, False if the wallet is empty, None if the request was dropped
+    """
+    # retries, backoff and circuit breaking all happen inside ParticleApi.make_request
     if acct is None:
         return False
 
-    for x in range(3):
-        try:
-            tokens_ret = await _api.get_tokens(acct.address, _cid)
-        except httpx.ReadTimeout as err:
-            cp.warning('Try: %s/3 Timed out: %s' % (x + 1, err))
-            await asyncio.sleep(sleep_for)
-            sleep_for += sleep_for
-            if x > 2:
-                break
-        else:
-            if tokens_ret is not None:
-                TOKENS: list[dict] = tokens_ret.get('tokens')
-                if len(TOKENS) > 0:
-                    [t.update({'cid': _cid}) for t in TOKENS]
-                if int(tokens_ret.get('native')) > 0 or len(tokens_ret.get('tokens')) > 0:
-                    success = True
-                    # res = {acct.address: {}}
-                    res = {'key': str(acct.key.hex()), 'address': str(acct.address), 'result': tokens_ret, 'cid': _cid}
-                    await _scan_session.update_wallet(res, _cid)
-                    # await log_result(_out, result)
-            if success and res:
-                return res
-        return False
+    tokens_ret = None
+    if _prefilter is not None:
+        outcome, balance = await _prefilter.check(_api, acct.address, _cid)
+        if outcome == ActivityPrefilter.EMPTY:
+            return False
+        if outcome == ActivityPrefilter.NATIVE:
+            tokens_ret = {'native': str(balance), 'tokens': []}
+    if tokens_ret is None:
+        tokens_ret = await _api.get_tokens(acct.address, _cid)
+    if tokens_ret is None:
+        return None
+    else:
+        if _scam_filter is not None and tokens_ret.get('tokens'):
+            tokens_ret['tokens'] = _scam_filter.filter(tokens_ret['tokens'], _cid)
+        if int(tokens_ret.get('native')) > 0 or len(tokens_ret.get('tokens')) > 0:
+            res = {'key': str(acct.key.hex()), 'address': str(acct.address),
+                   'result': _scan_session.slim_result(tokens_ret, _cid), 'cid': _cid}
+            await _scan_session.update_wallet(res, _cid)
+            return res
+    return False
 
 
 async def load_accounts_from_file(file_path: str):
     return await async_load_eth_keys(file_path)
 
 
-async def file_list_main(file_: str, _cid: int, output_file: str = None, _batch_size: int = 100, cp=None):
+async def stream_accounts_from_file(file_path: str, chunk_size: int = 1000, db_file: str = None):
+    deriver = KeyDeriver(cache=KeyCache(db_file) if db_file else None)
+    try:
+        async for chunk in async_iter_eth_keys(file_path, chunk_size, deriver=deriver):
+            for acct in chunk:
+                yield acct
+    finally:
+        deriver.close()
+
+
+async def scan_unit(_api: ParticleApi, acct: Acct, _cid: int, _out: str, _scan_session: ScanSession,
+                    _broker: PriceBroker, _scam_filter: ScamFilter = None,
+                    _prefilter: ActivityPrefilter = None) -> dict | bool:
+    """
+    Scan one (account, chain) work item: enumerate the wallet's tokens, then price whatever it holds
+    through the chain wide price broker, which hands the prices to the scan session
+    :return: the wallet result, False if it is empty, None if the request was dropped
+    """
+    br = await wrap_get_tokens(_api, acct, _cid, _out, _scan_session, _scam_filter, _prefilter)
+    if not br:
+        return br
+    tokens: list[dict] = br.get('result').get('tokens')
+    native_qty = int(br.get('result').get('native'))
+    if native_qty > 0 or len(tokens):
+        token_addresses = [token['address'] for token in tokens]
+        token_addresses.append('native')
+        await _broker.get_prices(token_addresses, _cid)
+    return br
+
+
+async def file_list_main(file_: str, _cid: int, output_file: str = None, _batch_size: int = 20,
+                         _concurrency: int = 100, cp=None, key_cache_db: str = None, rpc_batch: int = 0,
+                         rpc_batch_window: float = 0.005, price_ttl: float = 600, adaptive: bool = True,
+                         resume: bool = False, price_cache_db: str = None, price_cache_size: int = 100000,
+                         store_db: str = None, token_db: str = None, filter_scams: bool = True,
+                         prefilter_mode: str = 'off', stats_db: str = None, min_yield: float = 0.0,
+                         base_url: str = data.constants.PARTICLE_RPC_URL, metrics_file: str = None,
+                         metrics_port: int = None, max_per_chain: int = 64):
     if output_file is None:
         output_file = 'scans/particle_scan_%s.json' % time.time()
     if _cid == 0:
@@ -439,108 +649,179 @@ async def file_list_main(file_: str, _cid: int, output_file: str = None, _batch_
         cp = ColorPrint(args.verbosity)
     cp.output(chain_id_list)
     cp.output('Logging results to %s' % output_file)
-    api = ParticleApi(project_id, project_server_key)
-
-    eth_accounts = await load_accounts_from_file(file_)
-    scan_session = await ScanSession(args.output_file, eth_accounts).create(args.output_file, eth_accounts)
-
-    # await scan_session.__ainit__()
-    # scan_session.create_account_dict(eth_accounts)
-    chain_id_list_len = chain_id_list.__len__()
-    # call_count = _batch_size * chain_id_list_len
-    await scan_session.create_account_dict(eth_accounts, chain_id_list)
-    # pprint.pprint(scan_session.acct_map)
-
-    #print('Chain id len:  %s' % chain_id_list_len)
-    # print('Calls: ', call_count)
-    cp.output('Loaded %s accounts, %s chains' % (len(eth_accounts), chain_id_list_len))
-    # call_count = (batch_size_ * chain_id_list_len)
-    if len(eth_accounts) > _batch_size:
-        batches = divide_chunks(eth_accounts, batch_size)
-        cp.notice('We have %s batches of %s accounts' % (len(batches), _batch_size))
-    else:
-        batches = [eth_accounts]
-    progress = tqdm.tqdm(batches)
-
-    for cn, c in enumerate(chain_id_list):
-        cp.output('Running chain: %s' % c)
-
-        for x, batch in enumerate(progress):
-            cp.output('Batch %s/%s, chain: %s/%s' % (x + 1, len(batches), cn, len(chain_id_list)))
-            tasks = set()
-            price_tasks = set()
-            token_list = []
-            # tokens_ret = await api.get_tokens(acct.address, _cid)
-            for acct in batch:
-                if acct:
-                    task = asyncio.create_task(wrap_get_tokens(api, acct, c, output_file, scan_session))
-                    task.add_done_callback(tasks.discard)
-                    tasks.add(task)
-            batch_results = [await _ret for _ret in asyncio.as_completed(tasks)]
-            cp.output('Found %s results' % batch_results.__len__())
-            cp.debug(batch_results)
-            res_len = 0
-            tasks.clear()
-            await asyncio.sleep(0.1)
-
-            for z, br in enumerate(batch_results):
-                if br:
-                    # print(br)
-                    res_len += 1
-                    _addr = br.get('address')
-                    _key = br.get('key')
-
-                    tokens: list[dict] = br.get('result').get('tokens')
-                    native_qty = int(br.get('result').get('native'))
-                    br.get('result').pop('native')
-                    if native_qty > 0 or len(tokens):
-                        # print(tokens, native_qty, c)
-                        tokens.append({'address': 'native', 'amount': native_qty, 'decimals': 18, 'cid': c})
-                        if tokens:
-                            task = asyncio.create_task(api.get_price([token['address'] for token in tokens], c))
-                            task.add_done_callback(price_tasks.discard)
-                            price_tasks.add(task)
-            cp.output('Found %s results' % res_len)
-            price_results = [await _ret for _ret in asyncio.as_completed(price_tasks)]
-
-            if len(price_results):
-                for _tokens in price_results:
-                    # print(_tokens)
-                    if _tokens:
-                        for k, tp in enumerate(_tokens):
-                            tp: Union[TokenPrice, None]
-                            if tp is not None:
-                                token_list.append(tp)
-                    await scan_session.set_token_prices(token_list)
-            price_tasks.clear()
-            token_list.clear()
-            # batches.clear()
-        await scan_session.dump()
-        await asyncio.sleep(0)
+    # adaptive: the per chain limit starts at --batch and follows the endpoint up to --max-per-chain
+    limiters = LimiterRegistry(initial=min(_batch_size, max_per_chain), max_limit=max_per_chain) if adaptive else None
+    api = ParticleApi(project_id, project_server_key, rpc_batch, rpc_batch_window, adaptive, base_url=base_url,
+                      limiters=limiters)
+    await transport.warm([api.base_url])
+
+    checkpoint = CheckpointLog(output_file + '.ndjson')
+    store = SqliteStore(store_db) if store_db else None
+    if store is not None:
+        await asyncio.to_thread(store.start)
+    registry = TokenRegistry(token_db)
+    if token_db:
+        cp.notice('Loaded %s known tokens' % await asyncio.to_thread(registry.load))
+    scam_filter = ScamFilter() if filter_scams else None
+    prefilter = ActivityPrefilter(prefilter_mode) if prefilter_mode != 'off' else None
+    if scam_filter is not None:
+        cp.notice('Loaded %s scam token entries' % await asyncio.to_thread(scam_filter.load))
+    scan_session = await ScanSession.create(output_file, [], scan_log=checkpoint.log_file, store=store,
+                                            registry=registry, price_ttl=price_ttl)
+
+    chain_stats = ChainStats(stats_db) if stats_db else None
+    weights = None
+    if chain_stats is not None and await asyncio.to_thread(chain_stats.load):
+        if min_yield > 0:
+            dead = chain_stats.below(chain_id_list, min_yield)
+            if dead:
+                cp.warning('Skipping %s chains below a %s hit rate: %s' % (len(dead), min_yield, dead))
+            chain_id_list = [c for c in chain_id_list if c not in dead]
+        chain_id_list = chain_stats.order(chain_id_list)
+        weights = chain_stats.weights(chain_id_list)
+    scheduler = ChainScheduler(chain_id_list, global_limit=_concurrency,
+                               per_chain_limit=max_per_chain if adaptive else _batch_size,
+                               skip=lambda acct, c: checkpoint.completed(acct.address, c), weights=weights,
+                               limiter_for=(lambda c: limiters.get(api.base_url, c)) if adaptive else None)
+    chain_id_list_len = len(scheduler.chain_ids)
+    scan_session.init_chains(scheduler.chain_ids)
+    price_cache = PriceCache(price_cache_db, ttl=price_ttl, max_entries=price_cache_size) if price_cache_db else None
+    broker = PriceBroker(api.get_price, ttl=price_ttl, on_prices=scan_session.set_token_prices, cache=price_cache,
+                         make_price=TokenPrice)
+    if price_cache is not None:
+        cp.notice('Loaded %s cached prices' % await broker.warm(scheduler.chain_ids))
+
+    resumed_tokens: dict[int, set[str]] = {}
+    if resume:
+        async def restore(br: dict, c: int):
+            await scan_session.update_wallet(br, c)
+            tokens = resumed_tokens.setdefault(c, {'native'})
+            tokens.update(token['address'] for token in br['result']['tokens'])
+
+        units, results = await checkpoint.load(restore)
+        cp.notice('Resumed %s finished units (%s with results) from %s' % (units, results, checkpoint.log_file))
+    checkpoint.open(resume)
+    # restored wallets still need prices for the final valuation
+    reprice = [asyncio.create_task(broker.get_prices(tokens, c)) for c, tokens in resumed_tokens.items()]
+
+    cp.notice('Scanning %s chains, %s in flight (%s per chain%s)' % (
+        chain_id_list_len, _concurrency, scheduler.per_chain_limit, ' at most, adaptive' if adaptive else ''))
+    metrics_server = metrics.serve(metrics_port) if metrics_port else None
+    if metrics_server is not None:
+        cp.notice('Serving metrics on http://127.0.0.1:%s/metrics' % metrics_port)
+    metrics.REGISTRY.started = time.time()
+    progress = tqdm.tqdm(unit='unit')
+    found = 0
+    loaded = 0
+
+    async def counted(accounts):
+        nonlocal loaded
+        async for acct in accounts:
+            loaded += 1
+            yield acct
+
+    async def on_done(acct: Acct, c: int, br: dict | bool | None):
+        nonlocal found
+        if br:
+            found += 1
+            cp.debug(br)
+        metrics.UNITS.inc(c, 'dropped' if br is None else 'hit' if br else 'empty')
+        if br is not None:
+            await checkpoint.record(acct.address, c, br)
+            if chain_stats is not None:
+                chain_stats.record(c, bool(br))
+        progress.update(1)
+        progress.set_postfix(found=found)
+
+    async def handler(acct: Acct, c: int):
+        return await scan_unit(api, acct, c, output_file, scan_session, broker, scam_filter, prefilter)
 
-    return await scan_session.finalize()
+    try:
+        await scheduler.run(counted(stream_accounts_from_file(file_, db_file=key_cache_db)), handler, on_done)
+        await asyncio.gather(*reprice)
+    finally:
+        progress.close()
+        await transport.aclose()
+        if price_cache is not None:
+            price_cache.close()
+        await asyncio.to_thread(registry.flush)
+        if chain_stats is not None:
+            await asyncio.to_thread(chain_stats.flush)
+        try:
+            if store is not None:
+                await store.close()
+                cp.output('Stored %s wallet results in %s' % (store.written, store.db_file))
+        finally:
+            # last, it raises if the log writer died and everything else must be released first
+            await checkpoint.close()
+    cp.output('Loaded %s accounts, %s chains' % (loaded, chain_id_list_len))
+    if scheduler.skipped:
+        cp.output('Skipped %s units already in the checkpoint log' % scheduler.skipped)
+    cp.output('Found %s results' % found)
+    cp.output('Priced %s tokens in %s price calls' % (broker.requested, broker.calls))
+    if prefilter is not None:
+        cp.output('Prefilter (%s): probed %s wallets, skipped %s, %s native only' % (
+            prefilter.mode, prefilter.probed, prefilter.skipped, prefilter.native_only))
+    if scam_filter is not None and scam_filter.dropped:
+        cp.output('Dropped %s scam token holdings' % scam_filter.dropped)
+    if price_cache is not None and price_cache.evicted:
+        cp.output('Evicted %s least recently used prices from the price cache' % price_cache.evicted)
+    for c, counts in sorted(api.retry.stats.summary().items()):
+        cp.warning('Chain %s: %s retries, %s dropped, %s failed fast (circuit open)' % (
+            c, counts['retries'], counts['drops'], counts['short_circuits']))
+    if api.retry.stats.budget_exhausted:
+        cp.warning('Retry budget exhausted %s times' % api.retry.stats.budget_exhausted)
+    for c, errors in scheduler.errors.items():
+        if errors:
+            cp.warning('Chain %s: %s units failed' % (c, errors))
+    if limiters is not None:
+        cp.debug('Adaptive per chain limits: %s', {c: round(limit, 1) for (_, c), limit in limiters.snapshot().items()})
+
+    report = await scan_session.finalize()
+    metrics.update_rates()
+    if metrics_file:
+        metrics.REGISTRY.write(metrics_file)
+        cp.notice('Wrote metrics to %s' % metrics_file)
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    return report
 
 
 if __name__ == '__main__':
-    cp = ColorPrint(0)
     dotenv.load_dotenv()
     project_id = os.environ.get('PROJECT_ID')
     project_server_key = os.environ.get('PROJECT_SERVER_KEY')
 
     # api = ParticleApi(project_id, project_server_key)
     args = cli_args()
+    cp = ColorPrint(args.verbosity, buffered=args.buffer_output, summary=args.summary)
+    transport.configure(http2=not args.no_http2, max_connections=args.max_connections,
+                        max_keepalive_connections=args.max_connections)
 
     if args.command == 'single':
         chain_id = args.chain_id
         _address = helpers.load_keys(args.address)
         cp.output(f'Check: {_address}')
-        ret = asyncio.run(single_main(_address[0].address, chain_id))
+        ret = asyncio.run(single_main(_address[0].address, chain_id, args.rpc_url))
         pprint.pprint(json.dumps(ret))
     if args.command == 'file_list':
         chain_id = args.chain_id
         file = args.file
         _output_file = args.output_file
         batch_size = args.batch
-        ret = asyncio.run(file_list_main(file, chain_id, _output_file, batch_size))
+        ret = asyncio.run(file_list_main(file, chain_id, _output_file, batch_size, args.concurrency, cp,
+                                         key_cache_db=None if args.no_key_cache else args.cache_db,
+                                         rpc_batch=args.rpc_batch, rpc_batch_window=args.rpc_batch_window / 1000,
+                                         price_ttl=args.price_ttl, adaptive=not args.no_adaptive, resume=args.resume,
+                                         price_cache_db=None if args.no_price_cache else args.cache_db,
+                                         price_cache_size=args.price_cache_size,
+                                         store_db=args.db if args.store else None,
+                                         token_db=None if args.no_token_cache else args.cache_db,
+                                         filter_scams=not args.no_scam_filter, prefilter_mode=args.prefilter,
+                                         stats_db=None if args.no_chain_stats else args.cache_db,
+                                         min_yield=args.min_yield,
+                                         base_url=args.rpc_url, metrics_file=args.metrics_file,
+                                         metrics_port=args.metrics_port, max_per_chain=args.max_per_chain))
         if ret:
             pprint.pprint(ret)
+    cp.close()
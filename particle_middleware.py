@@ -1,14 +1,23 @@
 import asyncio
+import itertools
 import os
+from typing import Any, Union
 
 import dotenv
 import httpx
+from toolz import curry
 from web3 import AsyncWeb3 as Web3
 from web3.eth import AsyncEth
-from web3.providers import AsyncBaseProvider
-from web3.types import RPCEndpoint
+from web3.middleware.base import Web3Middleware, Web3MiddlewareBuilder
+from web3.providers.async_base import AsyncJSONBaseProvider
+from web3.types import RPCEndpoint, RPCResponse
 import argparse
 
+from data.constants import PARTICLE_RPC_URL
+from utils import transport
+from utils.rpc_batch import RpcBatcher
+from utils.rpc_cache import RpcCache
+
 PARTICLE_SUPPORTED = [(1, 'ethereum'), (43114, 'avalanche'), (56, 'bsc'), (137, 'polygon'), (10, 'optimism'),
                       (42161, 'arbitrum'), (42170, 'nova'), (8453, 'base'), (534352, 'scroll'), (324, 'zksync'),
                       (1101, 'polygonzkevm'), (1284, 'moonbeam'), (1285, 'moonriver'), (1313161554, 'aurora'),
@@ -18,31 +27,138 @@ PARTICLE_SUPPORTED = [(1, 'ethereum'), (43114, 'avalanche'), (56, 'bsc'), (137,
                       (321, 'platon'), (108, 'thundercore')]
 
 
-class CustomParticleProvider(AsyncBaseProvider):
-    def __init__(self, chain_id: int = 1):
+class CustomParticleProvider(AsyncJSONBaseProvider):
+    def __init__(self, chain_id: int = 1, base_url: str = PARTICLE_RPC_URL, batch_size: int = 20,
+                 batch_window: float = 0.005):
+        """
+        web3.py provider for the Particle evm-chain endpoint. Calls made concurrently through
+        `make_request` are micro-batched into JSON-RPC batch arrays, and web3's own batch API
+        (`w3.batch_requests()`) goes out as a single array through `make_batch_request`.
+        :param chain_id: chain every call is sent to
+        :param base_url: evm-chain endpoint
+        :param batch_size: max calls coalesced into one HTTP request (1 to send every call on its own)
+        :param batch_window: seconds to wait for more calls before sending a partial batch
+        """
+        super().__init__()
         dotenv.load_dotenv()
         self.project_id = os.environ.get('PROJECT_ID')
         self.project_server_key = os.environ.get('PROJECT_SERVER_KEY')
         self.chain_id = chain_id
-        self.base_url = "https://rpc.particle.network/evm-chain"
+        self.base_url = base_url
         self.headers = {'Content-Type': 'application/json'}
-        self.auth = httpx.BasicAuth(self.project_id, self.project_server_key)
-        self.client = httpx.AsyncClient(auth=self.auth, headers=self.headers, timeout=60,
-                                        limits=httpx.Limits(max_connections=100))
+        self.auth = httpx.BasicAuth(self.project_id or '', self.project_server_key or '')
+        # every provider shares the process wide connection pool
+        self.client = transport.get_client()
+        self.batcher = RpcBatcher(self._send, batch_size, batch_window) if batch_size > 1 else None
+        self._ids = itertools.count(1)
+
+    def next_id(self) -> int:
+        # one increasing sequence whether or not the call goes through the batcher
+        return self.batcher.next_id() if self.batcher is not None else next(self._ids)
 
-    async def make_request(self, method: RPCEndpoint, params):
-        # Prepare the request payload, ensuring chainId could be included in params if necessary
-        payload = {
+    def get_url(self) -> str:
+        return self.base_url + f"?chainId={self.chain_id}"
+
+    def form_request(self, method: RPCEndpoint, params: Any = None) -> dict:
+        return {
             'jsonrpc': '2.0',
             'chainId': self.chain_id,
             'method': method,
-            'params': params,
-            'id': 1  # Static ID for simplicity, could be made dynamic
+            'params': [] if params is None else params,
+            'id': self.next_id(),
         }
-        # Send the request
-        response = await self.client.post(self.base_url, json=payload)
-        response.raise_for_status()  # Ensure to check for HTTP errors
-        return response.json()
+
+    async def _send(self, _chain_id: int, payload: Union[dict, list[dict]]) -> Union[dict, list[dict], None]:
+        """
+        POST a single payload or a batch array
+        :return: decoded json, or on a bad status the JSON-RPC error object the server sent and None
+                 otherwise. Never raises for a status, so the batcher can resend a refused batch as
+                 single calls.
+        """
+        response = await self.client.post(self.get_url(), json=payload, auth=self.auth, headers=self.headers)
+        if response.status_code == 200:
+            return response.json()
+        try:
+            body = response.json()
+        except ValueError:
+            return None
+        return body if isinstance(body, dict) and isinstance(body.get('error'), dict) else None
+
+    @staticmethod
+    def _no_response(_id: Union[int, None], method: str) -> RPCResponse:
+        return {'jsonrpc': '2.0', 'id': _id, 'error': {'code': -32603, 'message': 'No response for %s' % method}}
+
+    async def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        if self.batcher is None:
+            payload = self.form_request(method, params)
+            response = await self._send(self.chain_id, payload)
+            return response if isinstance(response, dict) else self._no_response(payload['id'], method)
+        response = await self.batcher.call(self.chain_id, method, [] if params is None else params)
+        if response is None:
+            return self._no_response(None, method)
+        return response
+
+    async def make_batch_request(self, requests: list[tuple[RPCEndpoint, Any]]
+                                 ) -> Union[list[RPCResponse], RPCResponse]:
+        """
+        Send web3's batch as one JSON-RPC array
+        :return: the responses in request order, or the single error object the server sent instead
+        """
+        payloads = [self.form_request(method, params) for method, params in requests]
+        response = await self._send(self.chain_id, payloads)
+        if not isinstance(response, list):
+            return response if isinstance(response, dict) else self._no_response(None, 'the batch')
+        by_id = {resp.get('id'): resp for resp in response if isinstance(resp, dict)}
+        return [by_id.get(payload['id']) or self._no_response(payload['id'], payload['method'])
+                for payload in payloads]
+
+
+class RpcCacheMiddleware(Web3MiddlewareBuilder):
+    cache: RpcCache
+
+    @staticmethod
+    @curry
+    def build(cache: RpcCache, w3: Web3) -> Web3Middleware:
+        """
+        Serve deterministic calls from `cache` instead of the node, batches only send their misses
+            w3.middleware_onion.inject(RpcCacheMiddleware.build(RpcCache()), 'rpc_cache', layer=0)
+        """
+        middleware = RpcCacheMiddleware(w3)
+        middleware.cache = cache
+        return middleware
+
+    @property
+    def chain_id(self) -> int:
+        return getattr(self._w3.provider, 'chain_id', 0)
+
+    async def async_wrap_make_request(self, make_request):
+        async def middleware(method: RPCEndpoint, params: Any) -> RPCResponse:
+            key, ttl, response = self.cache.lookup(self.chain_id, method, params)
+            if response is not None:
+                return response
+            response = await make_request(method, params)
+            if key is not None:
+                self.cache.put(key, ttl, response)
+            return response
+
+        return middleware
+
+    async def async_wrap_make_batch_request(self, make_batch_request):
+        async def middleware(requests_info: list[tuple[RPCEndpoint, Any]]) -> Union[list[RPCResponse], RPCResponse]:
+            lookups = [self.cache.lookup(self.chain_id, method, params) for method, params in requests_info]
+            missing = [i for i, (_, _, response) in enumerate(lookups) if response is None]
+            if missing:
+                responses = await make_batch_request([requests_info[i] for i in missing])
+                if not isinstance(responses, list):
+                    return responses
+                for i, response in zip(missing, responses):
+                    key, ttl, _ = lookups[i]
+                    if key is not None:
+                        self.cache.put(key, ttl, response)
+                    lookups[i] = (key, ttl, response)
+            return [response for _, _, response in lookups]
+
+        return middleware
 
 
 def find_cid(name: str):
@@ -54,29 +170,48 @@ def find_cid(name: str):
     return 0
 
 
-def create_w3(cid: int = None, chain_name: str = None):
+def create_w3(cid: int = None, chain_name: str = None, cache: RpcCache = None, **provider_kwargs):
     if cid is None:
         assert chain_name is not None
         cid = find_cid(chain_name)
         assert cid is not 0
 
-    provider = CustomParticleProvider(chain_id=cid)
+    provider = CustomParticleProvider(chain_id=cid, **provider_kwargs)
     w3 = Web3(provider, modules={'eth': (AsyncEth,)})
+    if cache is not None:
+        # outermost, so cache hits skip every other middleware
+        w3.middleware_onion.inject(RpcCacheMiddleware.build(cache), 'rpc_cache', layer=0)
     return w3
 
 
 # Usage example
-async def main(cid: int):
-    w3 = create_w3(cid)
-    block_number = await w3.eth.block_number
-    base_fee = await w3.eth.gas_price
+async def main(cid: int, base_url: str = PARTICLE_RPC_URL, cache_db: str = None):
+    cache = RpcCache(db_file=cache_db)
+    await asyncio.to_thread(cache.load)
+    w3 = create_w3(cid, cache=cache, base_url=base_url)
+    await transport.warm([w3.provider.base_url])
+    # concurrent calls share one HTTP request
+    block_number, base_fee = await asyncio.gather(w3.eth.block_number, w3.eth.gas_price)
     print(f"Current Block Number: {block_number}")
     print(f'Current Base Fee: {base_fee}')
+    # explicit web3 batch
+    async with w3.batch_requests() as batch:
+        batch.add(w3.eth.get_block(block_number))
+        batch.add(w3.eth.chain_id)
+        block, chain_id = await batch.async_execute()
+    print(f"Block {block['number']} on chain {chain_id} has {len(block['transactions'])} transactions")
+    # pinned by number, served from the cache
+    await w3.eth.get_block(block_number)
+    print(f'RPC cache: {cache.hits} hits, {cache.misses} misses')
+    await asyncio.to_thread(cache.flush)
+    await transport.aclose()
 
 
 # Run the async main function
 if __name__ == "__main__":
     args = argparse.ArgumentParser()
     args.add_argument('cid', type=int, default=1)
+    args.add_argument('--rpc-url', type=str, default=PARTICLE_RPC_URL, help='evm-chain endpoint')
+    args.add_argument('--cache-db', type=str, default=None, help='persist immutable RPC responses in this sqlite db')
     args = args.parse_args()
-    asyncio.run(main(cid=args.cid))
+    asyncio.run(main(cid=args.cid, base_url=args.rpc_url, cache_db=args.cache_db))
@@ -0,0 +1,84 @@
+import asyncio
+import json
+
+from utils.checkpoint import CheckpointLog
+
+RESULT = {'key': '0x01', 'address': '0xA', 'result': {'native': '1', 'tokens': []}, 'cid': 1}
+
+
+async def record_all(log: CheckpointLog, units: list[tuple[str, int, object]], resume: bool = False):
+    log.open(resume)
+    for address, cid, result in units:
+        await log.record(address, cid, result)
+    await log.close()
+
+
+def test_resume_restores_finished_units(tmp_path):
+    path = str(tmp_path / 'scan.json.ndjson')
+    asyncio.run(record_all(CheckpointLog(path), [('0xA', 1, RESULT), ('0xA', 56, False), ('0xB', 1, None)]))
+
+    restored = []
+    log = CheckpointLog(path)
+    units, results = asyncio.run(log.load(lambda result, cid: restored.append((result['address'], cid))))
+    assert (units, results) == (3, 1)
+    assert restored == [('0xA', 1)]
+    assert log.completed('0xA', 1) and log.completed('0xA', 56) and log.completed('0xB', 1)
+    assert not log.completed('0xB', 56)
+    assert not log.completed('0xC', 1)
+
+
+def test_torn_last_line_is_skipped(tmp_path):
+    path = tmp_path / 'scan.json.ndjson'
+    path.write_text(json.dumps({'a': '0xA', 'c': 1, 'r': None}) + '\n' + '{"a": "0xB", "c"')
+    log = CheckpointLog(str(path))
+    assert asyncio.run(log.load()) == (1, 0)
+    assert log.completed('0xA', 1)
+    assert not log.completed('0xB', 1)
+
+
+def test_resumed_log_is_appended_to(tmp_path):
+    path = str(tmp_path / 'scan.json.ndjson')
+    asyncio.run(record_all(CheckpointLog(path), [('0xA', 1, RESULT)]))
+    log = CheckpointLog(path)
+    asyncio.run(log.load())
+    asyncio.run(record_all(log, [('0xB', 1, None)], resume=True))
+
+    reloaded = CheckpointLog(path)
+    assert asyncio.run(reloaded.load()) == (2, 1)
+    assert reloaded.completed('0xA', 1) and reloaded.completed('0xB', 1)
+
+
+def test_fresh_log_replaces_an_old_one(tmp_path):
+    path = str(tmp_path / 'scan.json.ndjson')
+    asyncio.run(record_all(CheckpointLog(path), [('0xA', 1, RESULT)]))
+    asyncio.run(record_all(CheckpointLog(path), [('0xB', 1, None)]))
+    log = CheckpointLog(path)
+    assert asyncio.run(log.load()) == (1, 0)
+    assert not log.completed('0xA', 1)
+
+
+def test_resume_after_a_torn_line_keeps_the_next_record(tmp_path):
+    path = tmp_path / 'scan.json.ndjson'
+    path.write_text(json.dumps({'a': '0xA', 'c': 1, 'r': None}) + '\n' + '{"a": "0xB", "c"')
+    log = CheckpointLog(str(path))
+    asyncio.run(log.load())
+    asyncio.run(record_all(log, [('0xC', 1, RESULT)], resume=True))
+
+    reloaded = CheckpointLog(str(path))
+    assert asyncio.run(reloaded.load()) == (2, 1)
+    assert reloaded.completed('0xA', 1) and reloaded.completed('0xC', 1)
+    assert not reloaded.completed('0xB', 1)
+    assert path.read_text().endswith('\n')
+
+
+def test_resume_terminates_a_whole_last_line(tmp_path):
+    path = tmp_path / 'scan.json.ndjson'
+    # a complete record whose newline never made it to disk
+    path.write_text(json.dumps({'a': '0xA', 'c': 1, 'r': None}))
+    log = CheckpointLog(str(path))
+    assert asyncio.run(log.load()) == (1, 0)
+    asyncio.run(record_all(log, [('0xB', 1, None)], resume=True))
+
+    reloaded = CheckpointLog(str(path))
+    assert asyncio.run(reloaded.load()) == (2, 0)
+    assert reloaded.completed('0xA', 1) and reloaded.completed('0xB', 1)
@@ -0,0 +1,41 @@
+import pytest
+
+from main import ScanSession
+from utils.holdings import HoldingsStore
+from utils.token_registry import TokenRegistry
+
+GOOD = '0x' + 'a' * 40
+BAD = '0x' + 'b' * 40
+
+
+def columns(store: HoldingsStore) -> list[int]:
+    return [len(store.addr_idx), len(store.chain_idx), len(store.token_idx), len(store.amount_lo), len(store.amount_hi)]
+
+
+@pytest.mark.parametrize('decimals', [256, -1])
+def test_bad_decimals_leave_the_columns_aligned(decimals):
+    store = HoldingsStore()
+    with pytest.raises(ValueError):
+        store.add('0x1', 'k1', 1, BAD, 10, decimals)
+    assert columns(store) == [0, 0, 0, 0, 0]
+    assert store.tokens.get((1, BAD)) is None
+
+    store.add('0x2', 'k2', 1, GOOD, 5 * 10 ** 6, 6)
+    assert columns(store) == [1, 1, 1, 1, 1]
+    row = store.row(0)
+    assert (row.address, row.token, row.amount, row.decimals) == ('0x2', GOOD, 5 * 10 ** 6, 6)
+
+
+def test_registry_accepts_the_full_uint8_range():
+    registry = TokenRegistry()
+    assert registry.decimals[registry.register(1, GOOD, 255)] == 255
+    assert registry.decimals[registry.register(1, BAD, 0)] == 0
+
+
+def test_scan_results_drop_tokens_with_bad_decimals():
+    session = ScanSession(output_file=None)
+    slim = session.slim_result({'native': '0', 'tokens': [
+        {'address': BAD, 'amount': '1', 'decimals': 300, 'symbol': 'BAD'},
+        {'address': GOOD, 'amount': '2', 'decimals': 6, 'symbol': 'GOOD'}]}, 1)
+    assert slim['tokens'] == [{'address': GOOD, 'amount': '2', 'decimals': 6}]
+    assert session.registry.get((1, BAD)) is None
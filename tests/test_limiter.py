@@ -0,0 +1,74 @@
+import asyncio
+
+from utils.helpers import Acct
+from utils.limiter import AimdLimiter, LimiterRegistry, PrioritySemaphore
+from utils.scheduler import ChainScheduler
+
+
+def test_additive_increase_up_to_the_ceiling():
+    limiter = AimdLimiter(initial=2, max_limit=4)
+    for _ in range(100):
+        limiter.success(0.01)
+    assert limiter.limit == 4
+
+
+def test_congestion_halves_once_per_round_trip():
+    limiter = AimdLimiter(initial=16, min_limit=1)
+    limiter.congestion()
+    limiter.congestion()
+    assert limiter.limit == 8
+
+
+def test_limiter_gates_scheduler_units():
+    registry = LimiterRegistry(initial=2, max_limit=2)
+    peak = {'in_flight': 0, 'max': 0}
+
+    async def handler(acct, cid):
+        peak['in_flight'] += 1
+        peak['max'] = max(peak['max'], peak['in_flight'])
+        await asyncio.sleep(0.001)
+        peak['in_flight'] -= 1
+        return True
+
+    accounts = [Acct(address='0x%040x' % i, key='0x%064x' % i) for i in range(1, 31)]
+    scheduler = ChainScheduler([1], global_limit=50, per_chain_limit=10,
+                               limiter_for=lambda c: registry.get('endpoint', c))
+    asyncio.run(scheduler.run(accounts, handler))
+    assert scheduler.completed[1] == 30
+    # ten workers, but the chain's limiter only ever lets two units run
+    assert peak['max'] == 2
+
+
+def test_priority_semaphore_serves_highest_priority_first():
+    async def run():
+        sem = PrioritySemaphore(1)
+        order = []
+
+        async def unit(name, priority):
+            await sem.acquire(priority)
+            order.append(name)
+            await asyncio.sleep(0)
+            sem.release()
+
+        await sem.acquire()
+        tasks = [asyncio.create_task(unit(n, p)) for n, p in (('low', 0.1), ('high', 1.0), ('mid', 0.5), ('high2', 1.0))]
+        await asyncio.sleep(0)
+        sem.release()
+        await asyncio.gather(*tasks)
+        return order, sem.value
+
+    assert asyncio.run(run()) == (['high', 'high2', 'mid', 'low'], 1)
+
+
+def test_priority_semaphore_skips_cancelled_waiters():
+    async def run():
+        sem = PrioritySemaphore(1)
+        await sem.acquire()
+        waiter = asyncio.create_task(sem.acquire(1.0))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        sem.release()
+        return sem.value
+
+    assert asyncio.run(run()) == 1
@@ -0,0 +1,23 @@
+import httpx
+import pytest
+
+from utils.mock_rpc import MockProcess
+
+
+def test_mock_process_serves_and_reports_stats():
+    server = MockProcess(latency=0, latency_dist='fixed').start()
+    try:
+        single = httpx.post(server.url + '?chainId=56', json={'jsonrpc': '2.0', 'id': 1, 'method': 'eth_chainId'})
+        batch = httpx.post(server.url, json=[{'jsonrpc': '2.0', 'id': i, 'method': 'eth_gasPrice'} for i in range(3)])
+    finally:
+        stats = server.stop()
+    assert single.json()['result'] == hex(56)
+    assert [r['id'] for r in batch.json()] == [0, 1, 2]
+    assert (stats.requests, stats.calls) == (2, 4)
+    assert stats.statuses == {200: 2}
+    assert stats.methods == {'eth_chainId': 1, 'eth_gasPrice': 3}
+
+
+def test_mock_process_raises_server_errors():
+    with pytest.raises(ValueError):
+        MockProcess(latency_dist='bogus').start()
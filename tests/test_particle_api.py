@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+import httpx
+
+from main import ParticleApi
+from utils.retry import CircuitBreaker, RetryEngine, RetryPolicy
+
+
+def api_answering(status: int, body: dict = None, failure_threshold: int = 3) -> tuple[ParticleApi, list]:
+    sent = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        sent.append(payload)
+        ret = body if body is not None else {'jsonrpc': '2.0', 'id': payload.get('id'), 'result': '0x1'}
+        return httpx.Response(status, json=ret)
+
+    api = ParticleApi('test', 'test', batch_size=0, adaptive=False,
+                      retry=RetryEngine(RetryPolicy(max_attempts=2, base=0, cap=0), failure_threshold=failure_threshold),
+                      base_url='http://mock/evm-chain')
+    api.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return api, sent
+
+
+def test_rpc_errors_do_not_open_the_breaker():
+    api, sent = api_answering(200, {'jsonrpc': '2.0', 'id': 1, 'error': {'code': -32602, 'message': 'bad address'}})
+
+    async def run():
+        return [await api.get_tokens('0xbad', 1) for _ in range(10)]
+
+    assert asyncio.run(run()) == [None] * 10
+    # not retried, and the chain stays usable
+    assert len(sent) == 10
+    assert api.retry.breaker(1).state == CircuitBreaker.CLOSED
+    assert api.retry.stats.summary()[1]['drops'] == 10
+
+
+def test_client_errors_are_not_retried_or_counted():
+    api, sent = api_answering(400, {'error': 'bad request'})
+
+    async def run():
+        return [await api.get_tokens('0x1', 1) for _ in range(5)]
+
+    assert asyncio.run(run()) == [None] * 5
+    assert len(sent) == 5
+    assert api.retry.breaker(1).state == CircuitBreaker.CLOSED
+
+
+def test_server_errors_open_the_breaker():
+    api, sent = api_answering(503, {'error': 'unavailable'})
+
+    async def run():
+        return [await api.get_tokens('0x1', 1) for _ in range(3)]
+
+    assert asyncio.run(run()) == [None] * 3
+    assert api.retry.breaker(1).state == CircuitBreaker.OPEN
+    # retried until the breaker opened, then failed fast
+    assert len(sent) == 3
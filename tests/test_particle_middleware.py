@@ -0,0 +1,46 @@
+import asyncio
+import json
+
+import httpx
+
+from particle_middleware import CustomParticleProvider
+
+
+def provider_with(handler, batch_size: int = 20) -> CustomParticleProvider:
+    provider = CustomParticleProvider(chain_id=1, base_url='http://mock/evm-chain', batch_size=batch_size)
+    provider.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return provider
+
+
+def test_refused_batch_falls_back_to_single_calls():
+    sent = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        sent.append(payload)
+        if isinstance(payload, list):
+            return httpx.Response(400, json={'error': 'batch requests are not allowed'})
+        return httpx.Response(200, json={'jsonrpc': '2.0', 'id': payload['id'], 'result': hex(payload['id'])})
+
+    provider = provider_with(handler)
+
+    async def run():
+        return await asyncio.gather(*[provider.make_request('eth_blockNumber', []) for _ in range(3)])
+
+    responses = asyncio.run(run())
+    assert [r['result'] for r in responses] == [hex(r['id']) for r in responses]
+    assert isinstance(sent[0], list) and len(sent) == 4
+    assert provider.batcher.fallbacks == 1
+
+
+def test_bad_status_is_an_error_response_not_an_exception():
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(503, text='unavailable')
+
+    provider = provider_with(handler, batch_size=1)
+    response = asyncio.run(provider.make_request('eth_blockNumber', []))
+    assert response['error']['code'] == -32603
+    assert response['id'] == 1
+
+    batch = asyncio.run(provider.make_batch_request([('eth_blockNumber', []), ('eth_chainId', [])]))
+    assert 'error' in batch
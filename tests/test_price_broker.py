@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+from eth_utils import to_checksum_address
+
+from main import ScanSession, TokenPrice
+from utils.price_broker import PriceBroker
+from utils.price_cache import PriceCache
+
+TOKEN = to_checksum_address('0x' + 'a' * 40)
+
+
+async def no_fetch(tokens, _chain_id):
+    raise AssertionError('warm prices must not be fetched')
+
+
+def seed(db_file: str, chain_ids: list[int]):
+    async def store():
+        cache = PriceCache(db_file)
+        now = time.time()
+        await cache.store([(c, TOKEN, float(c), now) for c in chain_ids])
+        cache.close()
+
+    asyncio.run(store())
+
+
+def warm(db_file: str, session_chains: list[int], chain_ids: list[int] = None) -> tuple[ScanSession, PriceBroker, int]:
+    async def run():
+        session = ScanSession(output_file=None)
+        session.init_chains(session_chains)
+        cache = PriceCache(db_file)
+        broker = PriceBroker(no_fetch, on_prices=session.set_token_prices, cache=cache, make_price=TokenPrice)
+        loaded = await broker.warm(chain_ids)
+        cache.close()
+        return session, broker, loaded
+
+    return asyncio.run(run())
+
+
+def test_warm_spanning_chains_outside_the_scan(tmp_path):
+    db_file = str(tmp_path / 'cache.db')
+    seed(db_file, [1, 56, 137])
+    # prices of chains the session never initialized used to crash set_token_prices
+    session, broker, loaded = warm(db_file, [1])
+    assert loaded == 3
+    assert {c: session.token_prices[c][TOKEN].price for c in (1, 56, 137)} == {1: 1.0, 56: 56.0, 137: 137.0}
+
+
+def test_warm_only_loads_the_scanned_chains(tmp_path):
+    db_file = str(tmp_path / 'cache.db')
+    seed(db_file, [1, 56, 137])
+    session, broker, loaded = warm(db_file, [1, 56], chain_ids=[1, 56])
+    assert loaded == 2
+    assert set(session.token_prices) == {1, 56}
+    assert broker.cached(TOKEN, 56) == (True, session.token_prices[56][TOKEN])
+    assert broker.cached(TOKEN, 137) == (False, None)
+
+
+def test_session_freshness_follows_the_price_ttl():
+    async def run(price_ttl):
+        session = ScanSession(output_file=None, price_ttl=price_ttl)
+        held = TokenPrice(TOKEN, 1, 1.0)
+        held.updated = int(time.time()) - 120
+        await session.set_token_prices([held])
+        # a re-price only replaces the held price once that is older than the ttl
+        await session.set_token_prices([TokenPrice(TOKEN, 1, 2.0)])
+        return session.token_prices[1][TOKEN].price
+
+    assert asyncio.run(run(60)) == 2.0
+    assert asyncio.run(run(600)) == 1.0
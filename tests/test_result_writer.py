@@ -0,0 +1,44 @@
+import asyncio
+import json
+
+import pytest
+
+from utils.errors import WriterFailed
+from utils.result_writer import NdjsonWriter
+
+
+def test_records_are_written_in_order(tmp_path):
+    path = str(tmp_path / 'out.ndjson')
+
+    async def write():
+        writer = NdjsonWriter(path, batch_size=3)
+        writer.start()
+        for i in range(10):
+            writer.write({'i': i})
+        await writer.close()
+        return writer
+
+    writer = asyncio.run(write())
+    with open(path) as f:
+        assert [json.loads(line)['i'] for line in f] == list(range(10))
+    assert writer.written == 10
+
+
+def test_thread_failure_is_raised_from_write_and_close(tmp_path):
+    path = str(tmp_path / 'out.ndjson')
+
+    async def write():
+        writer = NdjsonWriter(path, batch_size=1)
+        writer.start()
+        writer.write({'ok': 1})
+        # not serializable, kills the writer thread
+        writer.write({'bad': object()})
+        await asyncio.to_thread(writer._thread.join, 5)
+        assert not writer._thread.is_alive()
+        with pytest.raises(WriterFailed):
+            writer.write({'ok': 2})
+        with pytest.raises(WriterFailed) as raised:
+            await writer.close()
+        assert isinstance(raised.value.__cause__, TypeError)
+
+    asyncio.run(write())
@@ -0,0 +1,92 @@
+from utils import retry
+from utils.retry import CircuitBreaker, RetryBudget, RetryEngine, RetryPolicy
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_breaker_opens_after_consecutive_failures(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(retry.time, 'monotonic', clock)
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_success()
+    # a success resets the count, failures have to be consecutive
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_breaker_lets_one_probe_through_when_half_open(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(retry.time, 'monotonic', clock)
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    # a failed probe opens the circuit for another full timeout
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_budget_caps_retries_to_a_fraction_of_traffic(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(retry.time, 'monotonic', clock)
+    budget = RetryBudget(ratio=0.25, min_per_sec=0, max_tokens=100)
+    budget.tokens = 0
+    for _ in range(40):
+        budget.deposit()
+    allowed = sum(budget.withdraw() for _ in range(40))
+    assert allowed == 10
+
+
+def test_budget_refills_over_time_up_to_its_cap(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(retry.time, 'monotonic', clock)
+    budget = RetryBudget(ratio=0, min_per_sec=10, max_tokens=20)
+    while budget.withdraw():
+        pass
+    clock.now += 0.5
+    assert sum(budget.withdraw() for _ in range(10)) == 5
+    clock.now += 60
+    assert sum(budget.withdraw() for _ in range(100)) == 20
+
+
+def test_engine_stops_at_max_attempts_and_counts_exhaustion(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(retry.time, 'monotonic', clock)
+    budget = RetryBudget(ratio=0, min_per_sec=0, max_tokens=1)
+    budget.tokens = 1
+    engine = RetryEngine(RetryPolicy(max_attempts=3), budget)
+    assert engine.should_retry(56, 0)
+    assert not engine.should_retry(56, 1)
+    assert engine.stats.budget_exhausted == 1
+    assert not engine.should_retry(56, 2)
+    assert engine.stats.summary() == {56: {'retries': 1, 'drops': 0, 'short_circuits': 0}}
+    assert engine.breaker(56) is engine.breaker(56)
+
+
+def test_backoff_is_capped():
+    policy = RetryPolicy(base=0.5, cap=2.0)
+    assert all(0 <= policy.backoff(attempt) <= 2.0 for attempt in range(20))
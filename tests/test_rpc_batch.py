@@ -0,0 +1,88 @@
+import asyncio
+
+from utils.rpc_batch import MAX_REFUSALS, RpcBatcher
+
+
+class FakeEndpoint:
+    def __init__(self, batches: bool = True, reverse: bool = False, drop: int = None):
+        """
+        :param batches: answer batch arrays, otherwise reply to them with a single error object
+        :param reverse: answer batches in reverse order
+        :param drop: request id left out of batch replies
+        """
+        self.batches = batches
+        self.reverse = reverse
+        self.drop = drop
+        self.posts: list = []
+
+    async def send(self, _chain_id: int, payload):
+        self.posts.append(payload)
+        await asyncio.sleep(0)
+        if isinstance(payload, dict):
+            return {'jsonrpc': '2.0', 'id': payload['id'], 'result': [_chain_id, payload['params'][0]]}
+        if not self.batches:
+            return {'jsonrpc': '2.0', 'id': None, 'error': {'code': -32600, 'message': 'batches not supported'}}
+        ret = [{'jsonrpc': '2.0', 'id': p['id'], 'result': [_chain_id, p['params'][0]]}
+               for p in payload if p['id'] != self.drop]
+        return ret[::-1] if self.reverse else ret
+
+
+def test_responses_are_matched_by_id():
+    endpoint = FakeEndpoint(reverse=True)
+
+    async def run():
+        batcher = RpcBatcher(endpoint.send, max_batch=10, window=0.01)
+        return await asyncio.gather(*[batcher.call(56, 'eth_getBalance', [i]) for i in range(10)])
+
+    responses = asyncio.run(run())
+    assert [r['result'] for r in responses] == [[56, i] for i in range(10)]
+    assert len(endpoint.posts) == 1
+    ids = [p['id'] for p in endpoint.posts[0]]
+    assert ids == sorted(set(ids))
+
+
+def test_chains_are_batched_separately_and_missing_ids_resolve_to_none():
+    endpoint = FakeEndpoint(drop=2)
+
+    async def run():
+        batcher = RpcBatcher(endpoint.send, max_batch=10, window=0.01)
+        return await asyncio.gather(batcher.call(1, 'm', ['a']), batcher.call(1, 'm', ['b']),
+                                    batcher.call(56, 'm', ['c']))
+
+    a, b, c = asyncio.run(run())
+    assert a['result'] == [1, 'a']
+    assert b is None
+    assert c['result'] == [56, 'c']
+    assert len(endpoint.posts) == 2
+
+
+def test_refused_batch_falls_back_to_single_calls():
+    endpoint = FakeEndpoint(batches=False)
+
+    async def run():
+        batcher = RpcBatcher(endpoint.send, max_batch=5, window=0.01)
+        first = await asyncio.gather(*[batcher.call(1, 'm', [i]) for i in range(5)])
+        assert batcher.fallbacks == 1 and 1 not in batcher.unbatched
+        for _ in range(MAX_REFUSALS - 1):
+            await asyncio.gather(*[batcher.call(1, 'm', [i]) for i in range(5)])
+        posts = len(endpoint.posts)
+        last = await asyncio.gather(*[batcher.call(1, 'm', [i]) for i in range(5)])
+        return batcher, first, last, len(endpoint.posts) - posts
+
+    batcher, first, last, posts = asyncio.run(run())
+    assert [r['result'] for r in first] == [[1, i] for i in range(5)]
+    assert [r['result'] for r in last] == [[1, i] for i in range(5)]
+    assert 1 in batcher.unbatched
+    # once the chain is unbatched no array is sent, one post per call
+    assert posts == 5
+
+
+def test_transport_errors_reach_every_caller():
+    async def send(_chain_id, payload):
+        raise ConnectionError('down')
+
+    async def run():
+        batcher = RpcBatcher(send, max_batch=3, window=0.01)
+        return await asyncio.gather(*[batcher.call(1, 'm', [i]) for i in range(3)], return_exceptions=True)
+
+    assert all(isinstance(r, ConnectionError) for r in asyncio.run(run()))
@@ -0,0 +1,33 @@
+import math
+
+from utils.rpc_cache import RpcCache
+
+TX = '0x' + 'ab' * 32
+
+
+def tx(block_hash):
+    return {'jsonrpc': '2.0', 'id': 1, 'result': {'hash': TX, 'blockHash': block_hash,
+                                                   'blockNumber': None if block_hash is None else '0x10'}}
+
+
+def test_pending_transaction_is_not_pinned(tmp_path):
+    cache = RpcCache(db_file=str(tmp_path / 'cache.db'))
+    key, ttl, cached = cache.lookup(1, 'eth_getTransactionByHash', [TX])
+    assert ttl == math.inf and cached is None
+    cache.put(key, ttl, tx(None))
+    assert cache.lookup(1, 'eth_getTransactionByHash', [TX])[2] is None
+    assert cache.flush() == 0
+
+    # once mined it is pinned
+    cache.put(key, ttl, tx('0x' + 'cd' * 32))
+    assert cache.lookup(1, 'eth_getTransactionByHash', [TX])[2]['result']['blockNumber'] == '0x10'
+    assert cache.flush() == 1
+
+
+def test_errors_and_null_results_are_not_cached():
+    cache = RpcCache()
+    key, ttl, _ = cache.lookup(1, 'eth_getTransactionReceipt', [TX])
+    cache.put(key, ttl, {'jsonrpc': '2.0', 'id': 1, 'result': None})
+    cache.put(key, ttl, {'jsonrpc': '2.0', 'id': 1, 'error': {'code': -32000, 'message': 'busy'}})
+    assert cache.lookup(1, 'eth_getTransactionReceipt', [TX])[2] is None
+    assert cache.entries == {}
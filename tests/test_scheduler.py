@@ -0,0 +1,144 @@
+import asyncio
+import time
+
+import pytest
+
+from utils.errors import WriterFailed
+from utils.helpers import Acct
+from utils.scheduler import ChainScheduler
+
+
+def accounts(count: int) -> list[Acct]:
+    return [Acct(address='0x%040x' % i, key='0x%064x' % i) for i in range(1, count + 1)]
+
+
+def test_every_unit_runs_once():
+    seen = []
+
+    async def handler(acct, cid):
+        await asyncio.sleep(0)
+        seen.append((acct.address, cid))
+        return True
+
+    scheduler = ChainScheduler([1, 56, 137], global_limit=8, per_chain_limit=4)
+    asyncio.run(scheduler.run(accounts(50), handler))
+    assert sorted(seen) == sorted((a.address, c) for a in accounts(50) for c in (1, 56, 137))
+    assert scheduler.completed == {1: 50, 56: 50, 137: 50}
+
+
+def test_duplicate_chain_ids_are_scanned_once():
+    seen = []
+
+    async def handler(acct, cid):
+        seen.append(cid)
+
+    scheduler = ChainScheduler([321, 1, 321], global_limit=4, per_chain_limit=2)
+    asyncio.run(scheduler.run(accounts(10), handler))
+    assert scheduler.chain_ids == [321, 1]
+    assert seen.count(321) == 10
+
+
+def test_global_and_per_chain_limits_hold():
+    in_flight = {'all': 0, 'peak': 0}
+    per_chain = {1: 0, 56: 0}
+    peak_chain = {1: 0, 56: 0}
+
+    async def handler(acct, cid):
+        in_flight['all'] += 1
+        per_chain[cid] += 1
+        in_flight['peak'] = max(in_flight['peak'], in_flight['all'])
+        peak_chain[cid] = max(peak_chain[cid], per_chain[cid])
+        await asyncio.sleep(0.001)
+        in_flight['all'] -= 1
+        per_chain[cid] -= 1
+
+    scheduler = ChainScheduler([1, 56], global_limit=5, per_chain_limit=4)
+    asyncio.run(scheduler.run(accounts(40), handler))
+    assert in_flight['peak'] <= 5
+    assert max(peak_chain.values()) <= 4
+
+
+def test_skip_and_errors():
+    done = []
+
+    async def handler(acct, cid):
+        if acct.address.endswith('3'):
+            raise ValueError('bad unit')
+        return acct.address
+
+    async def on_done(acct, cid, result):
+        done.append((acct.address, cid, result))
+
+    scheduler = ChainScheduler([1, 56], global_limit=4, per_chain_limit=2,
+                               skip=lambda acct, cid: cid == 56 and acct.address.endswith('1'))
+    asyncio.run(scheduler.run(accounts(5), handler, on_done))
+    assert scheduler.skipped == 1
+    assert scheduler.errors == {1: 1, 56: 1}
+    # a failed unit is still reported, with a None result
+    assert ('0x%040x' % 3, 1, None) in done
+    assert len(done) == 9
+
+
+def test_failing_on_done_aborts_the_run():
+    async def handler(acct, cid):
+        return True
+
+    def on_done(acct, cid, result):
+        if acct.address.endswith('5'):
+            raise WriterFailed('disk full')
+
+    async def run():
+        # small queues, a dead worker used to leave the feeder blocked forever
+        scheduler = ChainScheduler([1, 56], global_limit=2, per_chain_limit=1, queue_size=1)
+        await asyncio.wait_for(scheduler.run(accounts(100), handler, on_done), 5)
+
+    with pytest.raises(WriterFailed):
+        asyncio.run(run())
+
+
+def test_writer_failure_in_handler_aborts_the_run():
+    async def handler(acct, cid):
+        # ie ScanSession.update_wallet writing to a store whose thread died
+        raise WriterFailed('database is locked')
+
+    async def run():
+        scheduler = ChainScheduler([1, 56], global_limit=2, per_chain_limit=1, queue_size=1)
+        await asyncio.wait_for(scheduler.run(accounts(100), handler), 5)
+
+    with pytest.raises(WriterFailed):
+        asyncio.run(run())
+
+
+def test_weights_do_not_pace_the_scan():
+    async def handler(acct, cid):
+        await asyncio.sleep(0.02)
+        return True
+
+    def timed(weights):
+        scheduler = ChainScheduler([1, 56, 137], global_limit=100, per_chain_limit=50, weights=weights)
+        started = time.monotonic()
+        asyncio.run(scheduler.run(accounts(300), handler))
+        assert scheduler.completed == {1: 300, 56: 300, 137: 300}
+        return time.monotonic() - started
+
+    unweighted = timed(None)
+    # a low weight chain used to get a single worker and the lockstep feed waited on it
+    assert timed({137: 0.03}) < unweighted * 2 + 0.2
+
+
+def test_weights_order_contended_slots():
+    def finish_order(weights):
+        order = []
+
+        async def handler(acct, cid):
+            order.append(cid)
+            await asyncio.sleep(0.001)
+            return True
+
+        # two global slots, three chains always have a unit waiting for one
+        scheduler = ChainScheduler([56, 137, 1], global_limit=2, per_chain_limit=2, weights=weights)
+        asyncio.run(scheduler.run(accounts(10), handler))
+        return sorted((56, 137, 1), key=lambda cid: len(order) - order[::-1].index(cid))
+
+    assert finish_order({56: 0.1, 137: 0.5, 1: 1.0}) == [1, 137, 56]
+    assert finish_order({56: 1.0, 137: 0.5, 1: 0.1}) == [56, 137, 1]
@@ -0,0 +1,109 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from data.constants import ZERO_ADDRESS
+from utils.errors import WriterFailed
+from utils.storage import SqliteStore, migrate
+
+TOKEN = '0x' + 'a' * 40
+
+# the tokens db schema before the tables were keyed by chain
+OLD_SCHEMA = (
+    'CREATE TABLE contracts (contract_address TEXT PRIMARY KEY, chain_id TEXT, decimals INTEGER)',
+    'CREATE TABLE accounts (address TEXT PRIMARY KEY, key TEXT)',
+    'CREATE TABLE account_tokens (account_address TEXT, contract_address TEXT, chain_id TEXT, balance REAL, '
+    'PRIMARY KEY (account_address, contract_address), '
+    'FOREIGN KEY (contract_address) REFERENCES contracts (contract_address))',
+)
+
+
+def old_db(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    for statement in OLD_SCHEMA:
+        conn.execute(statement)
+    conn.execute("INSERT INTO contracts VALUES (?, '56', 18)", (TOKEN,))
+    conn.execute("INSERT INTO accounts VALUES ('0x1', 'k1')")
+    conn.execute("INSERT INTO account_tokens VALUES ('0x1', ?, '56', 2.5)", (TOKEN,))
+    conn.commit()
+    return conn
+
+
+def primary_key(conn: sqlite3.Connection, table: str) -> list[str]:
+    cols = conn.execute('PRAGMA table_info(%s)' % table).fetchall()
+    return [c[1] for c in sorted(cols, key=lambda c: c[5]) if c[5]]
+
+
+def test_migrate_rebuilds_old_tables_with_chain_keys(tmp_path):
+    conn = old_db(str(tmp_path / 'tokens.db'))
+    migrate(conn)
+    assert primary_key(conn, 'contracts') == ['chain_id', 'contract_address']
+    assert primary_key(conn, 'account_tokens') == ['account_address', 'chain_id', 'contract_address']
+    assert conn.execute('SELECT chain_id, contract_address, decimals, symbol, name FROM contracts').fetchall() == [
+        (56, TOKEN, 18, None, None)]
+    assert conn.execute('SELECT account_address, chain_id, contract_address, balance FROM account_tokens').fetchall() == [
+        ('0x1', 56, TOKEN, 2.5)]
+    assert conn.execute('SELECT * FROM accounts').fetchall() == [('0x1', 'k1')]
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert tables == {'contracts', 'accounts', 'account_tokens'}
+    # the same address on another chain no longer collides
+    conn.execute("INSERT INTO contracts (chain_id, contract_address, decimals) VALUES (1, ?, 6)", (TOKEN,))
+    conn.close()
+
+
+def test_migrate_is_idempotent(tmp_path):
+    conn = old_db(str(tmp_path / 'tokens.db'))
+    migrate(conn)
+    migrate(conn)
+    assert conn.execute('SELECT COUNT(*) FROM contracts').fetchone()[0] == 1
+    assert conn.execute('SELECT COUNT(*) FROM account_tokens').fetchone()[0] == 1
+    conn.close()
+
+
+def test_migrate_adds_symbol_and_name_to_chain_keyed_contracts(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'tokens.db'))
+    conn.execute('CREATE TABLE contracts (chain_id INTEGER, contract_address TEXT, decimals INTEGER, '
+                 'PRIMARY KEY (chain_id, contract_address)) WITHOUT ROWID')
+    conn.execute('INSERT INTO contracts VALUES (1, ?, 6)', (TOKEN,))
+    conn.commit()
+    migrate(conn)
+    assert conn.execute('SELECT * FROM contracts').fetchall() == [(1, TOKEN, 6, None, None)]
+    conn.close()
+
+
+def test_store_writes_and_reads_back(tmp_path):
+    db_file = str(tmp_path / 'tokens.db')
+
+    async def run():
+        store = SqliteStore(db_file, flush_interval=0.05)
+        store.start()
+        store.write({'address': '0x1', 'key': 'k1', 'result': {
+            'native': str(10 ** 18), 'tokens': [{'address': TOKEN, 'amount': '2500000', 'decimals': 6}]}}, 1)
+        await store.close()
+        return store
+
+    store = asyncio.run(run())
+    assert store.written == 1
+    assert sorted(store.wallet('0x1')) == sorted([(1, ZERO_ADDRESS, str(10 ** 18), 1.0), (1, TOKEN, '2500000', 2.5)])
+    assert store.holders(1, TOKEN) == [('0x1', '2500000', 2.5)]
+    asyncio.run(store.close())
+
+
+def test_thread_failure_is_raised_from_write_and_close(tmp_path):
+    db_file = str(tmp_path / 'tokens.db')
+
+    async def run():
+        store = SqliteStore(db_file, flush_interval=0.05)
+        store.start()
+        # not a wallet result, kills the writer thread
+        store.write({'address': '0x1', 'key': 'k1', 'result': {'native': 'nan'}}, 1)
+        await asyncio.to_thread(store._thread.join, 5)
+        assert not store._thread.is_alive()
+        with pytest.raises(WriterFailed):
+            store.write({'address': '0x2', 'key': 'k2', 'result': {'native': '0', 'tokens': []}}, 1)
+        with pytest.raises(WriterFailed) as raised:
+            await store.close()
+        assert isinstance(raised.value.__cause__, ValueError)
+
+    asyncio.run(run())
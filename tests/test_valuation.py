@@ -0,0 +1,44 @@
+import numpy as np
+
+from data.constants import ZERO_ADDRESS
+from utils.holdings import HoldingsStore
+from utils.token_registry import TokenRegistry
+from utils.valuation import report_entries, value_holdings
+
+USDC = '0x' + 'a' * 40
+WBTC = '0x' + 'b' * 40
+
+
+def build() -> tuple[HoldingsStore, np.ndarray]:
+    registry = TokenRegistry()
+    registry.register(1, USDC, 6, 'USDC', 'USD Coin')
+    registry.register(1, WBTC, 8, 'WBTC', 'Wrapped BTC')
+    store = HoldingsStore(registry)
+    store.add('0x1', 'k1', 1, ZERO_ADDRESS, 2 * 10 ** 18, 18)
+    store.add('0x1', 'k1', 1, USDC, 5 * 10 ** 6, 6)
+    store.add('0x1', 'k1', 56, ZERO_ADDRESS, 10 ** 18, 18)
+    store.add('0x2', 'k2', 1, WBTC, 10 ** 8, 8)
+    prices = np.zeros(len(registry))
+    prices[registry.get((1, ZERO_ADDRESS))] = 3000.0
+    prices[registry.get((1, USDC))] = 1.0
+    prices[registry.get((1, WBTC))] = 60000.0
+    return store, prices
+
+
+def test_entries_match_the_valuation():
+    store, prices = build()
+    valuation = value_holdings(store, prices)
+    entries = list(report_entries(store, valuation, prices))
+    assert [(e['address'], e['cid']) for e in entries] == [('0x1', 1), ('0x1', 56), ('0x2', 1)]
+    assert [t['address'] for t in entries[0]['tokens']] == [ZERO_ADDRESS, USDC]
+    assert entries[0]['value'] == 6005.0
+    assert entries[0]['tokens'][1] == {'address': USDC, 'symbol': 'USDC', 'name': 'USD Coin', 'amount': 5 * 10 ** 6,
+                                       'decimals': 6, 'price': 1.0, 'balance': 5.0, 'value': 5.0}
+    assert entries[1]['value'] == 0.0
+    assert entries[2]['tokens'][0]['balance'] == 1.0 and entries[2]['value'] == 60000.0
+    assert sum(e['value'] for e in entries) == valuation.total
+
+
+def test_no_holdings_no_entries():
+    store = HoldingsStore()
+    assert list(report_entries(store, value_holdings(store, []), [])) == []
@@ -2,14 +2,17 @@ import asyncio
 import json
 from typing import Union, Tuple, Any
 
-import aiohttp
+import httpx
+
+from utils import transport
 
 
 class AsyncHttpClient:
     def __init__(self, _headers=None, base_url: str = None, timeout: Union[int, float] = 60):
         """
         A skeletal asynchronous HTTP class. Because I found myself writing this same code
-        hundreds of times, I decided to just write a reusable module.
+        hundreds of times, I decided to just write a reusable module. Requests go through the
+        process wide connection pool in `utils.transport`.
         :param _headers:
         :param base_url:
         :param timeout:
@@ -18,42 +21,45 @@ class AsyncHttpClient:
             _headers = {}
         self.timeout_secs: Union[int, float] = timeout
         self.base_url: str = base_url
-        self._session: Union[aiohttp.ClientSession, None] = None
+        self._session: Union[httpx.AsyncClient, None] = None
         self.is_a_initialized: bool = False
         self.global_headers: dict = _headers
 
     async def __ainit__(self):
         """
-        async __init__ , this must be awaited to create the client session
+        async __init__ , this must be awaited to attach to the shared connection pool
         :return:
         """
-        timeout = aiohttp.ClientTimeout(total=self.timeout_secs, connect=(self.timeout_secs / 3),
-                              sock_connect=(self.timeout_secs / 3), sock_read=(self.timeout_secs / 3))
-        self._session: aiohttp.ClientSession = aiohttp.ClientSession(headers=self.global_headers,
-                                                                     base_url=self.base_url,
-                                                                     timeout=timeout)
+        self._timeout = httpx.Timeout(self.timeout_secs, connect=self.timeout_secs / 3)
+        self._session = transport.get_client()
         self.is_a_initialized = True
 
     async def __aclose__(self):
-        self._session: aiohttp.ClientSession
-        await self._session.close()
+        # the pool is shared, closing it is up to whoever owns the process (transport.aclose)
+        self._session = None
+        self.is_a_initialized = False
+
+    def _url(self, path: str) -> str:
+        if self.base_url and not path.startswith(('http://', 'https://')):
+            return self.base_url.rstrip('/') + '/' + path.lstrip('/')
+        return path
 
-    async def parse_response(self, response: aiohttp.ClientResponse) -> tuple[int, bytes | Any]:
+    async def parse_response(self, response: httpx.Response) -> tuple[int, bytes | Any]:
         """
 
         :param response: client response object
         :return: status code, (either json dict, OR bytes if the content was not json)
         """
 
-        status = response.status
+        status = response.status_code
 
         if status == 200:
             try:
-                resp = await response.json(content_type=None)
+                resp = response.json()
             except json.JSONDecodeError:
-                resp = await response.read()
+                resp = response.content
         else:
-            resp = await response.read()
+            resp = response.content
         return status, resp
 
     async def post(self, path: str, data=None, verify_ssl: bool = False, _headers_overide: dict = None) -> tuple[
@@ -63,7 +69,7 @@ class AsyncHttpClient:
         :param _headers_overide:
         :param path: URL
         :param data: payload
-        :param verify_ssl: ignore ssl warnings
+        :param verify_ssl: unused, certificate checks are set on the shared pool
         :return: status, resp
         """
         if data is None:
@@ -72,9 +78,8 @@ class AsyncHttpClient:
             _headers = _headers_overide
         else:
             _headers = self.global_headers
-        session: aiohttp.ClientSession = self._session
-        async with session.post(url=path, json=data, verify_ssl=verify_ssl, headers=_headers) as response:
-            return await self.parse_response(response)
+        response = await self._session.post(self._url(path), json=data, headers=_headers, timeout=self._timeout)
+        return await self.parse_response(response)
 
     async def get(self, path: str, params=None, verify_ssl: bool = False, _headers_overide: dict = None) -> tuple[
         int, bytes | Any]:
@@ -83,7 +88,7 @@ class AsyncHttpClient:
         :param _headers_overide:
         :param path: URL
         :param params: query parameters (ie ?&param=value)
-        :param verify_ssl: bool
+        :param verify_ssl: unused, certificate checks are set on the shared pool
         :return: status, resp
         """
         if params is None:
@@ -92,10 +97,8 @@ class AsyncHttpClient:
             _headers = _headers_overide
         else:
             _headers = self.global_headers
-        async with self._session.get(url=path, params=params, verify_ssl=verify_ssl, headers=_headers) as response:
-            response: aiohttp.ClientResponse
-            # print(response.request_info)
-            return await self.parse_response(response)
+        response = await self._session.get(self._url(path), params=params, headers=_headers, timeout=self._timeout)
+        return await self.parse_response(response)
 
     async def request(self, method: str, *args, **kwargs) -> tuple[
         int, bytes | Any]:
@@ -113,13 +116,10 @@ class AsyncHttpClient:
             coro = fn(*args, **kwargs)
             try:
                 status, resp = await coro
-            except (aiohttp.ClientResponseError, aiohttp.ClientConnectorError, aiohttp.ServerDisconnectedError,
-                    aiohttp.ClientOSError) as err:
-                print('[!] HTTP Request error %s' % err)
-            except asyncio.exceptions.TimeoutError:
+            except httpx.TimeoutException:
                 print('[!] Timed out ...  ')
-            except aiohttp.ClientConnectorSSLError as err:
-                print('[!] ssl error %s with: ' % err)
+            except httpx.HTTPError as err:
+                print('[!] HTTP Request error %s' % err)
             except ValueError as err:
                 print('[!] invalid ?: %s' % err)
             finally:
@@ -135,7 +135,8 @@ class AsyncHttpClient:
         if not self.is_a_initialized:
             await self.__ainit__()
         s, ret = await self.request(method, path=url_path)
-        await self._session.close()
+        await self.__aclose__()
+        await transport.aclose()
         if s == 200:
             if type(ret) is bytes:
                 return ret.decode()
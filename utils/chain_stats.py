@@ -0,0 +1,100 @@
+import sqlite3
+import time
+from typing import Union
+
+from data.constants import CACHE_DB
+
+
+class ChainStats:
+    def __init__(self, db_file: str = CACHE_DB, min_samples: int = 100):
+        """
+        Per chain hit rates learned from earlier scans, stored in the `chain_stats` table of the cache
+        db. A hit is a (wallet, chain) unit that held anything. Rates are smoothed, (hits + 1) /
+        (scanned + 2), so a chain that was never scanned starts at 0.5 and is explored early instead of
+        being written off.
+        :param db_file: sqlite database path
+        :param min_samples: units a chain must have been scanned for before it can be skipped
+        """
+        self.db_file = db_file
+        self.min_samples = min_samples
+        self.history: dict[int, tuple[int, int]] = {}
+        self.scanned: dict[int, int] = {}
+        self.hits: dict[int, int] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_file)
+        conn.execute('CREATE TABLE IF NOT EXISTS chain_stats (chain_id INTEGER PRIMARY KEY, scanned INTEGER, '
+                     'hits INTEGER, updated REAL)')
+        return conn
+
+    def load(self) -> int:
+        """
+        Load the stats of earlier scans (blocking, run it in a thread)
+        :return: number of chains with history
+        """
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT chain_id, scanned, hits FROM chain_stats').fetchall()
+        finally:
+            conn.close()
+        self.history = {cid: (scanned, hits) for cid, scanned, hits in rows}
+        return len(self.history)
+
+    def record(self, _chain_id: int, hit: bool):
+        self.scanned[_chain_id] = self.scanned.get(_chain_id, 0) + 1
+        if hit:
+            self.hits[_chain_id] = self.hits.get(_chain_id, 0) + 1
+
+    def flush(self) -> int:
+        """
+        Add this run's counts to the stored ones (blocking, run it in a thread)
+        :return: number of chains written
+        """
+        now = time.time()
+        rows = [(cid, scanned, self.hits.get(cid, 0), now) for cid, scanned in self.scanned.items()]
+        if not rows:
+            return 0
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany('INSERT INTO chain_stats (chain_id, scanned, hits, updated) VALUES (?, ?, ?, ?) '
+                                 'ON CONFLICT (chain_id) DO UPDATE SET scanned = scanned + excluded.scanned, '
+                                 'hits = hits + excluded.hits, updated = excluded.updated', rows)
+        finally:
+            conn.close()
+        for cid, scanned, hits, _ in rows:
+            old_scanned, old_hits = self.history.get(cid, (0, 0))
+            self.history[cid] = (old_scanned + scanned, old_hits + hits)
+        self.scanned.clear()
+        self.hits.clear()
+        return len(rows)
+
+    def hit_rate(self, _chain_id: int) -> float:
+        scanned, hits = self.history.get(_chain_id, (0, 0))
+        return (hits + 1) / (scanned + 2)
+
+    def order(self, chain_ids: list[int]) -> list[int]:
+        """
+        :return: the chains sorted from highest to lowest hit rate
+        """
+        return sorted(chain_ids, key=self.hit_rate, reverse=True)
+
+    def weights(self, chain_ids: list[int]) -> dict[int, float]:
+        """
+        :return: each chain's hit rate relative to the best one, in (0, 1]
+        """
+        if not chain_ids:
+            return {}
+        best = max(self.hit_rate(cid) for cid in chain_ids)
+        return {cid: self.hit_rate(cid) / best for cid in chain_ids}
+
+    def below(self, chain_ids: list[int], min_yield: float) -> list[int]:
+        """
+        :return: the chains with enough history whose hit rate is below `min_yield`
+        """
+        return [cid for cid in chain_ids
+                if self.history.get(cid, (0, 0))[0] >= self.min_samples and self.hit_rate(cid) < min_yield]
+
+    def summary(self) -> dict[int, dict[str, Union[int, float]]]:
+        return {cid: {'scanned': scanned, 'hits': hits, 'hit_rate': self.hit_rate(cid)}
+                for cid, (scanned, hits) in self.history.items()}
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import os
+from typing import Any, Awaitable, Callable, Union
+
+from utils.helpers import async_iter_lines
+from utils.result_writer import NdjsonWriter
+
+
+class CheckpointLog:
+    def __init__(self, log_file: str, flush_every: int = 200):
+        """
+        Append-only NDJSON log of finished (address, chain) units. One line per unit:
+        {"a": address, "c": chain id, "r": wallet result or null if it was empty}. Units whose request
+        was dropped are never logged, so a resumed scan retries them. The report is not read back
+        from it: logged results are restored into the HoldingsStore on resume, and the report is built
+        from that store's Valuation.
+        :param log_file: path of the log
+        :param flush_every: records buffered before they are appended to disk
+        """
+        self.log_file = log_file
+        self.flush_every = flush_every
+        self._writer: Union[NdjsonWriter, None] = None
+        # address -> bitmask of finished chains, far smaller than a set of (address, chain) tuples
+        self._done: dict[str, int] = {}
+        self._bits: dict[int, int] = {}
+
+    def _bit(self, _chain_id: int) -> int:
+        bit = self._bits.get(_chain_id)
+        if bit is None:
+            bit = self._bits[_chain_id] = 1 << len(self._bits)
+        return bit
+
+    def _mark(self, address: str, _chain_id: int):
+        self._done[address] = self._done.get(address, 0) | self._bit(int(_chain_id))
+
+    def completed(self, address: str, _chain_id: int) -> bool:
+        return bool(self._done.get(address, 0) & self._bit(int(_chain_id)))
+
+    async def load(self, on_result: Callable[[dict, int], Union[Awaitable[None], None]] = None) -> tuple[int, int]:
+        """
+        Rebuild state from an existing log in a single streaming pass
+        :param on_result: called with (wallet result, chain id) for every logged non empty result
+        :return: (units restored, of which had results)
+        """
+        units = results = 0
+        if not os.path.exists(self.log_file):
+            return units, results
+        async for lines in async_iter_lines(self.log_file):
+            for line in lines:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line of a crashed run may be cut short
+                    continue
+                self._mark(record['a'], record['c'])
+                units += 1
+                if record.get('r'):
+                    results += 1
+                    if on_result is not None:
+                        ret = on_result(record['r'], int(record['c']))
+                        if asyncio.iscoroutine(ret):
+                            await ret
+        return units, results
+
+    def _repair_tail(self):
+        """
+        Make the log end on a complete line before it is appended to. A last line cut short by a crash
+        (the one `load` skips) is truncated away, otherwise the first record of the resumed run would
+        be glued onto it and lost too. A last line that is whole but lacks its newline gets one.
+        """
+        with open(self.log_file, 'rb+') as f:
+            start = f.seek(0, os.SEEK_END)
+            tail = b''
+            newline = -1
+            while start > 0 and newline == -1:
+                step = min(1 << 16, start)
+                start -= step
+                f.seek(start)
+                tail = f.read(step) + tail
+                newline = tail.rfind(b'\n')
+            last = tail[newline + 1:]
+            if not last.strip():
+                return
+            try:
+                json.loads(last)
+            except ValueError:
+                f.truncate(start + newline + 1)
+                return
+            f.seek(0, os.SEEK_END)
+            f.write(b'\n')
+
+    def open(self, resume: bool = False):
+        """
+        :param resume: append to the existing log instead of starting a new one
+        """
+        if resume and os.path.exists(self.log_file):
+            self._repair_tail()
+        self._writer = NdjsonWriter(self.log_file, append=resume, batch_size=self.flush_every)
+        self._writer.start()
+
+    async def record(self, address: str, _chain_id: int, result: Union[dict, Any, None]):
+        self._mark(address, _chain_id)
+        self._writer.write({'a': address, 'c': _chain_id, 'r': result or None})
+
+    async def close(self):
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
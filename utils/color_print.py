@@ -1,4 +1,8 @@
-from typing import Any
+import atexit
+import sys
+import threading
+import time
+from typing import Any, TextIO, Union
 
 
 class Ansi:
@@ -47,7 +51,17 @@ class Ansi:
 
 
 class ColorPrint:
-    def __init__(self, verbosity: int):
+    def __init__(self, verbosity: int, buffered: bool = False, flush_interval: float = 0.5, summary: bool = False,
+                 summary_interval: float = 10.0, stream: TextIO = None):
+        """
+        :param verbosity: -v count, debug lines need 3
+        :param buffered: collect lines in memory and write them out in one go every `flush_interval`
+        :param flush_interval: seconds between writes of the buffer
+        :param summary: do not print per item lines (`item`), print their count and total value every
+                        `summary_interval` seconds instead
+        :param summary_interval: seconds between summaries
+        :param stream: where to write, stdout by default
+        """
         self.verb = verbosity
         self.place_holder = '__TEXT__'
         self.verb_map = {
@@ -57,28 +71,101 @@ class ColorPrint:
             3: Ansi.CRED + '[' + Ansi.CBLACK + '!' + Ansi.CRED + '] ' + self.place_holder + Ansi.CEND,
             4: Ansi.CVIOLET2 + '[' + Ansi.CYELLOW + 'debug' + Ansi.CVIOLET2 + '] ' + self.place_holder + Ansi.CRED2
         }
+        self.buffered = buffered
+        self.flush_interval = flush_interval
+        self.summary = summary
+        self.summary_interval = summary_interval
+        self.stream = stream
+        self._buffer: list[str] = []
+        self._lock = threading.Lock()
+        self._items = 0
+        self._items_value = 0.0
+        self._last_summary = time.monotonic()
+        self._stop = threading.Event()
+        self._thread: Union[threading.Thread, None] = None
+        if buffered or summary:
+            self._thread = threading.Thread(target=self._run, name='color-print', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
 
-    def output(self, text: Any):
-        text = "%s%s" % (text, Ansi.CEND)
-        print(self.verb_map.get(0).replace(self.place_holder, text))
+    def _write(self, lines: list[str]):
+        stream = self.stream if self.stream is not None else sys.stdout
+        stream.write('\n'.join(lines) + '\n')
+        stream.flush()
 
-    def notice(self, text: Any):
-        text = "%s%s" % (text, Ansi.CEND)
-        print(self.verb_map.get(1).replace(self.place_holder, text))
+    def _emit(self, level: int, text: Any, args: tuple):
+        # formatting only happens here, once a line is known to be printed
+        text = text % args if args else text
+        line = self.verb_map.get(level).replace(self.place_holder, "%s%s" % (text, Ansi.CEND))
+        if not self.buffered:
+            self._write([line])
+            return
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) >= 10000:
+                self._flush()
 
-    def warning(self, text: Any):
-        text = "%s%s" % (text, Ansi.CEND)
-        print(self.verb_map.get(2).replace(self.place_holder, text))
+    def _flush(self):
+        if self._buffer:
+            lines, self._buffer = self._buffer, []
+            self._write(lines)
 
-    def error(self, text: Any):
-        text = "%s%s" % (text, Ansi.CEND)
-        print(self.verb_map.get(3).replace(self.place_holder, text))
+    def flush(self):
+        with self._lock:
+            self._flush()
 
-    def debug(self, text: Any):
+    def _summarize(self):
+        with self._lock:
+            items, value = self._items, self._items_value
+            self._items, self._items_value = 0, 0.0
+            self._last_summary = time.monotonic()
+        if items:
+            self._emit(0, '%s items, total value %s', (items, value))
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            if self.summary and time.monotonic() - self._last_summary >= self.summary_interval:
+                self._summarize()
+            self.flush()
+
+    def close(self):
+        """
+        Stop the background writer, print the last summary and write out whatever is buffered
+        """
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        if self.summary:
+            self._summarize()
+        self.flush()
+
+    def output(self, text: Any, *args: Any):
+        self._emit(0, text, args)
+
+    def notice(self, text: Any, *args: Any):
+        self._emit(1, text, args)
+
+    def warning(self, text: Any, *args: Any):
+        self._emit(2, text, args)
+
+    def error(self, text: Any, *args: Any):
+        self._emit(3, text, args)
+
+    def debug(self, text: Any, *args: Any):
         # NOTE: prints of -vvv is supplied.
-        text = "%s%s" % (text, Ansi.CEND)
         if self.verb >= 3:
-            print(self.verb_map.get(4).replace(self.place_holder, text))
+            self._emit(4, text, args)
+
+    def item(self, text: Any, *args: Any, value: float = 0.0):
+        """
+        One per item (wallet, address) line. In summary mode it is only counted, with its value.
+        """
+        if self.summary:
+            with self._lock:
+                self._items += 1
+                self._items_value += value
+            return
+        self._emit(0, text, args)
 
     def print(self, text: Any, verbosity: int = 0):
         if self.verb_map.get(verbosity):
@@ -1,36 +1,54 @@
+import atexit
 import logging
-import inspect
+import logging.handlers
 import os
-import logging
-import inspect
+import queue
+import sys
+from typing import Union
+
+_listener: Union[logging.handlers.QueueListener, None] = None
+
+
+class CallSiteFilter(logging.Filter):
+    def filter(self, record):
+        """
+        Tag the record with the `Class.func` it was logged from. Logger filters run in the caller's
+        thread before the record is queued, with the calling frame only a few frames up: walk
+        `f_back` to it instead of materializing the whole stack with inspect.stack().
+        """
+        frame = sys._getframe(1)
+        while frame is not None:
+            code = frame.f_code
+            if code.co_name == record.funcName and frame.f_lineno == record.lineno:
+                qualname = getattr(code, 'co_qualname', None)
+                if qualname is None:
+                    # python < 3.11, fall back to the class of `self`
+                    instance = frame.f_locals.get('self') if code.co_varnames[:1] == ('self',) else None
+                    qualname = '%s.%s' % (type(instance).__name__, code.co_name) if instance else code.co_name
+                record.context = qualname.replace('.<locals>', '')
+                return True
+            frame = frame.f_back
+        record.context = record.funcName
+        return True
+
 
 class CustomFormatter(logging.Formatter):
-    def format(self, record):
-        # Get the function name from the record
-        func_name = record.funcName
-
-        # Use inspect to get the class name
-        class_name = ''
-        for frame_info in inspect.stack():
-            # Check if the function name matches
-            if frame_info.function == func_name:
-                args, _, _, value_dict = inspect.getargvalues(frame_info.frame)
-                if len(args) and args[0] == 'self':
-                    instance = value_dict.get('self', None)
-                    if instance:
-                        class_name = instance.__class__.__name__ + '.'
-                break
-
-        # Check if class and function name are already in the message
-        if f"{class_name}{func_name}" not in record.msg:
-            record.msg = f"{class_name}{func_name} - {record.msg}"
-
-        return super(CustomFormatter, self).format(record)
+    def formatMessage(self, record):
+        # the message itself is left alone, so formatting twice never stacks prefixes
+        record.message = f"{getattr(record, 'context', record.funcName)} - {record.message}"
+        return super(CustomFormatter, self).formatMessage(record)
 
 # Set up logging as before
 
 def get_logger() -> logging.Logger:
+    """
+    :return: the shared logger. Handlers are configured on the first call only: records go through
+             a QueueHandler, and the file and stream output happen on a QueueListener thread.
+    """
+    global _listener
     _logger = logging.getLogger(__name__)
+    if _listener is not None:
+        return _logger
     _logger.setLevel(logging.DEBUG)
     script_name = os.path.basename(__file__)
     log_file_name = f"{os.path.splitext(script_name)[0]}.log"
@@ -41,8 +59,12 @@ def get_logger() -> logging.Logger:
     formatter = CustomFormatter('%(asctime)s  - %(levelname)s - %(message)s')
     ch.setFormatter(formatter)
     fh.setFormatter(formatter)
-    _logger.addHandler(fh)
-    _logger.addHandler(ch)
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    _logger.addFilter(CallSiteFilter())
+    _logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    _listener = logging.handlers.QueueListener(log_queue, fh, ch, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
     return _logger
 
 
@@ -55,4 +77,5 @@ if __name__ == '__main__':
     # Example usage
     logger = get_logger()
     my_instance = MyClass()
-    my_instance.my_function()
\ No newline at end of file
+    my_instance.my_function()
+    get_logger().error("Configured once: %s", 'logged a single time')
@@ -1,2 +1,6 @@
 class DotenvNotConfigured(Exception):
     pass
+
+
+class WriterFailed(Exception):
+    pass
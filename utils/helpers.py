@@ -1,10 +1,11 @@
 import asyncio
 import binascii
+import hashlib
 import json
 import os
 import os.path
 import os.path as path
-from typing import Union
+from typing import AsyncIterator, Union
 
 import aiofiles
 import trio
@@ -16,6 +17,7 @@ from hexbytes import HexBytes
 
 from data import constants
 from data.constants import NULL_KEY
+from utils.key_derivation import KeyDeriver, classify
 
 
 class Acct:
@@ -33,6 +35,16 @@ class Acct:
     def as_dict(self) -> dict:
         return json.loads(self.to_json())
 
+    @classmethod
+    def from_derived(cls, key: Union[str, bytes], address: ChecksumAddress) -> 'Acct':
+        """
+        Build from an address that is already checksummed (ie by `KeyDeriver`) without hashing it again
+        """
+        acct = cls.__new__(cls)
+        acct.key = HexBytes(key)
+        acct.address = address
+        return acct
+
     @classmethod
     def from_json(cls, json_or_str: Union[str, dict]) -> object:
         if type(json_or_str) is str:
@@ -46,6 +58,8 @@ class Acct:
 
 
 def parse_key(key: str) -> Acct | None:
+    if classify(key) == 2:
+        return Acct(key=NULL_KEY, address=key)
     try:
         account = Account.from_key(key)
     except (ValueError, binascii.Error):
@@ -148,6 +162,9 @@ async def async_read_as_lines(file: str) -> list[str]:
 
 
 def load_account(key: Union[HexBytes, str, bytes]):
+    if type(key) is str and classify(key) == 2:
+        # plain address, skip the key derivation attempt
+        return Acct(address=key, key=constants.NULL_KEY)
     try:
         account = web3.Account.from_key(key)
     except (ValueError, binascii.Error):
@@ -201,6 +218,88 @@ async def async_load_eth_keys(file_or_str: str) -> list[Acct | None] | list[Acct
             return [Acct(_acct.key.hex(), _acct.address)]
 
 
+async def async_iter_lines(file: str, block_size: int = 1 << 16) -> AsyncIterator[list[str]]:
+    """
+    Stream a file as lists of stripped lines, one list per block read, without ever holding the
+    whole file in memory
+    :param file: path
+    :param block_size: bytes per read
+    """
+    async with aiofiles.open(file, 'r') as f:
+        remainder = ''
+        while True:
+            block = await f.read(block_size)
+            if not block:
+                break
+            lines = (remainder + block).split('\n')
+            remainder = lines.pop()
+            yield [line.strip('\r\n') for line in lines]
+        if remainder.strip('\r\n'):
+            yield [remainder.strip('\r\n')]
+
+
+async def async_iter_key_lines(file: str, chunk_size: int = 1000, first_chunk: int = 16) -> AsyncIterator[list[str]]:
+    """
+    Chunk the non empty lines of a key file. Chunks start small and double up to `chunk_size` to
+    get the first keys through the pipeline fast.
+    """
+    pending: list[str] = []
+    size = min(first_chunk, chunk_size)
+    async for lines in async_iter_lines(file):
+        pending.extend(line for line in lines if line)
+        while len(pending) >= size:
+            chunk, pending = pending[:size], pending[size:]
+            yield chunk
+            size = min(size * 2, chunk_size)
+    if pending:
+        yield pending
+
+
+def address_hash(address: str) -> int:
+    """
+    :return: 64 bit blake2b digest of an address, collisions are negligible below billions of keys
+    """
+    return int.from_bytes(hashlib.blake2b(address.encode(), digest_size=8).digest(), 'little')
+
+
+async def async_iter_eth_keys(file_or_str: str, chunk_size: int = 1000, first_chunk: int = 16,
+                              deriver: KeyDeriver = None) -> AsyncIterator[list[Acct]]:
+    """
+    Streaming replacement for `async_load_eth_keys`. Parses, de-duplicates and yields accounts in
+    chunks as the file is read, so the scan can start on the first keys while the rest are still
+    loading. Key derivation runs on a process pool. Accounts are not kept once yielded, but
+    de-duplication remembers a 64 bit hash of every address seen, so memory still grows with the
+    number of unique keys (roughly 70 bytes each, 70MB for 1M keys).
+    :param file_or_str: string path or hex key
+    :param chunk_size: max accounts per yielded chunk
+    :param first_chunk: size of the first chunk
+    :param deriver: KeyDeriver to use, one is created (and shut down) if not supplied
+    :return: async generator of list[Acct]
+    """
+    if not path.exists(file_or_str):
+        _acct = load_account(file_or_str)
+        if _acct is not None:
+            yield [_acct]
+        return
+    seen: set[int] = set()
+    own_deriver = deriver is None
+    if own_deriver:
+        deriver = KeyDeriver()
+    try:
+        async for pairs in deriver.iter_derive(async_iter_key_lines(file_or_str, chunk_size, first_chunk)):
+            accts = []
+            for key, address in pairs:
+                digest = address_hash(address)
+                if digest not in seen:
+                    seen.add(digest)
+                    accts.append(Acct.from_derived(key, address))
+            if accts:
+                yield accts
+    finally:
+        if own_deriver:
+            deriver.close()
+
+
 def format_float(amount: float, precision: int = None) -> str:
     """
     Formats a float as a decimal string with large precision.
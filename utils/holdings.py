@@ -0,0 +1,115 @@
+from array import array
+from typing import Iterator, Union
+
+from utils.token_registry import Interner, TokenRegistry
+
+_U64 = (1 << 64) - 1
+
+
+class HoldingRow:
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store: 'HoldingsStore', index: int):
+        """
+        Lightweight view of one row of a HoldingsStore, nothing is copied out of the columns
+        """
+        self.store = store
+        self.index = index
+
+    @property
+    def address(self) -> str:
+        return self.store.addresses[self.store.addr_idx[self.index]]
+
+    @property
+    def key(self) -> str:
+        return self.store.keys[self.store.addr_idx[self.index]]
+
+    @property
+    def chain_id(self) -> int:
+        return self.store.tokens[self.store.token_idx[self.index]][0]
+
+    @property
+    def token(self) -> str:
+        return self.store.tokens[self.store.token_idx[self.index]][1]
+
+    @property
+    def amount(self) -> int:
+        return self.store.amount(self.index)
+
+    @property
+    def decimals(self) -> int:
+        return self.store.tokens.decimals[self.store.token_idx[self.index]]
+
+    @property
+    def symbol(self) -> Union[str, None]:
+        return self.store.tokens.symbols[self.store.token_idx[self.index]]
+
+    def as_dict(self) -> dict:
+        return {'address': self.token, 'symbol': self.symbol, 'amount': self.amount, 'decimals': self.decimals,
+                'cid': self.chain_id}
+
+    def __repr__(self):
+        return f"HoldingRow(address={self.address}, cid={self.chain_id}, token={self.token}, amount={self.amount})"
+
+
+class HoldingsStore:
+    def __init__(self, registry: TokenRegistry = None):
+        """
+        Columnar store of (wallet, chain, token, raw amount) holdings. Wallet addresses are interned
+        once and tokens refer to the token registry by id (decimals, symbol and name live there), rows
+        are parallel typed arrays. Raw amounts are uint256 on chain, so they are split into two uint64
+        columns and the rare amount that does not fit in 128 bits spills into a side dict.
+        :param registry: shared token registry, a private in memory one is used otherwise
+        """
+        self.addresses = Interner()
+        self.keys: list[str] = []
+        self.chains = Interner()
+        self.tokens = registry if registry is not None else TokenRegistry()
+        self.addr_idx = array('I')
+        self.chain_idx = array('H')
+        self.token_idx = array('I')
+        self.amount_lo = array('Q')
+        self.amount_hi = array('Q')
+        self.amount_big: dict[int, int] = {}
+
+    def add_address(self, address: str, key: str) -> int:
+        idx = self.addresses.intern(address)
+        if idx == len(self.keys):
+            self.keys.append(key)
+        return idx
+
+    def add(self, address: str, key: str, _chain_id: int, token: str, amount: int, decimals: int = None) -> int:
+        """
+        :return: row index
+        :raises ValueError: the token's decimals are out of range, no column is touched then
+        """
+        # register first, it can reject the token and a half appended row would shift every later one
+        token_id = self.tokens.register(_chain_id, token, decimals)
+        row = len(self.addr_idx)
+        self.addr_idx.append(self.add_address(address, key))
+        self.chain_idx.append(self.chains.intern(int(_chain_id)))
+        self.token_idx.append(token_id)
+        if amount >> 128:
+            self.amount_big[row] = amount
+            self.amount_lo.append(0)
+            self.amount_hi.append(0)
+        else:
+            self.amount_lo.append(amount & _U64)
+            self.amount_hi.append(amount >> 64)
+        return row
+
+    def amount(self, row: int) -> int:
+        big = self.amount_big.get(row)
+        if big is not None:
+            return big
+        return (self.amount_hi[row] << 64) | self.amount_lo[row]
+
+    def row(self, row: int) -> HoldingRow:
+        return HoldingRow(self, row)
+
+    def __len__(self):
+        return len(self.addr_idx)
+
+    def __iter__(self) -> Iterator[HoldingRow]:
+        for row in range(len(self.addr_idx)):
+            yield HoldingRow(self, row)
@@ -0,0 +1,80 @@
+import asyncio
+import binascii
+import hashlib
+import sqlite3
+import threading
+from typing import Union
+
+from data.constants import CACHE_DB
+
+
+class KeyCache:
+    def __init__(self, db_file: str = CACHE_DB):
+        """
+        Persistent private key -> checksum address cache, stored in the `key_cache` table of the
+        cache db. Entries are keyed by a hash of the key itself, so the cache is content addressed:
+        an edited key file only misses on the lines that actually changed, and nothing ever needs to
+        be invalidated because a key always derives to the same address.
+        :param db_file: sqlite database path
+        """
+        self.db_file = db_file
+        self._conn: Union[sqlite3.Connection, None] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_file, check_same_thread=False)
+            self._conn.execute('CREATE TABLE IF NOT EXISTS key_cache (key_hash BLOB PRIMARY KEY, address TEXT) '
+                               'WITHOUT ROWID')
+            self._conn.commit()
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    @staticmethod
+    def key_hash(key_line: str) -> bytes:
+        """
+        :param key_line: hex private key, with or without 0x
+        :return: 16 byte blake2b digest of the raw key
+        """
+        return hashlib.blake2b(binascii.unhexlify(key_line[-64:]), digest_size=16).digest()
+
+    def _lookup(self, hashes: list[bytes]) -> dict[bytes, str]:
+        ret = {}
+        with self._lock:
+            # stay under sqlite's bound parameter limit
+            for i in range(0, len(hashes), 500):
+                chunk = hashes[i:i + 500]
+                query = 'SELECT key_hash, address FROM key_cache WHERE key_hash IN (%s)' % ','.join('?' * len(chunk))
+                ret.update(self.conn.execute(query, chunk).fetchall())
+        return ret
+
+    def _store(self, rows: list[tuple[bytes, str]]):
+        with self._lock:
+            self.conn.executemany('INSERT OR REPLACE INTO key_cache (key_hash, address) VALUES (?, ?)', rows)
+            self.conn.commit()
+
+    async def lookup(self, hashes: list[bytes]) -> dict[bytes, str]:
+        """
+        :param hashes: key hashes from `key_hash`
+        :return: {key_hash: address} for the hashes that are cached
+        """
+        if not hashes:
+            return {}
+        ret = await asyncio.to_thread(self._lookup, hashes)
+        self.hits += len(ret)
+        self.misses += len(hashes) - len(ret)
+        return ret
+
+    async def store(self, rows: list[tuple[bytes, str]]):
+        """
+        :param rows: list of (key_hash, address)
+        """
+        if rows:
+            await asyncio.to_thread(self._store, rows)
@@ -0,0 +1,144 @@
+import asyncio
+import binascii
+import collections
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Union
+
+from eth_keys import keys
+from eth_utils import to_checksum_address, ValidationError
+
+from data.constants import NULL_KEY
+from utils.key_cache import KeyCache
+
+ADDRESS_RE = re.compile(r'^(0x)?[0-9a-fA-F]{40}$')
+KEY_RE = re.compile(r'^(0x)?[0-9a-fA-F]{64}$')
+
+
+def classify(line: str) -> int:
+    """
+    Cheap up front check of what a key file line holds
+    :param line: stripped line
+    :return: 1 for a private key, 2 for a plain address, 0 for garbage
+    """
+    if KEY_RE.match(line):
+        return 1
+    if ADDRESS_RE.match(line):
+        return 2
+    return 0
+
+
+def derive_keys(key_lines: list[str]) -> list[Union[tuple[str, str], None]]:
+    """
+    Derive checksum addresses for a chunk of hex private keys. Runs inside the pool workers, so it
+    must stay a plain module level function.
+    :param key_lines: lines that matched KEY_RE
+    :return: list of (key hex, checksum address), or None where the key is out of range
+    """
+    ret = []
+    for line in key_lines:
+        try:
+            pk = keys.PrivateKey(binascii.unhexlify(line[-64:]))
+        except (ValueError, ValidationError):
+            ret.append(None)
+        else:
+            ret.append((pk.to_hex(), pk.public_key.to_checksum_address()))
+    return ret
+
+
+class KeyDeriver:
+    def __init__(self, workers: int = None, chunk_size: int = 2000, max_pending: int = None,
+                 cache: KeyCache = None):
+        """
+        Derive addresses from private keys across every core. Lines are classified up front: plain
+        addresses only need a checksum and never leave this process, keys are shipped to the pool
+        in chunks.
+        :param workers: pool size, defaults to os.cpu_count()
+        :param chunk_size: keys per pool job
+        :param max_pending: pool jobs in flight before the reader waits (defaults to 2x workers)
+        :param cache: optional persistent KeyCache, only keys that miss it are derived
+        """
+        self.workers = workers if workers else (os.cpu_count() or 1)
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending if max_pending else self.workers * 2
+        self._pool: Union[ProcessPoolExecutor, None] = None
+        self.cache = cache
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # the pool is created once the logger, writer and sqlite threads are running, forking a
+            # threaded process can leave a lock held in the child, so workers come from a forkserver
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(method))
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        if self.cache is not None:
+            self.cache.close()
+
+    async def _derive_keys(self, key_lines: list[str]) -> list[Union[tuple[str, str], None]]:
+        if not key_lines:
+            return []
+        loop = asyncio.get_running_loop()
+        if len(key_lines) <= self.chunk_size:
+            return await loop.run_in_executor(self.pool, derive_keys, key_lines)
+        jobs = [loop.run_in_executor(self.pool, derive_keys, key_lines[i:i + self.chunk_size])
+                for i in range(0, len(key_lines), self.chunk_size)]
+        ret = []
+        for chunk in await asyncio.gather(*jobs):
+            ret.extend(chunk)
+        return ret
+
+    async def _cached_derive_keys(self, key_lines: list[str]) -> list[Union[tuple[str, str], None]]:
+        if self.cache is None:
+            return await self._derive_keys(key_lines)
+        hashes = [KeyCache.key_hash(line) for line in key_lines]
+        cached = await self.cache.lookup(hashes)
+        misses = [(key_hash, line) for key_hash, line in zip(hashes, key_lines) if key_hash not in cached]
+        derived = await self._derive_keys([line for _, line in misses])
+        await self.cache.store([(key_hash, pair[1]) for (key_hash, _), pair in zip(misses, derived) if pair])
+        derived = iter(derived)
+        return [('0x' + line[-64:].lower(), cached[key_hash]) if key_hash in cached else next(derived)
+                for key_hash, line in zip(hashes, key_lines)]
+
+    async def derive(self, lines: list[str]) -> list[tuple[str, str]]:
+        """
+        Resolve a chunk of key file lines
+        :param lines: stripped lines
+        :return: list of (key hex, checksum address) in input order, garbage lines dropped
+        """
+        kinds = [classify(line) for line in lines]
+        derived = iter(await self._cached_derive_keys([line for line, kind in zip(lines, kinds) if kind == 1]))
+        ret = []
+        for line, kind in zip(lines, kinds):
+            if kind == 1:
+                pair = next(derived)
+                if pair is not None:
+                    ret.append(pair)
+            elif kind == 2:
+                ret.append((NULL_KEY, to_checksum_address(line)))
+        return ret
+
+    async def iter_derive(self, chunks: AsyncIterator[list[str]]) -> AsyncIterator[list[tuple[str, str]]]:
+        """
+        Pipeline chunks of lines through the pool, keeping up to `max_pending` chunks in flight and
+        yielding results in input order
+        :param chunks: async iterator of line lists
+        """
+        pending: collections.deque[asyncio.Task] = collections.deque()
+        try:
+            async for lines in chunks:
+                pending.append(asyncio.ensure_future(self.derive(lines)))
+                while len(pending) >= self.max_pending or (pending and pending[0].done()):
+                    yield await pending.popleft()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,115 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class AimdLimiter:
+    def __init__(self, initial: int = 4, min_limit: int = 1, max_limit: int = 64, decrease: float = 0.5,
+                 latency_target: float = 5.0):
+        """
+        Additive increase / multiplicative decrease concurrency limiter. Every healthy response grows
+        the limit by 1/limit (so roughly +1 per round trip of the whole window), while a 429, a 5xx,
+        a timeout or a response slower than `latency_target` cuts it by `decrease`. At most one cut
+        is applied per round trip so a burst of failures from the same window only counts once.
+        :param initial: starting concurrency
+        :param min_limit: floor
+        :param max_limit: ceiling
+        :param decrease: multiplier applied on congestion
+        :param latency_target: seconds, slower responses count as congestion
+        """
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.latency = 0.0
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.release()
+
+    def success(self, latency: float):
+        self.latency = latency if not self.latency else (self.latency * 0.8 + latency * 0.2)
+        if latency > self.latency_target:
+            self.congestion()
+            return
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def congestion(self):
+        now = time.monotonic()
+        if now - self._last_decrease < max(self.latency, 0.1):
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease)
+
+
+class LimiterRegistry:
+    def __init__(self, **limiter_kwargs):
+        """
+        One AimdLimiter per (endpoint, chain id), created on first use
+        :param limiter_kwargs: passed through to AimdLimiter
+        """
+        self.limiter_kwargs = limiter_kwargs
+        self.limiters: dict[tuple[str, int], AimdLimiter] = {}
+
+    def get(self, endpoint: str, _chain_id: int) -> AimdLimiter:
+        key = (endpoint, _chain_id)
+        limiter = self.limiters.get(key)
+        if limiter is None:
+            limiter = self.limiters[key] = AimdLimiter(**self.limiter_kwargs)
+        return limiter
+
+    def snapshot(self) -> dict[tuple[str, int], float]:
+        return {key: limiter.limit for key, limiter in self.limiters.items()}
+
+
+class PrioritySemaphore:
+    def __init__(self, value: int):
+        """
+        Counting semaphore whose waiters are served highest priority first, and in arrival order
+        among equal priorities, instead of plain arrival order
+        :param value: slots
+        """
+        self.value = value
+        self._waiters: list[tuple[float, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+    async def acquire(self, priority: float = 0.0):
+        if self.value > 0 and not self._waiters:
+            self.value -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (-priority, next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # granted while being cancelled, hand the slot on
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            # cancelled waiters are left in the heap and skipped here
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.value += 1
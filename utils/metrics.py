@@ -0,0 +1,211 @@
+"""
+In-process metrics for the scan hot paths: counters, gauges and latency histograms keyed by label
+values. They are exported as Prometheus text or a JSON summary at the end of a run, and can be
+scraped during the run from a small stdlib HTTP endpoint (`serve`).
+"""
+import bisect
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Union
+
+# seconds, tuned for remote RPC calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_str(labelnames: tuple[str, ...], values: tuple, extra: str = '') -> str:
+    pairs = ['%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *labels: Any, value: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def get(self, *labels: Any) -> float:
+        return self.values.get(labels, 0)
+
+    def total(self) -> float:
+        return sum(list(self.values.values()))
+
+    def render(self) -> list[str]:
+        return ['%s%s %s' % (self.name, _label_str(self.labelnames, k), v) for k, v in list(self.values.items())]
+
+    def summary(self) -> Union[float, dict]:
+        if not self.labelnames:
+            return self.values.get((), 0)
+        return {'/'.join(str(v) for v in k): v for k, v in list(self.values.items())}
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, *labels: Any, value: float):
+        self.values[labels] = value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        Fixed bucket histogram, per label set it keeps one count per bucket (plus +Inf), the sum and
+        the count of observations
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels: Any):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def quantile(self, q: float, *labels: Any) -> float:
+        """
+        :return: upper bound of the bucket holding the q-quantile (the last bound for the +Inf bucket)
+        """
+        entry = self.values.get(labels)
+        if entry is None or not entry[2]:
+            return 0.0
+        rank = q * entry[2]
+        seen = 0
+        for i, count in enumerate(entry[0]):
+            seen += count
+            if seen >= rank:
+                return self.buckets[min(i, len(self.buckets) - 1)]
+        return self.buckets[-1]
+
+    def render(self) -> list[str]:
+        lines = []
+        for labels, (counts, total, count) in list(self.values.items()):
+            cumulative = 0
+            for bound, c in zip(self.buckets + (float('inf'),), counts):
+                cumulative += c
+                le = 'le="%s"' % ('+Inf' if bound == float('inf') else bound)
+                lines.append('%s_bucket%s %s' % (self.name, _label_str(self.labelnames, labels, le), cumulative))
+            lines.append('%s_sum%s %s' % (self.name, _label_str(self.labelnames, labels), total))
+            lines.append('%s_count%s %s' % (self.name, _label_str(self.labelnames, labels), count))
+        return lines
+
+    def summary(self) -> dict:
+        ret = {}
+        for labels, (_, total, count) in list(self.values.items()):
+            ret['/'.join(str(v) for v in labels) or 'all'] = {
+                'count': count, 'mean': total / count if count else 0.0,
+                'p50': self.quantile(0.5, *labels), 'p99': self.quantile(0.99, *labels)}
+        return ret
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Union[Counter, Gauge, Histogram]] = {}
+        self.started = time.time()
+
+    def _get(self, cls, name: str, documentation: str, labelnames: tuple[str, ...], **kwargs):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = cls(name, documentation, labelnames, **kwargs)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self._get(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+        return self._get(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> dict:
+        ret = {'uptime': time.time() - self.started}
+        ret.update({name: metric.summary() for name, metric in list(self.metrics.items())})
+        return ret
+
+    def write(self, path: str):
+        """
+        :param path: a `.json` path gets the JSON summary, anything else Prometheus text
+        """
+        with open(path, 'w') as f:
+            if path.endswith('.json'):
+                json.dump(self.summary(), f, indent=2)
+            else:
+                f.write(self.render_prometheus())
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter('particle_requests_total', 'JSON-RPC calls by outcome', ('chain', 'method', 'outcome'))
+REQUEST_SECONDS = REGISTRY.histogram('particle_request_seconds', 'JSON-RPC call latency including retries',
+                                     ('chain', 'method'))
+HTTP_RESPONSES = REGISTRY.counter('particle_http_responses_total', 'HTTP responses by status', ('chain', 'status'))
+RETRIES = REGISTRY.counter('particle_retries_total', 'JSON-RPC calls retried', ('chain', 'method'))
+DROPS = REGISTRY.counter('particle_drops_total', 'JSON-RPC calls given up on', ('chain', 'method'))
+PRICE_LOOKUPS = REGISTRY.counter('price_lookups_total', 'Token price lookups by source', ('chain', 'source'))
+PRICE_FETCH_SECONDS = REGISTRY.histogram('price_fetch_seconds', 'particle_getPrice chunk latency', ('chain',))
+WALLET_WRITES = REGISTRY.counter('scan_wallet_writes_total', 'Wallet results added to the scan session', ('chain',))
+HOLDINGS_ROWS = REGISTRY.gauge('scan_holdings_rows', 'Rows in the holdings store')
+UNITS = REGISTRY.counter('scan_units_total', 'Finished (wallet, chain) units by result', ('chain', 'result'))
+UNITS_PER_SECOND = REGISTRY.gauge('scan_units_per_second', 'Finished units per second since the scan started')
+QUEUE_DEPTH = REGISTRY.gauge('scan_queue_depth', 'Units waiting in a chain queue', ('chain',))
+
+
+def update_rates():
+    UNITS_PER_SECOND.set(value=UNITS.total() / max(time.time() - REGISTRY.started, 1e-9))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, fmt: str, *args: Any):
+        pass
+
+    def do_GET(self):
+        update_rates()
+        if self.path.startswith('/metrics.json'):
+            body, content_type = json.dumps(REGISTRY.summary()).encode(), 'application/json'
+        elif self.path.startswith('/metrics'):
+            body, content_type = REGISTRY.render_prometheus().encode(), 'text/plain; version=0.0.4'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """
+    Serve /metrics (Prometheus text) and /metrics.json from a daemon thread
+    :return: the server, call `shutdown()` on it to stop
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
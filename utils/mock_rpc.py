@@ -0,0 +1,273 @@
+"""
+Local stand-in for the Particle evm-chain endpoint, for benchmarks and offline testing. It speaks
+HTTP/1.1 with keep-alive, answers single and batched JSON-RPC calls and can simulate latency,
+server errors and 429 rate limiting. MockProcess runs it in a process of its own, so a benchmark's
+client shares neither its GIL nor its memory with the server.
+"""
+import hashlib
+import json
+import multiprocessing
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Union
+from urllib.parse import parse_qs, urlparse
+
+LATENCY_DISTRIBUTIONS = ('fixed', 'uniform', 'exponential', 'lognormal')
+
+
+class MockStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.calls = 0
+        self.statuses: dict[int, int] = {}
+        self.methods: dict[str, int] = {}
+
+    def count(self, status: int, methods: list[str]):
+        with self.lock:
+            self.requests += 1
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status == 200:
+                self.calls += len(methods)
+                for method in methods:
+                    self.methods[method] = self.methods.get(method, 0) + 1
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {'requests': self.requests, 'calls': self.calls, 'statuses': dict(self.statuses),
+                    'methods': dict(self.methods)}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'MockStats':
+        stats = cls()
+        stats.requests = d['requests']
+        stats.calls = d['calls']
+        stats.statuses = d['statuses']
+        stats.methods = d['methods']
+        return stats
+
+
+class MockParticleServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.02, latency_dist: str = 'lognormal',
+                 error_rate: float = 0.0, max_concurrent: int = 0, hit_rate: float = 0.1, tokens_per_hit: int = 3,
+                 seed: int = None):
+        """
+        :param host: bind address
+        :param port: bind port, 0 picks a free one
+        :param latency: seconds, mean service time of one HTTP request
+        :param latency_dist: fixed, uniform (0 to 2x mean), exponential or lognormal
+        :param error_rate: fraction of HTTP requests answered with a 500
+        :param max_concurrent: requests in flight above which the server answers 429 (0 for no limit)
+        :param hit_rate: fraction of (wallet, chain) pairs that hold anything, picked deterministically
+        :param tokens_per_hit: tokens held by a wallet that holds anything
+        :param seed: random seed for latency and errors
+        """
+        if latency_dist not in LATENCY_DISTRIBUTIONS:
+            raise ValueError('Unknown latency distribution: %s' % latency_dist)
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.latency_dist = latency_dist
+        self.error_rate = error_rate
+        self.max_concurrent = max_concurrent
+        self.hit_rate = hit_rate
+        self.tokens_per_hit = tokens_per_hit
+        self.random = random.Random(seed)
+        self.stats = MockStats()
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._thread: Union[threading.Thread, None] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return 'http://%s:%s/evm-chain' % (host, port)
+
+    def start(self) -> 'MockParticleServer':
+        self._thread = threading.Thread(target=self.serve_forever, name='mock-particle', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def service_time(self) -> float:
+        with self._lock:
+            rnd = self.random
+            if self.latency_dist == 'fixed':
+                return self.latency
+            if self.latency_dist == 'uniform':
+                return rnd.uniform(0, 2 * self.latency)
+            if self.latency_dist == 'exponential':
+                return rnd.expovariate(1 / self.latency) if self.latency > 0 else 0.0
+            # sigma 0.5 keeps the mean at `latency` with a realistic right tail
+            return rnd.lognormvariate(0, 0.5) * self.latency / 1.1331
+
+    def fails(self) -> bool:
+        with self._lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    @staticmethod
+    def _seed(*parts: Any) -> int:
+        digest = hashlib.blake2b(':'.join(str(p).lower() for p in parts).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'little')
+
+    def holds(self, address: str, _chain_id: int) -> bool:
+        return (self._seed(address, _chain_id) % 1000000) < self.hit_rate * 1000000
+
+    def wallet(self, address: str, _chain_id: int) -> dict:
+        if not self.holds(address, _chain_id):
+            return {'native': '0', 'tokens': []}
+        seed = self._seed(address, _chain_id)
+        tokens = []
+        for i in range(self.tokens_per_hit):
+            token = '0x' + hashlib.blake2b(b'token:%d:%d' % (_chain_id, (seed + i) % 50), digest_size=20).hexdigest()
+            tokens.append({'address': token, 'amount': str((seed % 10 ** 6 + 1) * 10 ** 12), 'decimals': 18,
+                           'symbol': 'MOCK%d' % ((seed + i) % 50), 'name': 'Mock token %d' % ((seed + i) % 50)})
+        return {'native': str((seed % 10 ** 6 + 1) * 10 ** 12), 'tokens': tokens}
+
+    def call(self, payload: dict, _chain_id: int) -> dict:
+        method = payload.get('method')
+        params = payload.get('params') or []
+        ret = {'jsonrpc': '2.0', 'id': payload.get('id')}
+        if method == 'particle_getTokens':
+            ret['result'] = self.wallet(params[0], _chain_id)
+        elif method == 'particle_getPrice':
+            ret['result'] = [{'address': token, 'currencies': [{'type': 'usd', 'price': 1.0}]} for token in params[0]]
+        elif method == 'eth_getBalance':
+            ret['result'] = hex(int(self.wallet(params[0], _chain_id)['native']))
+        elif method == 'eth_getTransactionCount':
+            ret['result'] = hex(1 if self.holds(params[0], _chain_id) else 0)
+        elif method == 'eth_blockNumber':
+            ret['result'] = hex(int(time.time()))
+        elif method == 'eth_gasPrice':
+            ret['result'] = hex(10 ** 9)
+        elif method == 'eth_chainId':
+            ret['result'] = hex(_chain_id)
+        else:
+            ret['error'] = {'code': -32601, 'message': 'Method not found: %s' % method}
+        return ret
+
+
+def _serve(conn, server_kwargs: dict):
+    try:
+        server = MockParticleServer(**server_kwargs).start()
+    except Exception as err:
+        conn.send(err)
+        return
+    conn.send(server.url)
+    try:
+        conn.recv()
+    except EOFError:
+        # the parent went away without stopping us
+        pass
+    server.stop()
+    try:
+        conn.send(server.stats.as_dict())
+    except (BrokenPipeError, OSError):
+        pass
+
+
+class MockProcess:
+    def __init__(self, **server_kwargs):
+        """
+        A MockParticleServer running in a spawned process. The stats are sent back when it stops.
+        :param server_kwargs: passed through to MockParticleServer
+        """
+        self.server_kwargs = server_kwargs
+        self.url: Union[str, None] = None
+        self.stats = MockStats()
+        self._conn = None
+        self._process: Union[multiprocessing.Process, None] = None
+
+    def start(self) -> 'MockProcess':
+        """
+        Start the process and wait for the server to listen
+        :raises: whatever MockParticleServer raised in the child (ie ValueError for a bad distribution)
+        """
+        ctx = multiprocessing.get_context('spawn')
+        self._conn, child = ctx.Pipe()
+        self._process = ctx.Process(target=_serve, args=(child, self.server_kwargs), name='mock-particle', daemon=True)
+        self._process.start()
+        child.close()
+        ret = self._conn.recv()
+        if isinstance(ret, Exception):
+            self._process.join()
+            raise ret
+        self.url = ret
+        return self
+
+    def stop(self) -> MockStats:
+        """
+        :return: the server's stats
+        """
+        if self._process is None:
+            return self.stats
+        try:
+            self._conn.send('stop')
+            self.stats = MockStats.from_dict(self._conn.recv())
+        finally:
+            self._conn.close()
+            self._process.join()
+            self._process = None
+        return self.stats
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes, Nagle would hold the body back on keep-alive connections
+    disable_nagle_algorithm = True
+    server: MockParticleServer
+
+    def log_message(self, fmt: str, *args: Any):
+        pass
+
+    def _reply(self, status: int, body: bytes = b''):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self._reply(200)
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with server._lock:
+            server.in_flight += 1
+            limited = 0 < server.max_concurrent < server.in_flight
+        try:
+            if limited:
+                server.stats.count(429, [])
+                return self._reply(429, b'{"error": "too many requests"}')
+            time.sleep(server.service_time())
+            if server.fails():
+                server.stats.count(500, [])
+                return self._reply(500, b'{"error": "internal error"}')
+            try:
+                payload = json.loads(body)
+                _chain_id = int(parse_qs(urlparse(self.path).query).get('chainId', ['1'])[0])
+            except (ValueError, TypeError):
+                server.stats.count(400, [])
+                return self._reply(400, b'{"error": "bad request"}')
+            if isinstance(payload, list):
+                ret = [server.call(p, _chain_id) for p in payload]
+                methods = [p.get('method') for p in payload]
+            else:
+                ret = server.call(payload, _chain_id)
+                methods = [payload.get('method')]
+            server.stats.count(200, methods)
+            self._reply(200, json.dumps(ret).encode())
+        finally:
+            with server._lock:
+                server.in_flight -= 1
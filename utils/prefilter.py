@@ -0,0 +1,52 @@
+import asyncio
+from typing import Any, Union
+
+MODES = ('off', 'any', 'nonce')
+
+
+class ActivityPrefilter:
+    # outcomes of `check`
+    SCAN = 'scan'
+    EMPTY = 'empty'
+    NATIVE = 'native'
+
+    def __init__(self, mode: str = 'any'):
+        """
+        Cheap activity probe run before `particle_getTokens`. The wallet's nonce and native balance
+        are fetched with `eth_getTransactionCount` / `eth_getBalance`, which ParticleApi coalesces
+        into JSON-RPC batches, and only wallets showing activity get the expensive token enumeration.
+        Modes, from loose to strict:
+          any   - enumerate tokens if the wallet ever sent a transaction or holds native coin
+          nonce - enumerate tokens only if the wallet ever sent a transaction; a funded wallet that
+                  never did is recorded with its native balance alone
+        Wallets that only ever received tokens are missed by design, use mode 'off' to scan them.
+        :param mode: 'any' or 'nonce'
+        """
+        if mode not in MODES or mode == 'off':
+            raise ValueError('Unknown prefilter mode: %s' % mode)
+        self.mode = mode
+        self.probed = 0
+        self.skipped = 0
+        self.native_only = 0
+
+    async def check(self, _api: Any, address: str, _chain_id: int) -> tuple[str, Union[int, None]]:
+        """
+        :param _api: ParticleApi
+        :return: (SCAN, None) to enumerate tokens, (EMPTY, None) to skip the wallet, or (NATIVE,
+                 balance) to record the native balance without enumerating tokens
+        """
+        nonce, balance = await asyncio.gather(_api.eth_get_transaction_count(address, _chain_id),
+                                              _api.eth_get_balance(address, _chain_id))
+        self.probed += 1
+        if nonce is None or balance is None:
+            # the probe was dropped, fall back to a full scan rather than guessing
+            return self.SCAN, None
+        if nonce > 0:
+            return self.SCAN, None
+        if balance > 0:
+            if self.mode == 'any':
+                return self.SCAN, None
+            self.native_only += 1
+            return self.NATIVE, balance
+        self.skipped += 1
+        return self.EMPTY, None
@@ -0,0 +1,176 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Iterable, Union
+
+from eth_typing import ChecksumAddress
+from eth_utils import to_checksum_address
+
+from data.constants import ZERO_ADDRESS
+from utils import metrics
+from utils.price_cache import PriceCache
+
+
+class PriceBroker:
+    def __init__(self, fetch: Callable[[list[str], int], Awaitable[Union[list[Any], None]]], ttl: float = 600,
+                 chunk_size: int = 100, window: float = 0.05,
+                 on_prices: Callable[[list[Any]], Union[Awaitable[None], None]] = None,
+                 cache: PriceCache = None, make_price: Callable[[str, int, float], Any] = None):
+        """
+        Chain wide price coalescing. Every wallet in flight asks the broker for its tokens, the broker
+        collects the unique addresses per chain, prices them with as few chunked `particle_getPrice`
+        calls as possible and fans the results back out. A token is priced at most once per `ttl` per
+        chain, including tokens that came back without a price.
+        :param fetch: coroutine function fetch(tokens, chain_id) -> list of TokenPrice (ie ParticleApi.get_price)
+        :param ttl: seconds a price (or a missing price) is reused for
+        :param chunk_size: max tokens per price call
+        :param window: seconds to collect tokens before sending a price call
+        :param on_prices: optional callback (or coroutine function) given every freshly fetched price list
+        :param cache: optional persistent cache, warm loaded by `warm()` and fed every fetched price
+        :param make_price: make_price(token, chain_id, price) -> TokenPrice, used to rebuild cached prices
+        """
+        self.fetch = fetch
+        self.ttl = ttl
+        self.chunk_size = chunk_size
+        self.window = window
+        self.on_prices = on_prices
+        self.cache = cache
+        self.make_price = make_price
+        self._prices: dict[int, dict[str, tuple[float, Any]]] = {}
+        self._inflight: dict[int, dict[str, asyncio.Future]] = {}
+        self._pending: dict[int, dict[str, str]] = {}
+        self._timers: dict[int, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.requested = 0
+        self.calls = 0
+
+    async def warm(self, chain_ids: Iterable[int] = None) -> int:
+        """
+        Seed the in memory cache from the persistent one, keeping each price's original timestamp
+        so it still expires on time
+        :param chain_ids: only load prices of these chains (the cache is shared by every scan), None for all
+        :return: number of prices loaded
+        """
+        if self.cache is None or self.make_price is None:
+            return 0
+        rows = await self.cache.load()
+        if chain_ids is not None:
+            chain_ids = set(chain_ids)
+            rows = [row for row in rows if row[0] in chain_ids]
+        fresh: list[Any] = []
+        for _chain_id, token, value, updated in rows:
+            price = None
+            if value is not None:
+                price = self.make_price(token, _chain_id, value)
+                price.updated = int(updated)
+                fresh.append(price)
+            self._prices.setdefault(_chain_id, {})[token] = (updated, price)
+        if self.on_prices is not None and fresh:
+            ret = self.on_prices(fresh)
+            if asyncio.iscoroutine(ret):
+                await ret
+        return len(rows)
+
+    @staticmethod
+    def normalize(token: Union[str, ChecksumAddress]) -> str:
+        if token == 'native' or token == ZERO_ADDRESS:
+            return ZERO_ADDRESS
+        return to_checksum_address(token)
+
+    def cached(self, token: str, _chain_id: int) -> tuple[bool, Any]:
+        """
+        :param token: normalized token address
+        :return: (is fresh, TokenPrice or None)
+        """
+        entry = self._prices.get(_chain_id, {}).get(token)
+        if entry is not None and entry[0] >= time.time() - self.ttl:
+            return True, entry[1]
+        return False, None
+
+    async def get_prices(self, tokens: Iterable[Union[str, ChecksumAddress]], _chain_id: int) -> list[Any]:
+        """
+        :param tokens: token addresses, `native` or the zero address for the native asset
+        :param _chain_id: chain
+        :return: list of TokenPrice for the tokens that have a price
+        """
+        loop = asyncio.get_running_loop()
+        ret = []
+        waiting = []
+        inflight = self._inflight.setdefault(_chain_id, {})
+        pending = self._pending.setdefault(_chain_id, {})
+        for raw in set(tokens):
+            token = self.normalize(raw)
+            fresh, price = self.cached(token, _chain_id)
+            if fresh:
+                metrics.PRICE_LOOKUPS.inc(_chain_id, 'cache')
+                if price is not None:
+                    ret.append(price)
+                continue
+            fut = inflight.get(token)
+            if fut is not None:
+                metrics.PRICE_LOOKUPS.inc(_chain_id, 'coalesced')
+            else:
+                metrics.PRICE_LOOKUPS.inc(_chain_id, 'fetch')
+                fut = loop.create_future()
+                inflight[token] = fut
+                pending[token] = 'native' if token == ZERO_ADDRESS else raw
+            waiting.append(fut)
+        if pending:
+            if len(pending) >= self.chunk_size:
+                self._flush(_chain_id)
+            elif _chain_id not in self._timers:
+                self._timers[_chain_id] = loop.call_later(self.window, self._flush, _chain_id)
+        if waiting:
+            for price in await asyncio.gather(*waiting):
+                if price is not None:
+                    ret.append(price)
+        return ret
+
+    def _flush(self, _chain_id: int):
+        timer = self._timers.pop(_chain_id, None)
+        if timer is not None:
+            timer.cancel()
+        pending = self._pending.pop(_chain_id, None)
+        if not pending:
+            return
+        items = list(pending.items())
+        for i in range(0, len(items), self.chunk_size):
+            task = asyncio.create_task(self._fetch_chunk(_chain_id, items[i:i + self.chunk_size]))
+            task.add_done_callback(self._tasks.discard)
+            self._tasks.add(task)
+
+    async def _fetch_chunk(self, _chain_id: int, items: list[tuple[str, str]]):
+        inflight = self._inflight.setdefault(_chain_id, {})
+        self.calls += 1
+        self.requested += len(items)
+        started = time.monotonic()
+        try:
+            prices = await self.fetch([raw for _, raw in items], _chain_id)
+        except Exception:
+            prices = None
+        metrics.PRICE_FETCH_SECONDS.observe(time.monotonic() - started, _chain_id)
+        if prices is None:
+            # the call failed, release the waiters without caching so the next wallet retries
+            for token, _ in items:
+                fut = inflight.pop(token, None)
+                if fut is not None and not fut.done():
+                    fut.set_result(None)
+            return
+        now = time.time()
+        cache = self._prices.setdefault(_chain_id, {})
+        by_address = {price.address: price for price in prices if price is not None}
+        for token, _ in items:
+            price = by_address.get(token)
+            cache[token] = (now, price)
+            fut = inflight.pop(token, None)
+            if fut is not None and not fut.done():
+                fut.set_result(price)
+        if self.on_prices is not None and by_address:
+            ret = self.on_prices(list(by_address.values()))
+            if asyncio.iscoroutine(ret):
+                await ret
+        if self.cache is not None:
+            rows = []
+            for token, _ in items:
+                price = by_address.get(token)
+                rows.append((_chain_id, token, float(price.price) if price is not None else None, now))
+            await self.cache.store(rows)
@@ -0,0 +1,82 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from typing import Union
+
+from data.constants import CACHE_DB
+
+
+class PriceCache:
+    def __init__(self, db_file: str = CACHE_DB, ttl: float = 600, max_entries: int = 100000):
+        """
+        Persistent (chain id, token) -> usd price cache, stored in the `price_cache` table of the
+        cache db so back to back scans reuse recent prices. Tokens that came back without a price
+        are kept too (price NULL), they are the ones most worth not asking about again. The table is
+        bounded: once it grows past `max_entries` the least recently used rows are evicted.
+        :param db_file: sqlite database path
+        :param ttl: seconds a stored price is considered fresh
+        :param max_entries: most rows kept
+        """
+        self.db_file = db_file
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._conn: Union[sqlite3.Connection, None] = None
+        self._lock = threading.Lock()
+        self.loaded = 0
+        self.stored = 0
+        self.evicted = 0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_file, check_same_thread=False)
+            self._conn.execute('CREATE TABLE IF NOT EXISTS price_cache (chain_id INTEGER, token TEXT, price REAL, '
+                               'updated REAL, last_used REAL, PRIMARY KEY (chain_id, token)) WITHOUT ROWID')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS price_cache_last_used ON price_cache (last_used)')
+            self._conn.commit()
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _load(self) -> list[tuple[int, str, Union[float, None], float]]:
+        now = time.time()
+        with self._lock:
+            self.conn.execute('DELETE FROM price_cache WHERE updated < ?', (now - self.ttl,))
+            # everything that survives is about to be used by this run
+            self.conn.execute('UPDATE price_cache SET last_used = ?', (now,))
+            rows = self.conn.execute('SELECT chain_id, token, price, updated FROM price_cache').fetchall()
+            self.conn.commit()
+        return rows
+
+    def _store(self, rows: list[tuple[int, str, Union[float, None], float]]):
+        now = time.time()
+        with self._lock:
+            self.conn.executemany('INSERT OR REPLACE INTO price_cache (chain_id, token, price, updated, last_used) '
+                                  'VALUES (?, ?, ?, ?, ?)', [row + (now,) for row in rows])
+            excess = self.conn.execute('SELECT COUNT(*) FROM price_cache').fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.conn.execute('DELETE FROM price_cache WHERE (chain_id, token) IN '
+                                  '(SELECT chain_id, token FROM price_cache ORDER BY last_used LIMIT ?)', (excess,))
+                self.evicted += excess
+            self.conn.commit()
+
+    async def load(self) -> list[tuple[int, str, Union[float, None], float]]:
+        """
+        Bulk warm load, expired rows are dropped first
+        :return: list of fresh (chain_id, token, price or None, updated)
+        """
+        rows = await asyncio.to_thread(self._load)
+        self.loaded = len(rows)
+        return rows
+
+    async def store(self, rows: list[tuple[int, str, Union[float, None], float]]):
+        """
+        :param rows: list of (chain_id, token, price or None, updated)
+        """
+        if rows:
+            await asyncio.to_thread(self._store, rows)
+            self.stored += len(rows)
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import os
+import queue
+import threading
+from typing import Any, Iterable, Union
+
+from utils.errors import WriterFailed
+
+_CLOSE = object()
+
+
+class NdjsonWriter:
+    def __init__(self, file: str, append: bool = False, batch_size: int = 500, flush_interval: float = 1.0):
+        """
+        Append objects to an NDJSON file from a dedicated thread. `write` only enqueues, so neither
+        json serialization nor disk io ever runs on the event loop. Records are flushed every
+        `batch_size` records or `flush_interval` seconds, whichever comes first. If the thread fails
+        (disk full, a record that does not serialize) the error is kept and raised as WriterFailed by
+        the next `write` and by `close`, instead of records silently piling up in the queue.
+        :param file: path
+        :param append: keep the existing contents
+        :param batch_size: records per write
+        :param flush_interval: seconds, max age of a buffered record
+        """
+        self.file = file
+        self.append = append
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.error: Union[BaseException, None] = None
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='ndjson-writer', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def write(self, obj: Any):
+        """
+        Queue one record. The object must not be mutated afterwards.
+        :raises WriterFailed: the writer thread died, nothing more can be written
+        """
+        self.check()
+        self._queue.put(obj)
+
+    def check(self):
+        if self.error is not None:
+            raise WriterFailed('Writing %s failed: %r' % (self.file, self.error)) from self.error
+
+    def _run(self):
+        try:
+            self._write_loop()
+        except BaseException as err:
+            self.error = err
+
+    def _write_loop(self):
+        with open(self.file, 'a' if self.append else 'w') as f:
+            closing = False
+            while not closing:
+                batch = []
+                try:
+                    item = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    continue
+                while True:
+                    if item is _CLOSE:
+                        closing = True
+                        break
+                    batch.append(json.dumps(item))
+                    if len(batch) >= self.batch_size:
+                        break
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                if batch:
+                    f.write('\n'.join(batch) + '\n')
+                    f.flush()
+                    self.written += len(batch)
+            os.fsync(f.fileno())
+
+    async def close(self):
+        """
+        Flush and stop the thread
+        :raises WriterFailed: the writer thread died, records written after the failure were lost
+        """
+        if self._thread.is_alive():
+            self._queue.put(_CLOSE)
+            await asyncio.to_thread(self._thread.join)
+        self.check()
+
+
+def write_json_array(report_file: str, entries: Iterable[dict]) -> int:
+    """
+    Stream entries to a file as the elements of a JSON array, nothing is held in memory
+    :param report_file: json report path
+    :param entries: report entries
+    :return: number of entries written
+    """
+    count = 0
+    with open(report_file, 'w') as out:
+        out.write('[')
+        for entry in entries:
+            out.write(',\n' if count else '\n')
+            out.write(json.dumps(entry))
+            count += 1
+        out.write('\n]\n')
+    return count
@@ -0,0 +1,156 @@
+import random
+import time
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 4, base: float = 0.5, cap: float = 10.0):
+        """
+        Capped exponential backoff with full jitter
+        :param max_attempts: attempts per call, including the first one
+        :param base: seconds, backoff before the first retry is drawn from [0, base]
+        :param cap: seconds, upper bound of any single backoff
+        """
+        self.max_attempts = max_attempts
+        self.base = base
+        self.cap = cap
+
+    def backoff(self, attempt: int) -> float:
+        """
+        :param attempt: 0 based number of the attempt that just failed
+        :return: seconds to sleep before the next one
+        """
+        return random.uniform(0, min(self.cap, self.base * (2 ** attempt)))
+
+
+class RetryBudget:
+    def __init__(self, ratio: float = 0.2, min_per_sec: float = 10.0, max_tokens: float = 100.0):
+        """
+        Global retry budget shared by every chain. Each first attempt earns `ratio` of a retry, and
+        `min_per_sec` retries per second are always allowed, so retries can never grow past a fixed
+        fraction of real traffic while an endpoint is struggling.
+        :param ratio: retries earned per request
+        :param min_per_sec: retries per second allowed regardless of traffic
+        :param max_tokens: most retries that can be banked for a burst
+        """
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.max_tokens = max_tokens
+        self.tokens = min_per_sec
+        self._last_refill = time.monotonic()
+
+    def deposit(self):
+        self.tokens = min(self.tokens + self.ratio, self.max_tokens)
+
+    def withdraw(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self._last_refill) * self.min_per_sec, self.max_tokens)
+        self._last_refill = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold: int = 10, reset_timeout: float = 30.0):
+        """
+        Per chain circuit breaker. After `failure_threshold` consecutive failures the chain is failed
+        fast for `reset_timeout` seconds, then a single probe is let through (half open): success
+        closes the circuit, failure opens it again.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._probing = False
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class RetryStats:
+    def __init__(self):
+        self.retries: dict[int, int] = {}
+        self.drops: dict[int, int] = {}
+        self.short_circuits: dict[int, int] = {}
+        self.budget_exhausted = 0
+
+    @staticmethod
+    def _incr(counter: dict[int, int], _chain_id: int):
+        counter[_chain_id] = counter.get(_chain_id, 0) + 1
+
+    def retry(self, _chain_id: int):
+        self._incr(self.retries, _chain_id)
+
+    def drop(self, _chain_id: int):
+        self._incr(self.drops, _chain_id)
+
+    def short_circuit(self, _chain_id: int):
+        self._incr(self.short_circuits, _chain_id)
+
+    def summary(self) -> dict[int, dict[str, int]]:
+        ret = {}
+        for name, counter in (('retries', self.retries), ('drops', self.drops),
+                              ('short_circuits', self.short_circuits)):
+            for cid, count in counter.items():
+                ret.setdefault(cid, {'retries': 0, 'drops': 0, 'short_circuits': 0})[name] = count
+        return ret
+
+
+class RetryEngine:
+    def __init__(self, policy: RetryPolicy = None, budget: RetryBudget = None, failure_threshold: int = 10,
+                 reset_timeout: float = 30.0):
+        """
+        Bundles the retry policy, the global budget, one circuit breaker per chain and the counters
+        reported at the end of a scan
+        """
+        self.policy = policy if policy is not None else RetryPolicy()
+        self.budget = budget if budget is not None else RetryBudget()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers: dict[int, CircuitBreaker] = {}
+        self.stats = RetryStats()
+
+    def breaker(self, _chain_id: int) -> CircuitBreaker:
+        breaker = self.breakers.get(_chain_id)
+        if breaker is None:
+            breaker = self.breakers[_chain_id] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return breaker
+
+    def should_retry(self, _chain_id: int, attempt: int) -> bool:
+        """
+        :param attempt: 0 based number of the attempt that just failed
+        :return: True if another attempt is allowed (counts the retry), False if the call is dropped
+        """
+        if attempt + 1 >= self.policy.max_attempts:
+            return False
+        if not self.budget.withdraw():
+            self.stats.budget_exhausted += 1
+            return False
+        self.stats.retry(_chain_id)
+        return True
@@ -0,0 +1,116 @@
+import asyncio
+import itertools
+from typing import Any, Awaitable, Callable, Union
+
+# refused batches after which a chain's calls are always sent on their own
+MAX_REFUSALS = 3
+
+
+class RpcBatcher:
+    def __init__(self, send: Callable[[int, list[dict]], Awaitable[Union[list[dict], dict, None]]],
+                 max_batch: int = 20, window: float = 0.005):
+        """
+        Coalesce JSON-RPC calls made within `window` seconds to the same chain into one batch array,
+        then hand each caller back the response object carrying its request id. A batch answered with
+        anything but an array (an error object, or None for a bad status) is resent as single calls,
+        and a chain whose batches keep being refused while single calls succeed stops being batched.
+        :param send: coroutine function send(chain_id, payloads) -> decoded JSON response
+        :param max_batch: flush as soon as a chain has this many calls queued
+        :param window: seconds to wait for more calls before flushing a partial batch
+        """
+        self.send = send
+        self.max_batch = max_batch
+        self.window = window
+        self._ids = itertools.count(1)
+        self._pending: dict[int, list[tuple[dict, asyncio.Future]]] = {}
+        self._timers: dict[int, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._refusals: dict[int, int] = {}
+        self.unbatched: set[int] = set()
+        self.fallbacks = 0
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    async def call(self, _chain_id: int, method: str, params: list[Any]) -> Union[dict, None]:
+        """
+        Queue one call and wait for its response
+        :return: the JSON-RPC response object for this call (with either `result` or `error`), or None
+                 if the server left it out of the batch
+        """
+        loop = asyncio.get_running_loop()
+        payload = {
+            "jsonrpc": "2.0",
+            "method": method,
+            "params": params,
+            "id": self.next_id(),
+        }
+        if _chain_id in self.unbatched:
+            response = await self.send(_chain_id, payload)
+            return response if isinstance(response, dict) else None
+        fut = loop.create_future()
+        queue = self._pending.setdefault(_chain_id, [])
+        queue.append((payload, fut))
+        if len(queue) >= self.max_batch:
+            self._flush(_chain_id)
+        elif _chain_id not in self._timers:
+            self._timers[_chain_id] = loop.call_later(self.window, self._flush, _chain_id)
+        return await fut
+
+    def _flush(self, _chain_id: int):
+        timer = self._timers.pop(_chain_id, None)
+        if timer is not None:
+            timer.cancel()
+        items = self._pending.pop(_chain_id, None)
+        if items:
+            task = asyncio.create_task(self._send_batch(_chain_id, items))
+            task.add_done_callback(self._tasks.discard)
+            self._tasks.add(task)
+
+    async def _send_batch(self, _chain_id: int, items: list[tuple[dict, asyncio.Future]]):
+        try:
+            if len(items) == 1:
+                # no point wrapping a lone call in an array
+                responses = await self.send(_chain_id, items[0][0])
+            else:
+                responses = await self.send(_chain_id, [payload for payload, _ in items])
+        except Exception as err:
+            for _, fut in items:
+                if not fut.done():
+                    fut.set_exception(err)
+            return
+        if len(items) > 1 and not isinstance(responses, list):
+            await self._send_singly(_chain_id, items)
+            return
+        if isinstance(responses, dict):
+            responses = [responses]
+        by_id = {}
+        if isinstance(responses, list):
+            by_id = {resp.get('id'): resp for resp in responses if isinstance(resp, dict)}
+        for payload, fut in items:
+            if not fut.done():
+                fut.set_result(by_id.get(payload['id']))
+
+    async def _send_singly(self, _chain_id: int, items: list[tuple[dict, asyncio.Future]]):
+        """
+        Fallback for a refused batch: send every call of it on its own
+        """
+        self.fallbacks += 1
+        responses = await asyncio.gather(*[self.send(_chain_id, payload) for payload, _ in items],
+                                         return_exceptions=True)
+        answered = False
+        for (_, fut), response in zip(items, responses):
+            if fut.done():
+                continue
+            if isinstance(response, BaseException):
+                fut.set_exception(response)
+            elif isinstance(response, dict):
+                answered = answered or 'result' in response
+                fut.set_result(response)
+            else:
+                fut.set_result(None)
+        if answered:
+            # single calls go through where the batch did not
+            self._refusals[_chain_id] = self._refusals.get(_chain_id, 0) + 1
+            if self._refusals[_chain_id] >= MAX_REFUSALS:
+                self.unbatched.add(_chain_id)
@@ -0,0 +1,173 @@
+import json
+import math
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Union
+
+# results that never change once they exist
+IMMUTABLE_METHODS = {'eth_chainId', 'net_version', 'eth_getTransactionByHash', 'eth_getTransactionReceipt',
+                     'eth_getBlockByHash', 'eth_getBlockTransactionCountByHash', 'eth_getUncleCountByBlockHash',
+                     'eth_getTransactionByBlockHashAndIndex'}
+# results that only depend on the chain head
+LATEST_METHODS = {'eth_blockNumber', 'eth_gasPrice', 'eth_maxPriorityFeePerGas', 'eth_blobBaseFee'}
+# methods taking a block identifier, and its position in params
+BLOCK_PARAM = {'eth_getBalance': 1, 'eth_getCode': 1, 'eth_getTransactionCount': 1, 'eth_call': 1,
+               'eth_getStorageAt': 2, 'eth_getProof': 2, 'eth_feeHistory': 1, 'eth_getBlockByNumber': 0,
+               'eth_getBlockReceipts': 0, 'eth_getBlockTransactionCountByNumber': 0,
+               'eth_getUncleCountByBlockNumber': 0, 'eth_getTransactionByBlockNumberAndIndex': 0}
+LATEST_TAGS = {'latest', 'safe', 'finalized'}
+
+
+def block_ttl(block: Any, latest_ttl: float) -> Union[float, None]:
+    """
+    :return: math.inf for a block pinned by number or hash, `latest_ttl` for a head relative tag,
+             None for `pending` or anything unrecognized
+    """
+    if isinstance(block, int) or isinstance(block, dict):
+        # a number, or an EIP-1898 {blockHash: ...} / {blockNumber: ...} object
+        return math.inf
+    if not isinstance(block, str):
+        return None
+    if block in LATEST_TAGS:
+        return latest_ttl
+    if block == 'earliest' or block.startswith('0x'):
+        return math.inf
+    return None
+
+
+def ttl_for(method: str, params: Any, latest_ttl: float) -> Union[float, None]:
+    """
+    :return: seconds a response to this call may be served from the cache (math.inf for one that
+             can never change), or None if it must always go to the node
+    """
+    if method in IMMUTABLE_METHODS:
+        return math.inf
+    if method in LATEST_METHODS:
+        return latest_ttl
+    index = BLOCK_PARAM.get(method)
+    if index is None:
+        return None
+    params = params or []
+    # web3 always sends the block, a missing one means latest
+    return block_ttl(params[index] if len(params) > index else 'latest', latest_ttl)
+
+
+class RpcCache:
+    def __init__(self, max_entries: int = 10000, latest_ttl: float = 2.0, db_file: str = None):
+        """
+        Size bounded LRU of JSON-RPC responses keyed by (chain id, method, params). Calls whose result
+        is pinned (chain id, receipts, blocks by number or hash, state at an explicit block) are kept
+        until evicted. Head relative calls (`eth_blockNumber`, `eth_gasPrice`, state at `latest`)
+        expire after `latest_ttl`. Error responses and null results are never cached, a receipt that
+        is null now will not be later. Neither is a pending transaction (null `blockHash`), it has yet
+        to be mined and its block fields will change.
+        :param max_entries: most responses kept in memory, and on disk
+        :param latest_ttl: seconds a head relative response stays fresh, 0 to never cache them
+        :param db_file: sqlite database path to persist the pinned responses in (`rpc_cache`
+                        table), None to keep the cache in memory only
+        """
+        self.max_entries = max_entries
+        self.latest_ttl = latest_ttl
+        self.db_file = db_file
+        self.entries: OrderedDict[tuple, tuple[float, dict]] = OrderedDict()
+        self._dirty: dict[tuple, dict] = {}
+        self._touched: set[tuple] = set()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def lookup(self, _chain_id: int, method: str, params: Any) -> tuple[Union[tuple, None], float, Union[dict, None]]:
+        """
+        :return: (key, ttl, cached response or None). The key is None for a call that must not be
+                 cached, pass the rest to `put` along with the node's response
+        """
+        ttl = ttl_for(method, params, self.latest_ttl)
+        if ttl is None or ttl <= 0:
+            return None, 0.0, None
+        try:
+            key = (_chain_id, method, json.dumps(params or [], sort_keys=True, separators=(',', ':')))
+        except TypeError:
+            return None, 0.0, None
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires, response = entry
+            if expires > time.monotonic():
+                self.entries.move_to_end(key)
+                if expires == math.inf:
+                    self._touched.add(key)
+                self.hits += 1
+                return key, ttl, dict(response)
+            del self.entries[key]
+        self.misses += 1
+        return key, ttl, None
+
+    def put(self, key: tuple, ttl: float, response: Any):
+        if not isinstance(response, dict) or 'error' in response or response.get('result') is None:
+            return
+        result = response['result']
+        if key[1] == 'eth_getTransactionByHash' and (not isinstance(result, dict) or result.get('blockHash') is None):
+            return
+        self.entries[key] = (time.monotonic() + ttl, response)
+        self.entries.move_to_end(key)
+        if ttl == math.inf and self.db_file is not None:
+            self._dirty[key] = response
+        while len(self.entries) > self.max_entries:
+            old, _ = self.entries.popitem(last=False)
+            self._dirty.pop(old, None)
+            self.evicted += 1
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_file)
+        conn.execute('CREATE TABLE IF NOT EXISTS rpc_cache (chain_id INTEGER, method TEXT, params TEXT, '
+                     'response TEXT, last_used REAL, PRIMARY KEY (chain_id, method, params)) WITHOUT ROWID')
+        return conn
+
+    def load(self) -> int:
+        """
+        Load the most recently used pinned responses (blocking, run it in a thread)
+        :return: number of responses loaded
+        """
+        if self.db_file is None:
+            return 0
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT chain_id, method, params, response FROM rpc_cache ORDER BY last_used DESC '
+                                'LIMIT ?', (self.max_entries,)).fetchall()
+        finally:
+            conn.close()
+        # oldest first, so the LRU order matches the stored one
+        for _chain_id, method, params, response in reversed(rows):
+            self.entries[(_chain_id, method, params)] = (math.inf, json.loads(response))
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return len(rows)
+
+    def flush(self) -> int:
+        """
+        Write the pinned responses fetched this run and bump the ones served from disk, then trim the
+        table to `max_entries` (blocking, run it in a thread)
+        :return: number of responses written
+        """
+        if self.db_file is None or not (self._dirty or self._touched):
+            return 0
+        now = time.time()
+        rows = [key + (json.dumps(response), now) for key, response in self._dirty.items()]
+        touched = [(now,) + key for key in self._touched if key not in self._dirty]
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO rpc_cache (chain_id, method, params, response, last_used) '
+                                 'VALUES (?, ?, ?, ?, ?)', rows)
+                conn.executemany('UPDATE rpc_cache SET last_used = ? WHERE chain_id = ? AND method = ? AND params = ?',
+                                 touched)
+                excess = conn.execute('SELECT COUNT(*) FROM rpc_cache').fetchone()[0] - self.max_entries
+                if excess > 0:
+                    conn.execute('DELETE FROM rpc_cache WHERE (chain_id, method, params) IN '
+                                 '(SELECT chain_id, method, params FROM rpc_cache ORDER BY last_used LIMIT ?)',
+                                 (excess,))
+        finally:
+            conn.close()
+        self._dirty.clear()
+        self._touched.clear()
+        return len(rows)
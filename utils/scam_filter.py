@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+from array import array
+from typing import Union
+
+from data.constants import SCAM_FILTER_CACHE, SCAM_TOKENS_FILE, USER_SCAM_FILE
+
+_MAGIC = b'SCAM1\n'
+# chain id used for entries of the user list, which apply on every chain
+ANY_CHAIN = 0
+
+
+def token_hash(_chain_id: int, address: str) -> int:
+    """
+    :return: 64 bit blake2b digest of a (chain id, lowercase address) pair
+    """
+    digest = hashlib.blake2b(b'%d:%s' % (_chain_id, address.lower().encode()), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class ScamFilter:
+    def __init__(self, tokens_file: str = SCAM_TOKENS_FILE, user_file: str = USER_SCAM_FILE,
+                 cache_file: Union[str, None] = SCAM_FILTER_CACHE):
+        """
+        Known scam / spam airdrop tokens, compiled once into a set of 64 bit hashes. `tokens_file` is
+        the shipped {"tokens": [{"address", "chainId"}]} blacklist, `user_file` a plain list of
+        addresses blocked on every chain. The compiled set is cached to `cache_file` and rebuilt only
+        when a source list changes.
+        :param tokens_file: json blacklist
+        :param user_file: one address per line
+        :param cache_file: compiled filter, or None to always compile in memory
+        """
+        self.tokens_file = tokens_file
+        self.user_file = user_file
+        self.cache_file = cache_file
+        self._hashes: set[int] = set()
+        self.dropped = 0
+
+    def _signature(self) -> bytes:
+        h = hashlib.blake2b(digest_size=16)
+        for path in (self.tokens_file, self.user_file):
+            if path is not None and os.path.exists(path):
+                st = os.stat(path)
+                h.update(b'%s:%d:%d;' % (path.encode(), st.st_size, st.st_mtime_ns))
+        return h.digest()
+
+    def _compile(self) -> array:
+        hashes = array('Q')
+        if self.tokens_file is not None and os.path.exists(self.tokens_file):
+            with open(self.tokens_file, 'r') as f:
+                for token in json.load(f).get('tokens', []):
+                    hashes.append(token_hash(int(token['chainId']), token['address']))
+        if self.user_file is not None and os.path.exists(self.user_file):
+            with open(self.user_file, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        hashes.append(token_hash(ANY_CHAIN, line))
+        return hashes
+
+    def _read_cache(self, signature: bytes) -> Union[array, None]:
+        if self.cache_file is None or not os.path.exists(self.cache_file):
+            return None
+        with open(self.cache_file, 'rb') as f:
+            blob = f.read()
+        header = _MAGIC + signature
+        if not blob.startswith(header):
+            return None
+        hashes = array('Q')
+        hashes.frombytes(blob[len(header):])
+        return hashes
+
+    def _write_cache(self, signature: bytes, hashes: array):
+        tmp = self.cache_file + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(_MAGIC + signature)
+            f.write(hashes.tobytes())
+        os.replace(tmp, self.cache_file)
+
+    def load(self) -> int:
+        """
+        Load the compiled filter, compiling (and caching) it first if the source lists changed
+        :return: number of blocked entries
+        """
+        signature = self._signature()
+        hashes = self._read_cache(signature)
+        if hashes is None:
+            hashes = self._compile()
+            if self.cache_file is not None:
+                self._write_cache(signature, hashes)
+        self._hashes = set(hashes)
+        return len(self._hashes)
+
+    def is_scam(self, _chain_id: int, address: str) -> bool:
+        return token_hash(int(_chain_id), address) in self._hashes or token_hash(ANY_CHAIN, address) in self._hashes
+
+    def filter(self, tokens: list[dict], _chain_id: int) -> list[dict]:
+        """
+        :param tokens: `particle_getTokens` token entries
+        :return: the entries that are not known scam tokens
+        """
+        kept = [token for token in tokens if not self.is_scam(_chain_id, token.get('address'))]
+        self.dropped += len(tokens) - len(kept)
+        return kept
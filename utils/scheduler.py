@@ -0,0 +1,161 @@
+import asyncio
+import time
+from typing import Any, AsyncIterable, Awaitable, Callable, Iterable, Union
+
+from utils import metrics
+from utils.errors import WriterFailed
+from utils.helpers import Acct
+from utils.limiter import AimdLimiter, PrioritySemaphore
+
+
+class ChainScheduler:
+    def __init__(self, chain_ids: list[int], global_limit: int = 100, per_chain_limit: int = 20,
+                 queue_size: int = None, skip: Callable[[Acct, int], bool] = None,
+                 weights: dict[int, float] = None, limiter_for: Callable[[int], AimdLimiter] = None):
+        """
+        Interleave (account, chain) work items across every chain at once. Each chain gets its own
+        queue and pool of workers bounded by `per_chain_limit`, and every unit of work must also hold
+        a slot of the shared `global_limit` while it runs, so a slow chain can never hold more than
+        its own share of the in-flight budget.
+        :param chain_ids: chains to scan
+        :param global_limit: maximum units in flight across all chains
+        :param per_chain_limit: maximum units in flight on any single chain
+        :param queue_size: pending units buffered per chain (defaults to 1000, or 2x the per chain
+                           limit if larger), the slack a fast chain gets ahead of the slowest one
+        :param skip: optional predicate skip(acct, chain_id), units it returns True for are never queued
+        :param weights: optional {chain_id: weight in (0, 1]}, the priority of a chain's units for a free
+                        global slot (default 1). Weights only order contended slots, every chain keeps
+                        `per_chain_limit` workers, so a low weight never throttles a chain that has idle
+                        budget to use. Chains are also fed in the order given.
+        :param limiter_for: optional limiter_for(chain_id) -> AimdLimiter. Every unit then also holds a slot
+                            of its chain's limiter, whose limit adapts to the endpoint between 1 and
+                            `per_chain_limit`: finished units are its successes, the api reports 429s, 5xx
+                            and transport errors as congestion.
+        """
+        # duplicate chain ids (ie 321 is listed as both kcc and platon) would double scan a chain
+        self.chain_ids = list(dict.fromkeys(chain_ids))
+        self.global_limit = global_limit
+        self.per_chain_limit = min(per_chain_limit, global_limit)
+        self.queue_size = queue_size if queue_size is not None else max(self.per_chain_limit * 2, 1000)
+        self.global_sem = PrioritySemaphore(global_limit)
+        self.weights: dict[int, float] = weights or {}
+        self.queues: dict[int, asyncio.Queue] = {cid: asyncio.Queue(self.queue_size) for cid in self.chain_ids}
+        self.workers: set[asyncio.Task] = set()
+        self.in_flight: dict[int, int] = {cid: 0 for cid in self.chain_ids}
+        self.completed: dict[int, int] = {cid: 0 for cid in self.chain_ids}
+        self.errors: dict[int, int] = {cid: 0 for cid in self.chain_ids}
+        self.skip = skip
+        self.skipped = 0
+        self.limiter_for = limiter_for
+
+    async def _run_unit(self, acct: Acct, cid: int, handler: Callable[[Acct, int], Awaitable[Any]],
+                        limiter: AimdLimiter = None) -> Any:
+        await self.global_sem.acquire(self.weights.get(cid, 1.0))
+        self.in_flight[cid] += 1
+        # timed from the global slot on, waiting for the budget is not the endpoint's latency
+        started = time.monotonic()
+        try:
+            result = await handler(acct, cid)
+        except WriterFailed:
+            # results can no longer be saved, every unit after this one would be lost too
+            raise
+        except Exception:
+            # one bad unit must not take down the chain's worker
+            self.errors[cid] += 1
+            return None
+        finally:
+            self.in_flight[cid] -= 1
+            self.global_sem.release()
+        if limiter is not None and result is not None:
+            limiter.success(time.monotonic() - started)
+        return result
+
+    async def _worker(self, cid: int, handler: Callable[[Acct, int], Awaitable[Any]],
+                      on_done: Callable[[Acct, int, Any], Union[Awaitable[None], None]] = None):
+        queue = self.queues[cid]
+        while True:
+            acct = await queue.get()
+            metrics.QUEUE_DEPTH.set(cid, value=queue.qsize())
+            try:
+                if acct is None:
+                    return
+                limiter = self.limiter_for(cid) if self.limiter_for is not None else None
+                if limiter is None:
+                    result = await self._run_unit(acct, cid, handler)
+                else:
+                    async with limiter:
+                        result = await self._run_unit(acct, cid, handler, limiter)
+                self.completed[cid] += 1
+                if on_done is not None:
+                    ret = on_done(acct, cid, result)
+                    if asyncio.iscoroutine(ret):
+                        await ret
+            finally:
+                queue.task_done()
+
+    def start(self, handler: Callable[[Acct, int], Awaitable[Any]],
+              on_done: Callable[[Acct, int, Any], Union[Awaitable[None], None]] = None):
+        """
+        Spawn the per chain workers
+        :param handler: coroutine function called as handler(acct, chain_id)
+        :param on_done: optional callback (or coroutine function) called with (acct, chain_id, result)
+        """
+        for cid in self.chain_ids:
+            for _ in range(self.per_chain_limit):
+                task = asyncio.create_task(self._worker(cid, handler, on_done))
+                task.add_done_callback(self.workers.discard)
+                self.workers.add(task)
+
+    async def submit(self, acct: Acct):
+        """
+        Queue one account on every chain. Blocks while the slowest chain's queue is full, which
+        keeps memory bounded without stalling the other chains' workers.
+        :param acct: account to scan
+        """
+        for cid in self.chain_ids:
+            if self.skip is not None and self.skip(acct, cid):
+                self.skipped += 1
+                continue
+            await self.queues[cid].put(acct)
+
+    async def feed(self, accounts: Union[Iterable[Acct], AsyncIterable[Acct]]):
+        if hasattr(accounts, '__aiter__'):
+            async for acct in accounts:
+                if acct is not None:
+                    await self.submit(acct)
+        else:
+            for acct in accounts:
+                if acct is not None:
+                    await self.submit(acct)
+
+    async def join(self):
+        """
+        Wait for every queued unit to finish, then stop the workers
+        """
+        for cid in self.chain_ids:
+            for _ in range(self.per_chain_limit):
+                await self.queues[cid].put(None)
+        await asyncio.gather(*self.workers)
+
+    async def _feed_and_join(self, accounts: Union[Iterable[Acct], AsyncIterable[Acct]]):
+        await self.feed(accounts)
+        await self.join()
+
+    async def run(self, accounts: Union[Iterable[Acct], AsyncIterable[Acct]], handler: Callable[[Acct, int], Awaitable[Any]],
+                  on_done: Callable[[Acct, int, Any], Union[Awaitable[None], None]] = None):
+        """
+        Scan every account on every chain. A worker only dies on an exception from `on_done` (or a
+        WriterFailed from `handler`), that aborts the run and is raised here, rather than leaving the
+        feeder blocked on the dead worker's queue.
+        """
+        self.start(handler, on_done)
+        feeder = asyncio.create_task(self._feed_and_join(accounts))
+        try:
+            done, _ = await asyncio.wait([feeder, *self.workers], return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if not task.cancelled() and task.exception() is not None:
+                    raise task.exception()
+        finally:
+            feeder.cancel()
+            for task in list(self.workers):
+                task.cancel()
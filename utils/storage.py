@@ -0,0 +1,224 @@
+import asyncio
+import queue
+import sqlite3
+import threading
+import time
+from typing import Union
+
+from data.constants import TOKENS_DB, ZERO_ADDRESS
+from utils.errors import WriterFailed
+
+_CLOSE = object()
+
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS contracts (
+        chain_id INTEGER,
+        contract_address TEXT,
+        decimals INTEGER,
+        symbol TEXT,
+        name TEXT,
+        PRIMARY KEY (chain_id, contract_address)
+    ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS accounts (
+        address TEXT PRIMARY KEY,
+        key TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS account_tokens (
+        account_address TEXT,
+        chain_id INTEGER,
+        contract_address TEXT,
+        amount TEXT,
+        balance REAL,
+        updated INTEGER,
+        PRIMARY KEY (account_address, chain_id, contract_address),
+        FOREIGN KEY (chain_id, contract_address) REFERENCES contracts (chain_id, contract_address)
+    ) WITHOUT ROWID''',
+    # the primary key already serves lookups by account_address (its leading column)
+    'CREATE INDEX IF NOT EXISTS account_tokens_contract ON account_tokens (chain_id, contract_address)',
+)
+
+UPSERT_ACCOUNT = ('INSERT INTO accounts (address, key) VALUES (?, ?) '
+                  'ON CONFLICT (address) DO UPDATE SET key = excluded.key')
+UPSERT_CONTRACT = ('INSERT INTO contracts (chain_id, contract_address, decimals) VALUES (?, ?, ?) '
+                   'ON CONFLICT (chain_id, contract_address) DO UPDATE SET decimals = excluded.decimals')
+UPSERT_HOLDING = ('INSERT INTO account_tokens (account_address, chain_id, contract_address, amount, balance, updated) '
+                  'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (account_address, chain_id, contract_address) DO UPDATE SET '
+                  'amount = excluded.amount, balance = excluded.balance, updated = excluded.updated')
+
+
+def _primary_key(conn: sqlite3.Connection, table: str) -> list[str]:
+    cols = conn.execute('PRAGMA table_info(%s)' % table).fetchall()
+    return [c[1] for c in sorted(cols, key=lambda c: c[5]) if c[5]]
+
+
+def _has(conn: sqlite3.Connection, table: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+
+def migrate(conn: sqlite3.Connection):
+    """
+    Bring the tokens db to the current schema. The original tables keyed contracts and holdings by
+    contract address alone, so the same address on two chains collided; those tables are rebuilt
+    with chain aware keys and their rows copied over. Token symbol and name columns are added to
+    contracts for the token registry.
+    """
+    with conn:
+        if _has(conn, 'contracts') and _primary_key(conn, 'contracts') != ['chain_id', 'contract_address']:
+            conn.execute('ALTER TABLE contracts RENAME TO contracts_old')
+        if _has(conn, 'account_tokens') and 'chain_id' not in _primary_key(conn, 'account_tokens'):
+            conn.execute('ALTER TABLE account_tokens RENAME TO account_tokens_old')
+        for statement in SCHEMA:
+            conn.execute(statement)
+        if _has(conn, 'contracts_old'):
+            conn.execute('INSERT OR IGNORE INTO contracts (chain_id, contract_address, decimals) '
+                         'SELECT CAST(chain_id AS INTEGER), contract_address, decimals FROM contracts_old')
+            conn.execute('DROP TABLE contracts_old')
+        columns = {c[1] for c in conn.execute('PRAGMA table_info(contracts)')}
+        for column in ('symbol', 'name'):
+            if column not in columns:
+                conn.execute('ALTER TABLE contracts ADD COLUMN %s TEXT' % column)
+        if _has(conn, 'account_tokens_old'):
+            conn.execute('INSERT OR IGNORE INTO account_tokens (account_address, chain_id, contract_address, balance) '
+                         'SELECT account_address, CAST(chain_id AS INTEGER), contract_address, balance '
+                         'FROM account_tokens_old')
+            conn.execute('DROP TABLE account_tokens_old')
+
+
+class SqliteStore:
+    def __init__(self, db_file: str = TOKENS_DB, batch_size: int = 5000, flush_interval: float = 1.0):
+        """
+        Incremental storage of scan results in the `accounts`, `contracts` and `account_tokens` tables
+        of the tokens db. `write` only enqueues; a dedicated thread owns the write connection (WAL
+        mode) and applies whole batches of wallets as executemany upserts in a single transaction, so
+        a multi million holding scan is persisted as it runs and can be queried without loading it.
+        If the thread fails (locked or full disk, a malformed result) the error is kept and raised as
+        WriterFailed by the next `write` and by `close`.
+        :param db_file: sqlite database path
+        :param batch_size: wallet results per transaction
+        :param flush_interval: seconds, max age of a queued result
+        """
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.error: Union[BaseException, None] = None
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+        self._read_conn: Union[sqlite3.Connection, None] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def start(self):
+        conn = self._connect()
+        try:
+            migrate(conn)
+        finally:
+            conn.close()
+        self._thread.start()
+
+    def write(self, result: dict, _chain_id: int):
+        """
+        Queue one wallet result ({'key', 'address', 'result'}). It must not be mutated afterwards.
+        :raises WriterFailed: the writer thread died, nothing more can be stored
+        """
+        self.check()
+        self._queue.put((result, int(_chain_id)))
+
+    def check(self):
+        if self.error is not None:
+            raise WriterFailed('Writing %s failed: %r' % (self.db_file, self.error)) from self.error
+
+    @staticmethod
+    def _rows(batch: list[tuple[dict, int]]) -> tuple[list, list, list]:
+        now = int(time.time())
+        accounts, contracts, holdings = {}, {}, []
+        for result, cid in batch:
+            address = result['address']
+            accounts[address] = result.get('key')
+            native = int(result['result'].get('native'))
+            held = [(ZERO_ADDRESS, native, 18)] if native > 0 else []
+            held.extend((t.get('address'), int(t.get('amount')), int(t.get('decimals') or 0))
+                        for t in result['result'].get('tokens'))
+            for token, amount, decimals in held:
+                if amount <= 0:
+                    continue
+                contracts[(cid, token)] = decimals
+                holdings.append((address, cid, token, str(amount), amount / (10 ** decimals), now))
+        return (list(accounts.items()), [(c, t, d) for (c, t), d in contracts.items()], holdings)
+
+    def _apply(self, conn: sqlite3.Connection, batch: list[tuple[dict, int]]):
+        accounts, contracts, holdings = self._rows(batch)
+        with conn:
+            conn.executemany(UPSERT_ACCOUNT, accounts)
+            conn.executemany(UPSERT_CONTRACT, contracts)
+            conn.executemany(UPSERT_HOLDING, holdings)
+        self.written += len(batch)
+
+    def _run(self):
+        try:
+            self._write_loop()
+        except BaseException as err:
+            self.error = err
+
+    def _write_loop(self):
+        conn = self._connect()
+        try:
+            closing = False
+            while not closing:
+                try:
+                    item = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    continue
+                batch = []
+                while True:
+                    if item is _CLOSE:
+                        closing = True
+                        break
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                if batch:
+                    self._apply(conn, batch)
+        finally:
+            conn.close()
+
+    async def close(self):
+        """
+        Flush and stop the thread
+        :raises WriterFailed: the writer thread died, results written after the failure were not stored
+        """
+        if self._thread.is_alive():
+            self._queue.put(_CLOSE)
+            await asyncio.to_thread(self._thread.join)
+        if self._read_conn is not None:
+            self._read_conn.close()
+            self._read_conn = None
+        self.check()
+
+    @property
+    def read_conn(self) -> sqlite3.Connection:
+        if self._read_conn is None:
+            self._read_conn = self._connect()
+        return self._read_conn
+
+    def wallet(self, address: str) -> list[tuple[int, str, str, float]]:
+        """
+        :return: list of (chain_id, contract_address, raw amount, balance) held by an address
+        """
+        return self.read_conn.execute('SELECT chain_id, contract_address, amount, balance FROM account_tokens '
+                                      'WHERE account_address = ?', (address,)).fetchall()
+
+    def holders(self, _chain_id: int, token: str) -> list[tuple[str, str, float]]:
+        """
+        :return: list of (account_address, raw amount, balance) holding a token on a chain
+        """
+        return self.read_conn.execute('SELECT account_address, amount, balance FROM account_tokens '
+                                      'WHERE chain_id = ? AND contract_address = ?', (_chain_id, token)).fetchall()
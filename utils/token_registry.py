@@ -0,0 +1,137 @@
+import sqlite3
+from array import array
+from typing import Hashable, Union
+
+from data.constants import ZERO_ADDRESS
+from utils.storage import migrate
+
+UPSERT_METADATA = ('INSERT INTO contracts (chain_id, contract_address, decimals, symbol, name) VALUES (?, ?, ?, ?, ?) '
+                   'ON CONFLICT (chain_id, contract_address) DO UPDATE SET decimals = excluded.decimals, '
+                   'symbol = excluded.symbol, name = excluded.name')
+# ERC-20 decimals are a uint8, and the registry stores them in an array('B')
+MAX_DECIMALS = 255
+
+
+class Interner:
+    __slots__ = ('ids', 'values')
+
+    def __init__(self):
+        """
+        Map hashable values to dense integer ids, each value is stored once
+        """
+        self.ids: dict[Hashable, int] = {}
+        self.values: list = []
+
+    def intern(self, value: Hashable) -> int:
+        idx = self.ids.get(value)
+        if idx is None:
+            idx = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return idx
+
+    def get(self, value: Hashable) -> Union[int, None]:
+        return self.ids.get(value)
+
+    def __getitem__(self, idx: int):
+        return self.values[idx]
+
+    def __len__(self):
+        return len(self.values)
+
+
+class TokenRegistry(Interner):
+    __slots__ = ('decimals', 'symbols', 'names', 'db_file', '_dirty')
+
+    def __init__(self, db_file: str = None):
+        """
+        Per chain token metadata, interned once. Every (chain id, token) pair gets a dense id that
+        holdings refer to, decimals live in a typed array indexed by that id and symbol / name are
+        kept next to it, so nothing is repeated per wallet. With a `db_file` the registry is warm
+        loaded from, and written back to, the `contracts` table of that db.
+        :param db_file: sqlite database path, or None for an in memory registry
+        """
+        super().__init__()
+        self.decimals = array('B')
+        self.symbols: list[Union[str, None]] = []
+        self.names: list[Union[str, None]] = []
+        self.db_file = db_file
+        self._dirty: set[int] = set()
+
+    def intern(self, value: tuple[int, str]) -> int:
+        idx = self.ids.get(value)
+        if idx is None:
+            idx = self.ids[value] = len(self.values)
+            self.values.append(value)
+            self.decimals.append(18 if value[1] == ZERO_ADDRESS else 0)
+            self.symbols.append(None)
+            self.names.append(None)
+        return idx
+
+    def register(self, _chain_id: int, token: str, decimals: int = None, symbol: str = None,
+                 name: str = None) -> int:
+        """
+        Intern a token, filling in (or correcting) whatever metadata is given
+        :return: token id
+        :raises ValueError: decimals outside 0 to MAX_DECIMALS, nothing is interned then
+        """
+        if decimals is not None and not 0 <= decimals <= MAX_DECIMALS:
+            raise ValueError('Token %s on chain %s reports %s decimals' % (token, _chain_id, decimals))
+        idx = self.intern((int(_chain_id), token))
+        if decimals is not None and self.decimals[idx] != decimals:
+            self.decimals[idx] = decimals
+            self._dirty.add(idx)
+        if symbol is not None and self.symbols[idx] != symbol:
+            self.symbols[idx] = symbol
+            self._dirty.add(idx)
+        if name is not None and self.names[idx] != name:
+            self.names[idx] = name
+            self._dirty.add(idx)
+        return idx
+
+    def metadata(self, _chain_id: int, token: str) -> Union[dict, None]:
+        """
+        :return: {'decimals', 'symbol', 'name'} or None for an unknown token
+        """
+        idx = self.ids.get((int(_chain_id), token))
+        if idx is None:
+            return None
+        return {'decimals': self.decimals[idx], 'symbol': self.symbols[idx], 'name': self.names[idx]}
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_file)
+        migrate(conn)
+        return conn
+
+    def load(self) -> int:
+        """
+        Bulk load every known token from the contracts table (blocking, run it in a thread)
+        :return: number of tokens loaded
+        """
+        if self.db_file is None:
+            return 0
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT chain_id, contract_address, decimals, symbol, name FROM contracts').fetchall()
+        finally:
+            conn.close()
+        for _chain_id, token, decimals, symbol, name in rows:
+            self.register(_chain_id, token, decimals, symbol, name)
+        self._dirty.clear()
+        return len(rows)
+
+    def flush(self) -> int:
+        """
+        Write new or changed tokens back to the contracts table (blocking, run it in a thread)
+        :return: number of tokens written
+        """
+        if self.db_file is None or not self._dirty:
+            return 0
+        dirty, self._dirty = self._dirty, set()
+        rows = [(*self.values[i], self.decimals[i], self.symbols[i], self.names[i]) for i in sorted(dirty)]
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(UPSERT_METADATA, rows)
+        finally:
+            conn.close()
+        return len(rows)
@@ -0,0 +1,76 @@
+"""
+One process wide httpx connection pool shared by ParticleApi, CustomParticleProvider and
+AsyncHttpClient, so keep-alive connections (and their TLS handshakes) are reused by everything
+instead of every client opening its own.
+"""
+import asyncio
+from typing import Union
+
+import httpx
+
+try:
+    import h2  # noqa: F401 - httpx only needs it importable to speak HTTP/2
+except ImportError:
+    HTTP2_AVAILABLE = False
+else:
+    HTTP2_AVAILABLE = True
+
+_client: Union[httpx.AsyncClient, None] = None
+_settings = {
+    'http2': True,
+    'max_connections': 200,
+    'max_keepalive_connections': 100,
+    'keepalive_expiry': 30.0,
+    'timeout': 60.0,
+}
+
+
+def configure(**settings):
+    """
+    Change the pool settings, must be called before the first `get_client()`
+    :param settings: http2, max_connections, max_keepalive_connections, keepalive_expiry, timeout
+    """
+    for key in settings:
+        if key not in _settings:
+            raise ValueError('Unknown transport setting: %s' % key)
+    _settings.update(settings)
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    :return: the shared client, created on first use
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        limits = httpx.Limits(max_connections=_settings['max_connections'],
+                              max_keepalive_connections=_settings['max_keepalive_connections'],
+                              keepalive_expiry=_settings['keepalive_expiry'])
+        _client = httpx.AsyncClient(http2=_settings['http2'] and HTTP2_AVAILABLE, limits=limits,
+                                    timeout=_settings['timeout'])
+    return _client
+
+
+async def warm(urls: list[str], connections: int = 4):
+    """
+    Open connections up front so TLS handshakes are paid once at startup. Over HTTP/2 a single
+    connection per host is multiplexed, so only one request per url is sent.
+    :param urls: one url per host to warm
+    :param connections: connections to open per host over HTTP/1.1
+    """
+    client = get_client()
+    per_host = 1 if (_settings['http2'] and HTTP2_AVAILABLE) else connections
+
+    async def touch(url: str):
+        try:
+            await client.head(url, timeout=5)
+        except httpx.HTTPError:
+            pass
+
+    await asyncio.gather(*[touch(url) for url in urls for _ in range(per_host)])
+
+
+async def aclose():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,109 @@
+from typing import Iterator, Sequence
+
+import numpy as np
+
+from utils.holdings import HoldingsStore
+
+_TWO_64 = float(1 << 64)
+
+
+class Valuation:
+    __slots__ = ('balances', 'values', 'address_totals', 'address_rows', 'chain_totals', 'token_totals')
+
+    def __init__(self, balances: np.ndarray, values: np.ndarray, address_totals: np.ndarray,
+                 address_rows: np.ndarray, chain_totals: np.ndarray, token_totals: np.ndarray):
+        """
+        Result of a valuation pass. `balances` and `values` are parallel to the holdings rows, the
+        totals are indexed by the store's interned address, chain and token ids.
+        """
+        self.balances = balances
+        self.values = values
+        self.address_totals = address_totals
+        self.address_rows = address_rows
+        self.chain_totals = chain_totals
+        self.token_totals = token_totals
+
+    @classmethod
+    def empty(cls) -> 'Valuation':
+        z = np.zeros(0, dtype=np.float64)
+        return cls(z, z, z, np.zeros(0, dtype=np.int64), z, z)
+
+    @property
+    def total(self) -> float:
+        return float(self.values.sum())
+
+
+def raw_amounts(store: HoldingsStore) -> np.ndarray:
+    """
+    :return: float64 raw amounts rebuilt from the hi/lo uint64 columns (plus the wide amount spill)
+    """
+    lo = np.frombuffer(store.amount_lo, dtype=np.uint64).astype(np.float64)
+    hi = np.frombuffer(store.amount_hi, dtype=np.uint64).astype(np.float64)
+    amounts = hi * _TWO_64 + lo
+    for row, amount in store.amount_big.items():
+        amounts[row] = float(amount)
+    return amounts
+
+
+def value_holdings(store: HoldingsStore, token_prices: Sequence[float]) -> Valuation:
+    """
+    Value every row of the store in one vectorized pass: the price table is joined to the rows
+    through the interned token ids, and per address, chain and token totals are reduced with
+    bincount, so no Python code runs per holding.
+    :param store: holdings
+    :param token_prices: usd price per interned token id (0 when unpriced)
+    """
+    rows = len(store)
+    if not rows:
+        return Valuation.empty()
+    addr_idx = np.frombuffer(store.addr_idx, dtype=np.uint32)
+    chain_idx = np.frombuffer(store.chain_idx, dtype=np.uint16)
+    token_idx = np.frombuffer(store.token_idx, dtype=np.uint32)
+    decimals = np.frombuffer(store.tokens.decimals, dtype=np.uint8)[token_idx]
+
+    balances = raw_amounts(store) * np.power(10.0, -decimals.astype(np.float64))
+    prices = np.asarray(token_prices, dtype=np.float64)
+    values = balances * prices[token_idx]
+
+    return Valuation(
+        balances=balances,
+        values=values,
+        address_totals=np.bincount(addr_idx, weights=values, minlength=len(store.addresses)),
+        address_rows=np.bincount(addr_idx, minlength=len(store.addresses)),
+        chain_totals=np.bincount(chain_idx, weights=values, minlength=len(store.chains)),
+        token_totals=np.bincount(token_idx, weights=values, minlength=len(store.tokens)),
+    )
+
+
+def report_entries(store: HoldingsStore, valuation: Valuation, token_prices: Sequence[float]) -> Iterator[dict]:
+    """
+    Yield one report entry per (wallet, chain) from an existing valuation. Balances and values are
+    read from `valuation` and prices from the same table it was computed with, so the report can
+    never disagree with the totals. A wallet's rows for one chain are appended together, each
+    contiguous run of (address, chain) rows is one entry.
+    :param store: holdings
+    :param valuation: value_holdings(store, token_prices)
+    :param token_prices: usd price per interned token id
+    """
+    rows = len(store)
+    if not rows:
+        return
+    addr_idx = np.frombuffer(store.addr_idx, dtype=np.uint32)
+    chain_idx = np.frombuffer(store.chain_idx, dtype=np.uint16)
+    unit = (addr_idx.astype(np.int64) << 16) | chain_idx
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(unit)) + 1, [rows])).tolist()
+    tokens = store.tokens
+    token_idx = store.token_idx
+    balances = valuation.balances.tolist()
+    values = valuation.values.tolist()
+    prices = np.asarray(token_prices, dtype=np.float64).tolist()
+    for start, end in zip(starts, starts[1:]):
+        entry_tokens = []
+        for row in range(start, end):
+            t = token_idx[row]
+            entry_tokens.append({'address': tokens[t][1], 'symbol': tokens.symbols[t], 'name': tokens.names[t],
+                                 'amount': store.amount(row), 'decimals': tokens.decimals[t], 'price': prices[t],
+                                 'balance': balances[row], 'value': values[row]})
+        a = store.addr_idx[start]
+        yield {'address': store.addresses[a], 'key': store.keys[a], 'cid': store.chains[store.chain_idx[start]],
+               'tokens': entry_tokens, 'value': sum(values[start:end])}